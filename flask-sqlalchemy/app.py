@@ -1,4 +1,13 @@
 #!/usr/bin/env python3
+'''The Flask app.
+
+`create_app` doesn't connect to the database or create its schema (see
+`migrate.py`), so it's quick and safe to call in a pre-forking server's master
+process. Each worker opens its own connections on its first request.
+
+    flask --app app init-db
+    gunicorn --preload --workers 4 'app:create_app()'
+'''
 
 import jwt
 import os
@@ -7,54 +16,106 @@ from flask import Flask
 from flask_restx import Api
 from flask_jwt_extended import JWTManager
 
-from session import session
-
-app = Flask(__name__)
-
-app.config.update(
-    PROPAGATE_EXCEPTIONS = True,
-    SECRET_KEY = os.getenv('SECRET_KEY'),
-    JWT_SECRET_KEY = os.getenv('SECRET_KEY'),
-    JWT_TOKEN_LOCATION = ['cookies'],
-    JWT_COOKIE_CSRF_PROTECT = True,
-    JWT_CSRF_CHECK_FORM = True
-)
+import export
+import hashing
+import instrument
+import migrate
 
-api = Api(app,
-          version='0.5',
-          title='Honk',
-          description='Honk API',
-          errors=Flask.errorhandler)
-
-jwt_manager = JWTManager(app)
+from encoding import output_json
+from identity import load_identity
+from session import session
 
 from user import api as user_api
 from auth import api as auth_api
 from suggestion import api as suggestion_api
 from post import api as post_api
+from metrics import api as metrics_api
+from export import api as export_api
+
+def create_app(config=None):
+    '''Create the app, with `config` overriding the settings from the
+    environment.'''
+
+    app = Flask(__name__)
+
+    app.config.update(
+        PROPAGATE_EXCEPTIONS = True,
+        SECRET_KEY = os.getenv('SECRET_KEY'),
+        JWT_SECRET_KEY = os.getenv('SECRET_KEY'),
+        JWT_TOKEN_LOCATION = ['cookies'],
+        JWT_COOKIE_CSRF_PROTECT = True,
+        JWT_CSRF_CHECK_FORM = True,
+        QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', 10)),
+        QUERY_REPEAT_LIMIT = int(os.getenv('QUERY_REPEAT_LIMIT', 2)),
+        QUERY_STRICT = os.getenv('QUERY_STRICT') != None,
+        POST_WRITE_BEHIND = os.getenv('POST_WRITE_BEHIND') != None,
+        ADMIN_USER_IDS = {int(id) for id in
+                          os.getenv('ADMIN_USER_IDS', '').split(',')
+                          if id.strip() != ''}
+    )
+
+    if config != None:
+        app.config.update(config)
+
+    instrument.init_app(app)
+
+    api = Api(app,
+              version='0.5',
+              title='Honk',
+              description='Honk API',
+              errors=Flask.errorhandler)
+
+    api.representation('application/json')(output_json)
+
+    jwt_manager = JWTManager(app)
+
+    # Without a target the cost stays at `hashing.cost` (14 unless
+    # `BCRYPT_COST` is set).
+    if os.getenv('BCRYPT_TARGET_SECONDS'):
+        hashing.calibrate(float(os.getenv('BCRYPT_TARGET_SECONDS')))
+
+    @api.errorhandler(hashing.HashingBusy)
+    def hashing_busy_handler(error):
+        return {
+            'status': 'fail',
+            'message': 'The server is busy; please try again shortly'
+        }, 503
+
+    api.add_namespace(user_api)
+    api.add_namespace(auth_api)
+    api.add_namespace(suggestion_api)
+    api.add_namespace(post_api)
+    api.add_namespace(metrics_api)
+    api.add_namespace(export_api)
+
+    @jwt_manager.user_identity_loader
+    def user_identity_lookup(user):
+        return user.id
 
-api.add_namespace(user_api)
-api.add_namespace(auth_api)
-api.add_namespace(suggestion_api)
-api.add_namespace(post_api)
+    # `current_user` is an `identity.Identity`, not a `User`. See `identity.py`.
+    @jwt_manager.user_lookup_loader
+    def user_lookup_callback(jwt_header, jwt_payload):
+        id = jwt_payload['sub']
+        return load_identity(id)
 
-@jwt_manager.user_identity_loader
-def user_identity_lookup(user):
-    return user.id
+    @app.teardown_appcontext
+    def remove_session(exception=None):
+        session.remove()
 
-from model import User
+    @jwt_manager.expired_token_loader
+    def expired_signature_error_handler(jwt_header, jwt_payload):
+        return {
+            'status': 'fail',
+            'message': 'Your login has expired; please log in again'
+        }, 400
 
-@jwt_manager.user_lookup_loader
-def user_lookup_callback(jwt_header, jwt_payload):
-    id = jwt_payload['sub']
-    return session.query(User).filter_by(id=id).one_or_none()
+    app.cli.add_command(migrate.init_db_command)
+    app.cli.add_command(export.export_command)
+    app.cli.add_command(export.import_command)
 
-@jwt_manager.expired_token_loader
-def expired_signature_error_handler(jwt_header, jwt_payload):
-    return {
-        'status': 'fail',
-        'message': 'Your login has expired; please log in again'
-    }, 400
+    return app
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Handy for development, but in production the schema is the deploy's job.
+    migrate.init_db()
+    create_app().run(debug=True)
@@ -0,0 +1,36 @@
+'''An ASGI deployment of the API, for running under uvicorn.
+
+This is the Flask app from `app.py` behind a WSGI-to-ASGI bridge (`a2wsgi`), so
+it serves the same routes with the same handlers, JSON and JWT cookies. The
+event loop looks after the connections, including idle keep-alive ones and
+slow clients, and each request is handed to a pool of `ASGI_THREADS` threads
+with a WSGI environ built from the ASGI scope (so the scheme, client address
+and headers are the real ones).
+
+It isn't an async stack: the handlers and the session are still synchronous,
+and a request waiting on SQLite or on the bcrypt pool (see `hashing.py`) holds
+one of the threads while it does, just as under a threaded WSGI server. What
+it buys is that connections that aren't in the middle of a request don't.
+
+It needs the extra packages in `requirements-asgi.txt`. Like the Flask app it
+expects the schema to be there already. Run it like this:
+
+    flask --app app init-db
+    uvicorn --factory asgi:create_app --workers 4
+'''
+
+import os
+
+from a2wsgi import WSGIMiddleware
+
+import app
+
+# Requests each process runs at once. Like the threads of a WSGI server, it
+# only has to be enough to keep SQLite and the bcrypt pool busy.
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 10))
+
+def create_app(config=None):
+    '''Create the ASGI app, with `config` overriding the settings from the
+    environment like for `app.create_app`.'''
+
+    return WSGIMiddleware(app.create_app(config), workers=ASGI_THREADS)
@@ -1,15 +1,15 @@
 from flask import request, make_response
 from flask_restx import Namespace, Resource, fields
 from flask_jwt_extended import (
-    jwt_required, create_access_token, set_access_cookies, unset_access_cookies
+    create_access_token, set_access_cookies, unset_access_cookies
 )
 
+import hashing
+
 from model import User
 from session import session
 
-from schema import UserSchema
-
-schema = UserSchema()
+from schema import user_schema
 
 api = Namespace('auth', description='Authentication operations')
 
@@ -19,102 +19,126 @@ registration_model = api.model('Register', {
     'password': fields.String(required=True, description='The user\'s password')
 })
 
-@api.route('/register')
-class Register(Resource):
-    def post(self):
-        '''Register a new user'''
-
-        # This is used in several places, so define it here to keep them in
-        # sync.
-        success_response = {
-            'status': 'success',
-            'message': 'Account created successfully'
-        }
+# These are the request logic of each route, called by the resources below.
+# Each one returns what a flask-restx method would. `login` and `logout` need a
+# request context for the cookies.
 
-        password = request.json.pop('password', None)
-        email = request.json.pop('email', None)
+def register(data):
+    '''Register a new user from the JSON `data` of a request.'''
 
-        try:
-            u = schema.load(request.json)
-        except:
-            return {
-                    'status': 'fail',
-                    'message': 'Couldn\'t deserialize user'
-            }, 500
+    # This is used in several places, so define it here to keep them in
+    # sync.
+    success_response = {
+        'status': 'success',
+        'message': 'Account created successfully'
+    }
 
-        email_status, email_error = u.set_email(email)
-        if not email_status:
-            return {
-                    'status': 'fail',
-                    'message': email_error
-            }
+    password = data.pop('password', None)
+    email = data.pop('email', None)
 
-        u.set_password(password)
+    try:
+        u = user_schema.load(data)
+    except:
+        return {
+                'status': 'fail',
+                'message': 'Couldn\'t deserialize user'
+        }, 500
 
-        if session.query(User).filter_by(username=u.username).count() > 0:
-            return {
+    email_status, email_error = u.set_email(email)
+    if not email_status:
+        return {
                 'status': 'fail',
-                'message': 'Username already in use'
-            }
+                'message': email_error
+        }
 
-        if session.query(User).filter_by(validated_email=u.validated_email).count() > 0:
-            # This is the case where an email address is already in use. It's
-            # better not to tell the client that the email is being used,
-            # because that could be used as the basis for an enumeration
-            # attack. Failing silently is fine for now.
+    u.set_password(password)
 
-            # TODO: Send an email to the existing user notifying them that
-            # someone is trying to sign up with their email. They can choose to
-            # ignore it, or it'll remind them that they already have an account
-            # if they were trying to sign up and forgot they already had one.
+    if session.query(User).filter_by(username=u.username).count() > 0:
+        return {
+            'status': 'fail',
+            'message': 'Username already in use'
+        }
 
-            return success_response
+    if session.query(User).filter_by(validated_email=u.validated_email).count() > 0:
+        # This is the case where an email address is already in use. It's
+        # better not to tell the client that the email is being used,
+        # because that could be used as the basis for an enumeration
+        # attack. Failing silently is fine for now.
 
-        # Any error should've been handled at this point. If there's an
-        # unhandled exception here then Flask will send a 500 for us.
-        session.add(u)
-        session.commit()
+        # TODO: Send an email to the existing user notifying them that
+        # someone is trying to sign up with their email. They can choose to
+        # ignore it, or it'll remind them that they already have an account
+        # if they were trying to sign up and forgot they already had one.
 
         return success_response
 
-@api.route('/login')
-class Login(Resource):
-    def post(self):
-        '''Log in to the server to get an authentication token'''
+    # Any error should've been handled at this point. If there's an
+    # unhandled exception here then Flask will send a 500 for us.
+    session.add(u)
+    session.commit()
+
+    u.verify_email_later()
 
-        username = request.json.get('username', None)
-        password = request.json.get('password', None)
+    return success_response
 
-        if username == None or password == None:
-            return {
-                    'status': 'fail',
-                    'message': 'Username or password missing'
-            }
+def login(data):
+    '''Check the username and password in `data`, and respond with the
+    cookies for a token if they're right.'''
 
-        password = password.encode('utf8')
-        u = session.query(User).filter_by(username=username).first()
+    username = data.get('username', None)
+    password = data.get('password', None)
 
-        if u == None or not u.check_password(password):
-            return {
+    if username == None or password == None:
+        return {
                 'status': 'fail',
-                'message': 'Incorrect login'
-            }
+                'message': 'Username or password missing'
+        }
+
+    password = password.encode('utf8')
+    u = session.query(User).filter_by(username=username).first()
+
+    if u == None or not u.check_password(password):
+        return {
+            'status': 'fail',
+            'message': 'Incorrect login'
+        }
+
+    # Hashes made before the cost was last raised are upgraded while we have
+    # the plaintext password on hand.
+    if hashing.needs_rehash(u.password_hash):
+        u.password_hash = hashing.hash_password(password)
+        session.commit()
+
+    access_token = create_access_token(identity=u)
+    resp = make_response({
+        'status': 'success',
+        'message': 'Successfully logged in'
+    })
+    set_access_cookies(resp, access_token)
+    return resp
+
+def logout():
+    resp = make_response({
+        'status': 'success',
+        'message': 'Successfully logged out'
+    })
+    unset_access_cookies(resp)
+    return resp
+
+@api.route('/register')
+class Register(Resource):
+    def post(self):
+        '''Register a new user'''
+        return register(request.json)
 
-        access_token = create_access_token(identity=u)
-        resp = make_response({
-            'status': 'success',
-            'message': 'Successfully logged in'
-        })
-        set_access_cookies(resp, access_token)
-        return resp
+@api.route('/login')
+class Login(Resource):
+    def post(self):
+        '''Log in to the server to get an authentication token'''
+        return login(request.json)
 
 @api.route('/logout')
 class Logout(Resource):
     def post(self):
         '''Log out'''
-        resp = make_response({
-            'status': 'success',
-            'message': 'Successfully logged out'
-        })
-        unset_access_cookies(resp)
-        return resp
+        return logout()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+'''Compare the throughput of the sync (WSGI) and async (ASGI) deployments.
+
+This seeds a scratch database, starts the Flask app under a threaded Werkzeug
+server and `asgi.py` under uvicorn (one process each), logs in to both, and
+then has more and more clients at once hammer a route on each. Each client
+opens a connection per request, so the async server really does have that many
+connections to look after.
+
+Usage:
+
+    python bench/asgi.py --concurrency 1 16 64 256 --duration 5
+    python bench/asgi.py --route login     # Waits on bcrypt instead of SQLite
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+from servers import HERE, PASSWORD, SERVERS, command, seed
+
+USERS = 1000
+
+async def request(port, method, path, body=None, cookies='', csrf=''):
+    '''Make one HTTP/1.1 request on a new connection.'''
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+
+    body = json.dumps(body).encode('utf8') if body != None else b''
+    writer.write('{} {} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'
+                 'Cookie: {}\r\nX-CSRF-TOKEN: {}\r\n'
+                 'Content-Type: application/json\r\nContent-Length: {}\r\n\r\n'
+                 .format(method, path, cookies, csrf, len(body)).encode('utf8')
+                 + body)
+
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = [line.split(': ', 1) for line in lines[1:]]
+    return status, headers, body
+
+async def login(port):
+    _, headers, _ = await request(port, 'POST', '/auth/login', {
+        'username': 'user0',
+        'password': PASSWORD
+    })
+    cookies = [v.split(';')[0] for k, v in headers
+               if k.lower() == 'set-cookie']
+    csrf = [c.split('=', 1)[1] for c in cookies
+            if c.startswith('csrf_access_token=')][0]
+    return '; '.join(cookies), csrf
+
+async def wait_for(port):
+    for _ in range(100):
+        try:
+            await request(port, 'GET', '/metrics')
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError('server on port {} never came up'.format(port))
+
+async def hammer(port, route, concurrency, duration):
+    cookies, csrf = await login(port)
+    deadline = time.monotonic() + duration
+    done = 0
+    errors = 0
+
+    async def client(n):
+        nonlocal done, errors
+        while time.monotonic() < deadline:
+            if route == 'login':
+                status, _, _ = await request(port, 'POST', '/auth/login', {
+                    'username': 'user0',
+                    'password': PASSWORD
+                })
+            else:
+                status, _, _ = await request(
+                    port, 'GET', '/suggestion/username/user{}'.format(n % 100),
+                    cookies=cookies, csrf=csrf)
+            if status == 200:
+                done += 1
+            else:
+                errors += 1
+
+    begin = time.monotonic()
+    await asyncio.gather(*[client(n) for n in range(concurrency)])
+    return done / (time.monotonic() - begin), errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 16, 64, 256])
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--route', choices=['suggestion', 'login'],
+                        default='suggestion')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    url = 'sqlite:///{}'.format(os.path.join(directory, 'bench.sqlite3'))
+    seed(url, USERS)
+
+    env = dict(os.environ, DATABASE_URL=url, BCRYPT_COST='10',
+               SECRET_KEY='bench-secret-key-that-is-long-enough')
+    servers = {}
+
+    try:
+        for port, name in enumerate(SERVERS, 5600):
+            servers[name] = (port, subprocess.Popen(command(name, port),
+                                                    cwd=HERE, env=env))
+
+        for port, _ in servers.values():
+            asyncio.run(wait_for(port))
+
+        print('{:>12} {:>14} {:>14}'.format('concurrency', 'wsgi req/s',
+                                            'asgi req/s'))
+
+        for concurrency in args.concurrency:
+            results = []
+            for name, (port, _) in servers.items():
+                rate, errors = asyncio.run(
+                    hammer(port, args.route, concurrency, args.duration))
+                results.append('{:.0f}{}'.format(
+                    rate, ' ({} err)'.format(errors) if errors else ''))
+            print('{:>12} {:>14} {:>14}'.format(concurrency, *results))
+    finally:
+        for _, process in servers.values():
+            process.terminate()
+            process.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+'''Compare the memory and speed of the two `LRUCache` backends.
+
+This fills an `LRUCache` with `--entries` entries, once backed by the
+`OrderedDict` fallback and once by `hashtable.Table` (if it's been built with
+`python setup.py build_ext --inplace`), and reports the bytes each entry costs
+on top of its key and value, and the nanoseconds a `get` and a `set` take.
+The keys are ints like the identity cache's, and the values are shared, so
+only the cache's own overhead is counted.
+
+Usage:
+
+    python bench/cache.py --entries 100000 --ttl 60
+'''
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import cache
+
+def measure(table, entries, ttl, rounds):
+    '''Returns bytes per entry, and nanoseconds per get and per set.'''
+
+    cache.Table = table
+    keys = list(range(entries))
+    value = object()
+
+    tracemalloc.start()
+    c = cache.LRUCache(maxsize=entries, ttl=ttl)
+    before = tracemalloc.get_traced_memory()[0]
+    for key in keys:
+        c.set(key, value)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    begin = time.perf_counter_ns()
+    for _ in range(rounds):
+        for key in keys:
+            c.get(key)
+    get = (time.perf_counter_ns() - begin) / (rounds * entries)
+
+    begin = time.perf_counter_ns()
+    for _ in range(rounds):
+        for key in keys:
+            c.set(key, value)
+    set = (time.perf_counter_ns() - begin) / (rounds * entries)
+
+    return size / entries, get, set
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--ttl', type=float, default=60,
+                        help='seconds, or 0 for no expiry')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    backends = [('OrderedDict', cache._Table)]
+
+    try:
+        from hashtable import Table
+        backends.append(('hashtable.Table', Table))
+    except ImportError:
+        print('hashtable isn\'t built, so only measuring the fallback')
+
+    print('{:<16} {:>12} {:>10} {:>10}'.format('backend', 'bytes/entry',
+                                                'get ns', 'set ns'))
+
+    for name, table in backends:
+        size, get, set = measure(table, args.entries, args.ttl or None,
+                                 args.rounds)
+        print('{:<16} {:>12.1f} {:>10.0f} {:>10.0f}'.format(name, size, get,
+                                                           set))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+'''Generate a big database of made up users and posts.
+
+The rows are bulk inserted through the models in `model.py`, so the result has
+exactly the schema (and indexes, and username trigram index) the app would
+create, and can be pointed to with `DATABASE_URL` or handed to the benchmarks
+with their `--fixture` option.
+
+Usernames are made of a stem and a number. The stems are random strings like
+`random_string` in `hashtable.c` makes, but which stem each user gets follows a
+Zipf distribution, so a few stems are shared by lots of users (`ab`, `ab1`,
+`ab2`, ...) and most by only one. That gives username suggestions the mix of
+big and small result sets they'd see for real. Likewise the number of posts
+each author has follows a Zipf distribution, so a few users write most of them,
+and so do the words in post bodies, which come from a vocabulary of `--words`
+words: a few (the words in `WORDS`) are in lots of posts and most are rare, so
+post search sees common and rare words like it would for real.
+`--username-skew`, `--post-skew` and `--word-skew` are the exponents; 0 is
+uniform and bigger is more skewed.
+
+Hashing millions of passwords would take days, so only the first `--logins`
+users get a real bcrypt hash of `--password`. Everyone else gets a well formed
+hash that no password matches (the column is unique, so they can't share one).
+
+Usage:
+
+    python bench/generate.py fixture.sqlite3 --users 1000000 --posts 5000000
+    DATABASE_URL=sqlite:///fixture.sqlite3 python app.py
+'''
+
+import argparse
+import itertools
+import os
+import random
+import string
+import sys
+import time
+
+import bcrypt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# The alphabet bcrypt encodes salts and digests in.
+BCRYPT_ALPHABET = './' + string.ascii_uppercase + string.ascii_lowercase \
+                  + string.digits
+
+DOMAINS = ['gmail.com', 'outlook.com', 'yahoo.com', 'proton.me', 'fastmail.com']
+
+WORDS = ['honk', 'goose', 'pond', 'bread', 'wing', 'feather', 'flock', 'gaggle',
+         'bill', 'waddle', 'hiss', 'egg', 'nest', 'river', 'park', 'duck']
+
+def random_string(rng):
+    '''1 to 10 random lowercase letters, like `random_string` in hashtable.c.'''
+
+    return ''.join(rng.choice(string.ascii_lowercase)
+                   for _ in range(rng.randint(1, 10)))
+
+def zipf_weights(n, skew):
+    '''Cumulative weights for picking one of `n` ranks with `random.choices`.'''
+
+    return list(itertools.accumulate(1 / (rank ** skew)
+                                     for rank in range(1, n + 1)))
+
+def placeholder_hash(id, cost):
+    '''A valid bcrypt hash for user `id` that no password will match.'''
+
+    salt = ''
+    while id > 0 or len(salt) == 0:
+        id, digit = divmod(id, 64)
+        salt += BCRYPT_ALPHABET[digit]
+
+    # The last character of the salt and of the digest only carries a couple of
+    # bits, so they're left at zero ('.') for bcrypt to accept them.
+    return '$2b${:02d}${}.{}.'.format(cost, salt.ljust(21, '.'),
+                                      'A' * 30).encode('ascii')
+
+def usernames(rng, count, stems, skew):
+    '''Generate `count` unique usernames from `stems` Zipf distributed stems.'''
+
+    vocabulary = list({random_string(rng) for _ in range(stems)})
+    rng.shuffle(vocabulary)
+
+    weights = zipf_weights(len(vocabulary), skew)
+    uses = dict.fromkeys(vocabulary, 0)
+
+    # Stems are only letters and the suffixes only digits, so a stem and a
+    # suffix can't add up to another stem's username.
+    for stem in rng.choices(vocabulary, cum_weights=weights, k=count):
+        n = uses[stem]
+        uses[stem] += 1
+        yield stem if n == 0 else '{}{}'.format(stem, n)
+
+def vocabulary(rng, count):
+    '''`WORDS` followed by random words, `count` in all, most common first.'''
+
+    words = list(WORDS)
+    seen = set(words)
+    while len(words) < count:
+        word = random_string(rng)
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('database', help='SQLite file to create')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--posts', type=int, default=500000)
+    parser.add_argument('--stems', type=int, default=10000,
+                        help='how many different username stems there are')
+    parser.add_argument('--username-skew', type=float, default=1.0)
+    parser.add_argument('--post-skew', type=float, default=1.1)
+    parser.add_argument('--words', type=int, default=50000,
+                        help='how many different words post bodies use')
+    parser.add_argument('--word-skew', type=float, default=1.0)
+    parser.add_argument('--logins', type=int, default=256,
+                        help='how many users can log in with --password')
+    parser.add_argument('--password', default='honk')
+    parser.add_argument('--bcrypt-cost', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--force', action='store_true',
+                        help='replace the database if it already exists')
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        if not args.force:
+            parser.error('{} already exists (use --force to replace it)'
+                         .format(args.database))
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(args.database + suffix):
+                os.remove(args.database + suffix)
+
+    # `session` reads this when it's imported, so it has to be set first.
+    os.environ['DATABASE_URL'] = 'sqlite:///{}'.format(
+        os.path.abspath(args.database))
+
+    from sqlalchemy import insert
+    from migrate import init_db
+    from model import Base, User, Post, create_username_index, \
+        create_post_body_index, drop_search_index
+    from session import Session, get_engine
+
+    engine = get_engine()
+    init_db(engine)
+
+    rng = random.Random(args.seed)
+    begin = time.monotonic()
+
+    # bcrypt is the slow part of this, so the real hashes are made once up
+    # front. Each one needs its own salt to keep them unique.
+    password = args.password.encode('utf8')
+    logins = [bcrypt.hashpw(password, bcrypt.gensalt(args.bcrypt_cost))
+              for _ in range(min(args.logins, args.users))]
+
+    # Keeping the username trigram index up to date row by row more than doubles
+    # the time it takes to insert users, so it's dropped here and built again
+    # in one go once they're all in. Likewise the post body index.
+    with engine.begin() as connection:
+        drop_search_index(connection, 'users_username_fts')
+        drop_search_index(connection, 'posts_body_fts')
+
+    with Session() as session:
+        names = usernames(rng, args.users, args.stems, args.username_skew)
+
+        for batch in batches(enumerate(names, 1), args.batch_size):
+            session.execute(insert(User), [{
+                'id': id,
+                'name': username.capitalize(),
+                'username': username,
+                'validated_email': '{}@{}'.format(username, rng.choice(DOMAINS)),
+                'password_hash': logins[id - 1] if id <= len(logins)
+                                 else placeholder_hash(id, args.bcrypt_cost)
+            } for id, username in batch])
+            session.commit()
+
+        with engine.begin() as connection:
+            create_username_index(Base.metadata, connection)
+
+        print('{} users in {:.1f}s'.format(args.users, time.monotonic() - begin))
+
+        # The busiest authors are spread over the whole id range rather than
+        # being the first few users.
+        authors = list(range(1, args.users + 1))
+        rng.shuffle(authors)
+        weights = zipf_weights(len(authors), args.post_skew)
+
+        words = vocabulary(rng, args.words)
+        word_weights = zipf_weights(len(words), args.word_skew)
+
+        for batch in batches(range(args.posts), args.batch_size):
+            chosen = rng.choices(authors, cum_weights=weights, k=len(batch))
+            session.execute(insert(Post), [{
+                'author_id': author,
+                'body': ' '.join(rng.choices(words, cum_weights=word_weights,
+                                             k=rng.randint(1, 12)))
+            } for author in chosen])
+            session.commit()
+
+        with engine.begin() as connection:
+            create_post_body_index(Base.metadata, connection)
+
+        print('{} posts in {:.1f}s'.format(args.posts, time.monotonic() - begin))
+
+    print('Users 1 to {} (by id) can log in with password {!r}'.format(
+        len(logins), args.password))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+'''Load test the API, route by route, and catch latency regressions.
+
+This seeds a scratch SQLite database, starts the app on it in a server of its
+own (`app.py` under a threaded Werkzeug server, or `asgi.py` under uvicorn with
+`--server asgi`), and then has `--concurrency` clients hit one route at a time
+for `--duration` seconds each. Every client is logged in as a user of its own.
+With `--fixture` it runs against a copy of a database from `bench/generate.py`
+instead of a freshly seeded one. The routes are:
+
+    register      POST /auth/register with a new username every time
+    login         POST /auth/login
+    user_get      GET /user/<username> for a random seeded user
+    user_put      PUT /user/<username> renaming the client's own user
+    post_get      GET /post/<id> for a random seeded post
+    post_create   POST /post
+    suggestion    GET /suggestion/username/<prefix> for a random prefix
+
+The server gets this script's environment, so settings like
+`EMAIL_DELIVERABILITY=background` (which keeps DNS lookups out of `register`,
+see `deliverability.py`) or `POST_WRITE_BEHIND` can be compared by setting
+them for both runs.
+
+A request counts as an error if it gets anything but a 200 or the body says
+`"status": "fail"`. For each route the throughput and the p50/p95/p99 latency
+of all requests is printed, and `--output` saves them as JSON, along with the
+commit they were measured on, so they can be compared against later with
+`--compare`. When comparing, the script exits with status 1 if any route's
+`--metric` got worse by more than `--threshold` percent.
+
+The clients run in this process, so on a small machine they compete with the
+server for CPU, and the numbers are best compared with runs on the same
+machine.
+
+Usage:
+
+    python bench/load.py --concurrency 16 --duration 10 --output before.json
+    python bench/load.py --concurrency 16 --duration 10 --compare before.json
+    python bench/load.py --routes login post_create --threshold 20
+    python bench/load.py --fixture fixture.sqlite3 --routes suggestion
+'''
+
+import argparse
+import datetime
+import http.client
+import json
+import math
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from servers import HERE, PASSWORD, SERVERS, command, seed
+
+# For each metric, whether a bigger number is worse.
+METRICS = {
+    'p50': True,
+    'p95': True,
+    'p99': True,
+    'mean': True,
+    'throughput': False,
+}
+
+def copy_fixture(fixture, path):
+    '''Copy a database made by `bench/generate.py` so the run can't change it.'''
+
+    # The backup API rather than copying the file, which could leave behind
+    # whatever is still in the fixture's write-ahead log.
+    source = sqlite3.connect(fixture)
+    destination = sqlite3.connect(path)
+    source.backup(destination)
+    destination.close()
+    source.close()
+
+def load_dataset(path):
+    '''The usernames (in id order) and the number of posts in the database.'''
+
+    connection = sqlite3.connect(path)
+    usernames = [username for username,
+                 in connection.execute('SELECT username FROM users ORDER BY id')]
+    posts, = connection.execute('SELECT max(id) FROM posts').fetchone()
+    connection.close()
+    return usernames, posts or 0
+
+def percentile(ordered, p):
+    '''The nearest-rank percentile of an already sorted list.'''
+
+    if len(ordered) == 0:
+        return None
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+class Client:
+    '''One simulated user, making one request at a time.'''
+
+    def __init__(self, port, n, usernames, posts):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port,
+                                                     timeout=60)
+        self.n = n
+        self.usernames = usernames
+        self.posts = posts
+        self.username = usernames[n]
+        self.cookies = {}
+        self.random = random.Random(n)
+        self.count = 0
+
+    def request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'}
+
+        if len(self.cookies) > 0:
+            headers['Cookie'] = '; '.join('{}={}'.format(k, v)
+                                          for k, v in self.cookies.items())
+        if 'csrf_access_token' in self.cookies:
+            headers['X-CSRF-TOKEN'] = self.cookies['csrf_access_token']
+
+        self.connection.request(method, path, headers=headers,
+                                body=json.dumps(body) if body != None else None)
+        response = self.connection.getresponse()
+        data = response.read()
+
+        for header in response.headers.get_all('Set-Cookie') or []:
+            name, _, value = header.split(';')[0].partition('=')
+            self.cookies[name] = value
+
+        if response.status != 200:
+            return False
+
+        try:
+            return json.loads(data).get('status') != 'fail'
+        except ValueError:
+            return False
+
+    def login(self):
+        return self.request('POST', '/auth/login', {
+            'username': self.username,
+            'password': PASSWORD
+        })
+
+    # One method per route, each making one request.
+
+    def register(self):
+        self.count += 1
+        username = 'load{}x{}x{}'.format(os.getpid(), self.n, self.count)
+        return self.request('POST', '/auth/register', {
+            'username': username,
+            'name': username,
+            'email': '{}@gmail.com'.format(username),
+            'password': PASSWORD
+        })
+
+    def user_get(self):
+        return self.request('GET', '/user/{}'.format(
+            self.random.choice(self.usernames)))
+
+    def user_put(self):
+        self.count += 1
+        return self.request('PUT', '/user/{}'.format(self.username), {
+            'name': 'user {} v{}'.format(self.n, self.count)
+        })
+
+    def post_get(self):
+        return self.request('GET', '/post/{}'.format(
+            self.random.randrange(self.posts) + 1))
+
+    def post_create(self):
+        return self.request('POST', '/post', {'body': 'honk honk'})
+
+    def suggestion(self):
+        # Prefixes of various lengths, so some match lots of users and some
+        # only a few.
+        return self.request('GET', '/suggestion/username/{}'.format(
+            self.random.choice(self.usernames)[:self.random.randrange(2, 8)]))
+
+ROUTES = ['register', 'login', 'user_get', 'user_put', 'post_get',
+          'post_create', 'suggestion']
+
+def run_route(clients, route, duration):
+    '''Have every client make requests to `route` until `duration` is up.'''
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def work(client):
+        nonlocal errors
+        mine = []
+        failed = 0
+        method = getattr(client, route)
+
+        while time.monotonic() < deadline:
+            begin = time.perf_counter()
+            try:
+                ok = method()
+            except (OSError, http.client.HTTPException):
+                ok = False
+                client.connection.close()
+            mine.append(time.perf_counter() - begin)
+            failed += not ok
+
+        with lock:
+            latencies.extend(mine)
+            errors += failed
+
+    begin = time.monotonic()
+    threads = [threading.Thread(target=work, args=(client,))
+               for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - begin
+
+    latencies.sort()
+    ms = lambda s: round(s * 1000, 3) if s != None else None
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round((len(latencies) - errors) / elapsed, 1),
+        'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50': ms(percentile(latencies, 50)),
+        'p95': ms(percentile(latencies, 95)),
+        'p99': ms(percentile(latencies, 99)),
+    }
+
+def wait_for(port, process):
+    for _ in range(100):
+        if process.poll() != None:
+            raise RuntimeError('server exited with {}'.format(process.returncode))
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port,
+                                                    timeout=1)
+            connection.request('GET', '/metrics')
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server on port {} never came up'.format(port))
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=HERE, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, metric, threshold):
+    '''Print how each route moved since `baseline` and list the regressions.'''
+
+    bigger_is_worse = METRICS[metric]
+    regressions = []
+
+    print()
+    print('{:<12} {:>12} {:>12} {:>9}  (vs {})'.format(
+        'route', 'before', 'after', 'change',
+        baseline.get('commit') or 'baseline'))
+
+    for route, after in results['routes'].items():
+        before = baseline['routes'].get(route)
+        if before == None or before.get(metric) in (None, 0) \
+                or after.get(metric) == None:
+            continue
+
+        change = (after[metric] - before[metric]) / before[metric] * 100
+        worse = change if bigger_is_worse else -change
+        flag = ''
+        if worse > threshold:
+            regressions.append(route)
+            flag = '  REGRESSION'
+
+        print('{:<12} {:>12} {:>12} {:>+8.1f}%{}'.format(
+            route, before[metric], after[metric], change, flag))
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--routes', nargs='+', choices=ROUTES, default=ROUTES)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5,
+                        help='seconds to spend on each route')
+    parser.add_argument('--warmup', type=float, default=1,
+                        help='seconds of unmeasured requests before each route')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--fixture',
+                        help='database from bench/generate.py to run against')
+    parser.add_argument('--server', choices=SERVERS, default='wsgi')
+    parser.add_argument('--port', type=int, default=5700)
+    parser.add_argument('--bcrypt-cost', type=int, default=10)
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='JSON file from an earlier run to compare with')
+    parser.add_argument('--metric', choices=METRICS, default='p95')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='percent a route can get worse by when comparing')
+    args = parser.parse_args()
+
+    args.users = max(args.users, args.concurrency)
+    args.posts = max(args.posts, 1)
+
+    path = os.path.join(tempfile.mkdtemp(), 'load.sqlite3')
+    url = 'sqlite:///{}'.format(path)
+
+    if args.fixture != None:
+        copy_fixture(args.fixture, path)
+    else:
+        seed(url, args.users, args.posts, args.concurrency, args.bcrypt_cost)
+
+    usernames, posts = load_dataset(path)
+
+    env = dict(os.environ, DATABASE_URL=url,
+               BCRYPT_COST=str(args.bcrypt_cost),
+               SECRET_KEY='load-test-secret-key-that-is-long-enough')
+    server = subprocess.Popen(command(args.server, args.port), cwd=HERE,
+                              env=env)
+
+    results = {
+        'commit': git_commit(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'server': args.server,
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'routes': {}
+    }
+
+    try:
+        wait_for(args.port, server)
+
+        clients = [Client(args.port, n, usernames, posts)
+                   for n in range(args.concurrency)]
+        for client in clients:
+            if not client.login():
+                raise RuntimeError('{} couldn\'t log in'.format(client.username))
+
+        print('{:<12} {:>9} {:>7} {:>10} {:>9} {:>9} {:>9}'.format(
+            'route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms',
+            'p99 ms'))
+
+        for route in args.routes:
+            if args.warmup > 0:
+                run_route(clients, route, args.warmup)
+
+            result = run_route(clients, route, args.duration)
+            results['routes'][route] = result
+
+            print('{:<12} {:>9} {:>7} {:>10} {:>9} {:>9} {:>9}'.format(
+                route, result['requests'], result['errors'],
+                result['throughput'], result['p50'], result['p95'],
+                result['p99']))
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.output != None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if args.compare != None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.metric, args.threshold)
+        if len(regressions) > 0:
+            print('\n{} got more than {}% worse: {}'.format(
+                args.metric, args.threshold, ', '.join(regressions)))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+'''Measure post search latency on a big database.
+
+This runs the queries behind `GET /post/search` (see `post.py`) against a
+database from `bench/generate.py`, for words picked by how many posts they're
+in: the most common, then ones in about 10%, 1%, 0.1% and 0.01% of posts, and
+one in only a handful, plus a common and a rare word together. For each it
+reports how many posts match, and the p50 and p99 milliseconds over
+`--repeat` runs of fetching the first page and the page after it with its
+cursor. For comparison it also times the `LIKE` scan a client would be left
+with otherwise, once for each word, unless `--no-scan` is given.
+
+Ranking is most of the work, and only the newest `post.SEARCH_WINDOW`
+matches are ranked. BM25 still goes through every match once to count how
+many posts have each word, which is far cheaper but does make the most
+common words the slowest to search for.
+
+Usage:
+
+    python bench/generate.py fixture.sqlite3 --users 1000000 --posts 5000000
+    python bench/search.py fixture.sqlite3 --repeat 20
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# How common each word searched for should be, as a fraction of all posts.
+FRACTIONS = [0.1, 0.01, 0.001, 0.0001]
+
+def pick_words(connection, posts):
+    '''(label, query) pairs of words by how many posts they're in.'''
+
+    connection.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS temp.posts_body_vocab "
+        "USING fts5vocab(main, 'posts_body_fts', 'row')")
+    vocabulary = connection.exec_driver_sql(
+        'SELECT term, doc FROM temp.posts_body_vocab ORDER BY doc DESC').all()
+
+    def closest(fraction):
+        return min(vocabulary, key=lambda row: abs(row.doc - fraction * posts))
+
+    common, rare = vocabulary[0], vocabulary[-1]
+    picks = [('most common', common.term)]
+    picks += [('~{:g}%'.format(fraction * 100), closest(fraction).term)
+              for fraction in FRACTIONS]
+    picks += [('rarest', rare.term),
+              ('common + 0.1%', '{} {}'.format(common.term,
+                                               closest(0.001).term))]
+    return picks
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('fixture', help='database from bench/generate.py')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--no-scan', action='store_true',
+                        help='skip timing LIKE scans')
+    args = parser.parse_args()
+
+    # `session` reads this when it's imported, so it has to be set first.
+    os.environ['DATABASE_URL'] = 'sqlite:///{}'.format(
+        os.path.abspath(args.fixture))
+
+    from sqlalchemy import func, select, text
+    from model import Post
+    from session import Session
+    import post
+
+    with Session() as session:
+        posts = session.scalar(select(func.count()).select_from(Post))
+        picks = pick_words(session.connection(), posts)
+
+        def search(match, after):
+            '''Everything the endpoint does for a page, short of the JSON.'''
+
+            page = session.execute(post.search_page(match, after,
+                                                    args.limit)).all()
+            ids = [row.id for row in page]
+            if len(ids) > 0:
+                snippets = session.execute(post.search_snippets(match, ids)).all()
+                found = session.scalars(post.search_posts(ids)).all()
+                post.search_results(page, snippets, found, args.limit)
+            return page
+
+        print('{} posts, {} per page\n'.format(posts, args.limit))
+        print('{:<16} {:<22} {:>9} {:>8} {:>8} {:>8} {:>8} {:>10}'.format(
+            'words', 'query', 'matches', 'p50 ms', 'p99 ms', 'next p50',
+            'next p99', 'LIKE ms'))
+
+        for label, words in picks:
+            match = post.search_match(words)
+            matches = session.execute(text(
+                'SELECT count(*) FROM posts_body_fts '
+                'WHERE posts_body_fts MATCH :match').bindparams(
+                    match=match)).scalar()
+
+            first, second = [], []
+            for _ in range(args.repeat):
+                begin = time.perf_counter()
+                page = search(match, None)
+                first.append((time.perf_counter() - begin) * 1000)
+
+                if len(page) == args.limit:
+                    begin = time.perf_counter()
+                    search(match, (page[-1].rank, page[-1].id))
+                    second.append((time.perf_counter() - begin) * 1000)
+
+            first.sort()
+            second.sort()
+
+            scan = '-'
+            if not args.no_scan:
+                # What a client would otherwise have to do for a page.
+                query = select(Post.id)
+                for word in words.split():
+                    query = query.where(Post.body.like('%{}%'.format(word)))
+                begin = time.perf_counter()
+                session.execute(query.order_by(Post.id.desc())
+                                     .limit(args.limit)).all()
+                scan = '{:.1f}'.format((time.perf_counter() - begin) * 1000)
+
+            print('{:<16} {:<22} {:>9} {:>8.2f} {:>8.2f} {:>8} {:>8} {:>10}'
+                  .format(label, words[:22], matches, percentile(first, 50),
+                          percentile(first, 99),
+                          '{:.2f}'.format(percentile(second, 50))
+                          if second else '-',
+                          '{:.2f}'.format(percentile(second, 99))
+                          if second else '-', scan))
+
+if __name__ == '__main__':
+    main()
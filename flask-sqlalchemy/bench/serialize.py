@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+'''Compare ways of serializing a username suggestion response.
+
+Each way turns `--count` users into the JSON body of a suggestion response,
+for each of the counts given:
+
+    schema       A new `UserSchema(many=True)` per call plus the `json` module,
+                 which is how `suggestion.py` used to do it.
+    shared       The shared `users_schema` from `schema.py` plus `json`. It
+                 only saves building the schema, which is most of the time
+                 for one user (like `/user/<username>` dumps) and next to
+                 nothing for a big list.
+    rows         `user_rows.dump` over row tuples plus `json`.
+    rows+orjson  `user_rows.dump` plus `encoding.dumps` (orjson if installed).
+
+Usage:
+
+    python bench/serialize.py --count 1 1000 --repeat 200
+'''
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import encoding
+
+from model import User
+from schema import UserSchema, users_schema, user_rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, nargs='+', default=[1, 1000])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print('orjson {}'.format(
+        'installed' if encoding.orjson else 'not installed'))
+
+    for count in args.count:
+        compare(count, args.repeat)
+
+def compare(count, repeat):
+    users = [User(id=i, name='user {}'.format(i), username='user{}'.format(i))
+             for i in range(count)]
+    # What a query for `*user_rows.columns, User.id` would return.
+    rows = [tuple(getattr(u, name) for name in user_rows.names) + (u.id,)
+            for u in users]
+
+    def response(results):
+        return {'status': 'success', 'results': results, 'next': None}
+
+    cases = {
+        'schema': lambda: json.dumps(
+            response(UserSchema(many=True).dump(users))).encode('utf8'),
+        'shared': lambda: json.dumps(
+            response(users_schema.dump(users))).encode('utf8'),
+        'rows': lambda: json.dumps(
+            response(user_rows.dump(rows))).encode('utf8'),
+        'rows+orjson': lambda: encoding.dumps(response(user_rows.dump(rows))),
+    }
+
+    # Every way has to produce the same thing for the comparison to be fair.
+    expected = json.loads(cases['schema']())
+    for name, fn in cases.items():
+        assert json.loads(fn()) == expected, name
+
+    baseline = None
+    print('{} users'.format(count))
+
+    for name, fn in cases.items():
+        elapsed = min(timeit.repeat(fn, number=repeat, repeat=3))
+        per_call = elapsed / repeat * 1e6
+        baseline = baseline or per_call
+        print('{:12} {:10.1f} us/response {:6.1f}x'.format(
+            name, per_call, baseline / per_call))
+
+if __name__ == '__main__':
+    main()
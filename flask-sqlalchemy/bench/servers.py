@@ -0,0 +1,62 @@
+'''What the benchmarks that run the app in a server of its own share: the
+commands that start each kind of server, and seeding a scratch database for
+them.'''
+
+import os
+import sys
+
+import bcrypt
+
+HERE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# The password of every seeded user that can log in.
+PASSWORD = 'honk'
+
+# The command for each server, to be run in `HERE` after filling in `{port}`.
+SERVERS = {
+    'wsgi': [sys.executable, '-c',
+             'import logging; from werkzeug.serving import run_simple; '
+             'from app import create_app; '
+             'logging.getLogger("werkzeug").setLevel(logging.WARNING); '
+             'run_simple("127.0.0.1", {port}, create_app(), threaded=True)'],
+    'asgi': [sys.executable, '-m', 'uvicorn', '--factory',
+             'asgi:create_app', '--host', '127.0.0.1', '--port', '{port}',
+             '--log-level', 'warning'],
+}
+
+def command(server, port):
+    return [part.format(port=port) for part in SERVERS[server]]
+
+def seed(url, users, posts=0, logins=1, bcrypt_cost=10):
+    '''Create the schema, `users` users named `user0` and so on, and `posts`
+    posts.
+
+    Only the first `logins` users get a real password hash, since making them
+    is slow. The rest get a placeholder (the column has to be unique).'''
+
+    os.environ['DATABASE_URL'] = url
+    sys.path.insert(0, HERE)
+
+    from sqlalchemy import insert
+    from model import User, Post
+    from migrate import init_db
+    from session import session
+
+    init_db()
+
+    session.execute(insert(User), [{
+        'name': 'user {}'.format(i),
+        'username': 'user{}'.format(i),
+        'validated_email': 'user{}@example.com'.format(i),
+        'password_hash': bcrypt.hashpw(PASSWORD.encode('utf8'),
+                                       bcrypt.gensalt(bcrypt_cost))
+                         if i < logins else 'x{}'.format(i).encode('utf8')
+    } for i in range(users)])
+
+    if posts > 0:
+        session.execute(insert(Post), [{
+            'author_id': i % users + 1,
+            'body': 'honk number {}'.format(i)
+        } for i in range(posts)])
+
+    session.commit()
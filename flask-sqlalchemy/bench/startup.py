@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+'''Check that starting the app stays quick and doesn't touch the database.
+
+This imports `app` and calls `create_app` in a fresh interpreter `--runs`
+times, with `DATABASE_URL` pointing at a file that doesn't exist. It fails
+(exits with status 1) if the median time goes over `--budget` milliseconds, or
+if the database file was created, which means something connected to the
+database at import time again. With `--top` it also lists the modules that
+took the longest to import, according to `python -X importtime`.
+
+Usage:
+
+    python bench/startup.py --budget 1000
+    python bench/startup.py --top 15
+'''
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+STARTUP = '''
+import time
+begin = time.perf_counter()
+from app import create_app
+create_app()
+print(time.perf_counter() - begin)
+'''
+
+def start(env, importtime=False):
+    '''Start the app once, returning the seconds it took and stderr.'''
+
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) \
+              + ['-c', STARTUP]
+    result = subprocess.run(command, cwd=HERE, env=env, capture_output=True,
+                            text=True, check=True)
+    return float(result.stdout.split()[-1]), result.stderr
+
+def slowest_imports(stderr, count):
+    '''The `count` modules imported by `app` (and the other modules imported
+    directly by the script) with the biggest cumulative time.'''
+
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # Nested imports are indented by two more spaces per level, and their
+        # time is already counted in the import that caused them.
+        if name.startswith('   ') and not name.startswith('    '):
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1000,
+                        help='milliseconds the median start can take')
+    parser.add_argument('--top', type=int, default=0,
+                        help='list this many of the slowest imports')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'startup.sqlite3')
+    env = dict(os.environ, DATABASE_URL='sqlite:///{}'.format(path),
+               SECRET_KEY='startup-check')
+    env.pop('BCRYPT_TARGET_SECONDS', None)
+
+    times = [start(env)[0] * 1000 for _ in range(args.runs)]
+    median = statistics.median(times)
+
+    print('import and create_app: median {:.0f}ms, min {:.0f}ms, max {:.0f}ms '
+          '(budget {:.0f}ms)'.format(median, min(times), max(times),
+                                     args.budget))
+
+    if args.top > 0:
+        _, stderr = start(env, importtime=True)
+        for microseconds, name in slowest_imports(stderr, args.top):
+            print('{:>8.1f}ms  {}'.format(microseconds / 1000, name))
+
+    failed = False
+
+    if median > args.budget:
+        print('Starting the app took longer than the budget')
+        failed = True
+
+    if os.path.exists(path):
+        print('Starting the app created the database, so something connected '
+              'to it')
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+'''Small in-process caches shared by the API modules.
+
+Basic usage is like this:
+
+    from cache import LRUCache
+    c = LRUCache(maxsize=2, ttl=60)
+    c.set('a', 1)
+    c.get('a')      # => 1, or None after 60 seconds or once 'a' is evicted
+    c.stats()       # => {'size': 1, 'maxsize': 2, 'hits': 1, 'misses': 0}
+
+The entries are kept in a `hashtable.Table` if the extension has been built
+(see `setup.py`), which stores each entry's expiry time in C rather than in a
+tuple and a float per entry, and in an `OrderedDict` otherwise.
+'''
+
+import threading
+import time
+
+from collections import OrderedDict
+
+class _Table(OrderedDict):
+    '''The parts of `hashtable.Table` that `LRUCache` uses, for when the
+    extension isn't built.'''
+
+    def set(self, key, value, expires=None):
+        self[key] = (expires, value)
+        self.move_to_end(key)
+
+    def get_fresh(self, key, now, default=None):
+        entry = OrderedDict.get(self, key)
+
+        if entry == None:
+            return default
+
+        if entry[0] != None and entry[0] < now:
+            del self[key]
+            return default
+
+        self.move_to_end(key)
+        return entry[1]
+
+try:
+    from hashtable import Table
+except ImportError:
+    Table = _Table
+
+_missing = object()
+
+class LRUCache:
+    '''A thread-safe cache that evicts the least recently used entry once it
+    holds `maxsize` entries. If `ttl` is given, entries also expire that many
+    seconds after they were set.'''
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = Table()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._entries.get_fresh(key, time.monotonic(), _missing)
+
+            if value is _missing:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        '''Returns the keys of the entries evicted to make room, if any.'''
+
+        expires = time.monotonic() + self.ttl if self.ttl != None else None
+        evicted = []
+
+        with self._lock:
+            self._entries.set(key, value, expires)
+
+            while len(self._entries) > self.maxsize:
+                evicted.append(self._entries.popitem(last=False)[0])
+
+        return evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses
+        }
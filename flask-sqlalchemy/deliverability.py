@@ -0,0 +1,163 @@
+'''Checking that the domains of email addresses can receive email.
+
+`validate_email` looks up the domain's MX records by default, so every request
+that sets an email used to wait on a DNS resolver. Here the syntax is always
+checked on the request path, and what happens with the domain depends on
+`EMAIL_DELIVERABILITY`:
+
+    sync        Look the domain up before accepting the address (the default).
+    background  Accept any well formed address, and look the domain up on a
+                background thread afterwards. The user's `email_verified`
+                is set once it turns out to be deliverable.
+    off         Never look domains up.
+
+Either way the answers are kept in a TTL cache by domain, so a popular domain
+is only looked up once every `EMAIL_DOMAIN_CACHE_TTL` seconds. The lookup
+itself is done by `resolver`, which can be swapped for a stub:
+
+    import deliverability
+    deliverability.resolver = lambda domain: True
+
+A resolver returns True if the domain is deliverable, False if it couldn't
+tell (e.g. the lookup timed out), and raises `EmailUndeliverableError` if it
+isn't deliverable.
+'''
+
+import logging
+import os
+import threading
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from email_validator import (
+    EmailUndeliverableError, caching_resolver, validate_email,
+    validate_email_deliverability
+)
+
+import metrics
+
+from cache import LRUCache
+from session import Session
+
+logger = logging.getLogger(__name__)
+
+MODES = ['sync', 'background', 'off']
+
+mode = os.getenv('EMAIL_DELIVERABILITY', 'sync')
+timeout = float(os.getenv('EMAIL_DNS_TIMEOUT', 5))
+max_workers = int(os.getenv('EMAIL_VERIFY_WORKERS', 2))
+
+if mode not in MODES:
+    raise ValueError('EMAIL_DELIVERABILITY must be one of {}'.format(
+        ', '.join(MODES)))
+
+# Values are `(deliverable, error)`, where `error` is the message for an
+# undeliverable domain. Lookups that couldn't tell either way aren't cached.
+domains = LRUCache(maxsize=int(os.getenv('EMAIL_DOMAIN_CACHE_SIZE', 10000)),
+                   ttl=float(os.getenv('EMAIL_DOMAIN_CACHE_TTL', 3600)))
+
+counts = Counter()
+
+metrics.register('email_domains',
+                 lambda: dict(domains.stats(), **counts))
+
+_dns_resolver = caching_resolver(timeout=timeout)
+
+def dns_lookup(domain):
+    info = validate_email_deliverability(domain, domain, timeout=timeout,
+                                         dns_resolver=_dns_resolver)
+    return 'unknown-deliverability' not in info
+
+resolver = dns_lookup
+
+def check_domain(domain):
+    '''Whether `domain` is known to be deliverable, asking `resolver` if the
+    answer isn't cached. Raises `EmailUndeliverableError` if it isn't.'''
+
+    entry = domains.get(domain)
+
+    if entry == None:
+        counts['lookups'] += 1
+        try:
+            deliverable = resolver(domain)
+        except EmailUndeliverableError as e:
+            domains.set(domain, (False, str(e)))
+            raise
+
+        if not deliverable:
+            return False
+
+        entry = (True, None)
+        domains.set(domain, entry)
+
+    deliverable, error = entry
+    if not deliverable:
+        raise EmailUndeliverableError(error)
+
+    return True
+
+def validate(email):
+    '''Check `email` the way `mode` says to.
+
+    Returns the normalized address and whether its domain is known to be
+    deliverable. Raises an `EmailNotValidError` if it isn't acceptable.'''
+
+    result = validate_email(email, check_deliverability=False)
+
+    if mode != 'sync':
+        return result.email, False
+
+    return result.email, check_domain(result.ascii_domain)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _reset_after_fork():
+    global _executor
+    _executor = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _verify(email, statement):
+    domain = validate_email(email, check_deliverability=False).ascii_domain
+
+    try:
+        deliverable = check_domain(domain)
+    except EmailUndeliverableError as e:
+        counts['undeliverable'] += 1
+        logger.info('%s is undeliverable: %s', email, e)
+        return
+
+    if not deliverable:
+        counts['unknown'] += 1
+        return
+
+    with Session() as session:
+        session.execute(statement)
+        session.commit()
+
+    counts['verified'] += 1
+
+def verify_later(email, statement):
+    '''Check the domain of `email` on a background thread, and if it's
+    deliverable execute `statement` (which should mark it as verified).
+
+    Does nothing when `mode` is `off`.'''
+
+    global _executor
+
+    if mode == 'off':
+        return
+
+    with _executor_lock:
+        if _executor == None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='verify-email')
+
+    future = _executor.submit(_verify, email, statement)
+    future.add_done_callback(_log_failure)
+
+def _log_failure(future):
+    if future.exception() != None:
+        logger.error('Verifying an email failed', exc_info=future.exception())
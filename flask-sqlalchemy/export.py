@@ -0,0 +1,328 @@
+'''Exporting and importing users and posts as NDJSON, for backups and moving
+them between databases.
+
+An export is every column of every row of a table, one JSON object per line, in
+order of id. Rows are read from the database `EXPORT_CHUNK` at a time with a
+server-side cursor (`yield_per`) and each chunk is encoded and sent before the
+next is read, so an export of any size takes the same memory. The whole export
+is read in one transaction, so it's a consistent snapshot of the table, but in
+WAL mode that also keeps the WAL from being checkpointed until it's done.
+
+Exports include the password hashes and email addresses, so the endpoints are
+only for the users whose ids are in `ADMIN_USER_IDS` (comma separated).
+
+Basic usage is like this:
+
+    GET /export/users                           # Admins only
+    GET /export/posts?after=1000                # Carry on from a broken export
+
+    flask --app app export users -o users.ndjson
+    flask --app app import users users.ndjson --checkpoint users.checkpoint
+
+Import users before their posts. See `import_file` for how the import works.
+'''
+
+import json
+import os
+
+import click
+
+from flask import Response, current_app, request
+from flask_restx import Namespace, Resource
+from flask_jwt_extended import jwt_required, current_user
+from sqlalchemy import JSON, String, insert, select, type_coerce
+from sqlalchemy.exc import IntegrityError
+
+from encoding import dumps, loads
+from model import (
+    Base, User, Post, create_username_index, create_post_body_index,
+    drop_search_index
+)
+from session import Session, get_engine
+
+api = Namespace('export', description='Exporting users and posts')
+
+# Rows read from the database at a time when exporting. Each chunk is one
+# write to the client.
+EXPORT_CHUNK = 5000
+
+# Rows inserted by each executemany when importing.
+IMPORT_CHUNK = 5000
+
+# How many rows an import with a checkpoint commits at a time.
+CHECKPOINT_ROWS = 1000000
+
+TABLES = {'users': User.__table__, 'posts': Post.__table__}
+
+# The search index over each table (see `model.py`), and what creates it.
+SEARCH_INDEXES = {
+    'users': ('users_username_fts', create_username_index),
+    'posts': ('posts_body_fts', create_post_body_index),
+}
+
+# Columns that are bytes, which JSON can't hold. They're password hashes (see
+# `hashing.py`), which are ASCII, so they're exported as strings.
+BYTES_COLUMNS = {'users': ['password_hash'], 'posts': []}
+
+def is_admin(config, user):
+    return user.id in config['ADMIN_USER_IDS']
+
+def export_query(table, after):
+    '''A query for every row of `table` with an id greater than `after`, in
+    order of id.'''
+
+    # JSON columns are decoded by `encode_rows` instead, with `loads`, which
+    # is quicker than SQLAlchemy decoding them with `json`.
+    query = select(*[type_coerce(column, String).label(column.name)
+                     if isinstance(column.type, JSON) else column
+                     for column in table.columns])
+
+    if after != None:
+        query = query.where(table.c.id > after)
+
+    return query.order_by(table.c.id) \
+                .execution_options(yield_per=EXPORT_CHUNK)
+
+def encode_rows(table, rows):
+    '''NDJSON for a chunk of rows from `export_query`.'''
+
+    names = table.columns.keys()
+    rows = [dict(zip(names, row)) for row in rows]
+
+    for name in BYTES_COLUMNS[table.name]:
+        for row in rows:
+            if isinstance(row[name], bytes):
+                row[name] = row[name].decode('ascii')
+
+    for column in table.columns:
+        if isinstance(column.type, JSON):
+            for row in rows:
+                if row[column.name] != None:
+                    row[column.name] = loads(row[column.name])
+
+    return b''.join([dumps(row) + b'\n' for row in rows])
+
+def export_rows(table, after=None):
+    '''Yields the NDJSON of `table` a chunk at a time.
+
+    It has a session of its own rather than the request's, since a response
+    is still being sent after its request has been torn down, and the chunks
+    can be asked for on different threads.'''
+
+    with Session() as session:
+        result = session.execute(export_query(table, after))
+
+        for rows in result.partitions():
+            yield encode_rows(table, rows)
+
+def refusal(current_user, table):
+    '''The response refusing to export `table` to `current_user`, or None if
+    they can have it.'''
+
+    if not is_admin(current_app.config, current_user):
+        return {
+            'status': 'fail',
+            'message': 'You don\'t have permission to export'
+        }, 403
+
+    if table not in TABLES:
+        return {
+            'status': 'fail',
+            'message': 'No such table can be exported'
+        }, 404
+
+    return None
+
+@api.route('/<string:table>')
+@api.response(400, 'Invalid after')
+@api.response(403, 'Only admins can export')
+@api.response(404, 'No such table')
+@api.param('table', 'Either users or posts')
+class Export(Resource):
+    @jwt_required()
+    @api.param('after', 'Only export rows with a greater id')
+    def get(self, table):
+        '''Export every row of a table as NDJSON, in order of id'''
+
+        rv = refusal(current_user, table)
+        if rv != None:
+            return rv
+
+        # A bad `after` mustn't quietly start a resumed export from the top.
+        after = request.args.get('after')
+        if after != None:
+            try:
+                after = int(after)
+            except ValueError:
+                return {
+                    'status': 'fail',
+                    'message': 'Invalid cursor'
+                }, 400
+
+        return Response(export_rows(TABLES[table], after),
+                        mimetype='application/x-ndjson')
+
+def read_checkpoint(checkpoint):
+    '''The offset into the file an import got to and the id of the last row
+    it committed, or 0 and None.'''
+
+    if checkpoint == None or not os.path.exists(checkpoint):
+        return 0, None
+
+    with open(checkpoint) as f:
+        state = json.load(f)
+        return state['offset'], state['id']
+
+def write_checkpoint(checkpoint, offset, id):
+    with open(checkpoint + '.tmp', 'w') as f:
+        json.dump({'offset': offset, 'id': id}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(checkpoint + '.tmp', checkpoint)
+
+def import_file(path, table, checkpoint=None, every=CHECKPOINT_ROWS,
+                engine=None):
+    '''Insert the rows in the NDJSON file at `path` (from an export) into
+    `table`, returning how many were inserted.
+
+    Rows are inserted `IMPORT_CHUNK` at a time with an executemany, so only a
+    chunk is in memory at once. Without a `checkpoint` they're all inserted in
+    one transaction, and an import that fails inserts nothing. With one, the
+    transaction is committed every `every` rows and the offset into the file
+    written to the `checkpoint` file afterwards, along with the id of the
+    last row. An import that's interrupted then carries on from its last
+    commit when it's run again with the same checkpoint, skipping any rows up
+    to that id. Rows added to the table by anything else in the meantime
+    don't change where it carries on from. If it was interrupted between a
+    commit and writing the checkpoint, running it again fails on the rows
+    that are already there rather than guessing which ones they are.
+
+    Keeping a table's search index up to date row by row is most of the work
+    of inserting, so when the table starts out empty the index is dropped and
+    built again in one go at the end. It's dropped in the same transaction as
+    the first rows are inserted, so the index is only ever missing while rows
+    without it are committed: without a `checkpoint` it's built again before
+    the one commit, and with one it's built again for whatever was committed
+    even if the import fails.'''
+
+    engine = engine or get_engine()
+    statement = insert(table)
+    names = set(table.columns.keys())
+    encoded = BYTES_COLUMNS[table.name]
+    chunk = IMPORT_CHUNK if checkpoint == None else min(IMPORT_CHUNK, every)
+    offset, last = read_checkpoint(checkpoint)
+    inserted = 0
+
+    with engine.connect() as connection:
+        index, create_index = SEARCH_INDEXES[table.name]
+        rebuild = False
+        if connection.dialect.name == 'sqlite':
+            # pysqlite doesn't start a transaction for DDL by itself, and the
+            # index has to be dropped in the one the rows go in.
+            connection.exec_driver_sql('BEGIN')
+            rebuild = connection.scalar(select(table.c.id).limit(1)) == None \
+                or connection.exec_driver_sql(
+                    'SELECT 1 FROM sqlite_master WHERE name = ?',
+                    (index,)).first() == None
+            if rebuild:
+                drop_search_index(connection, index)
+
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                rows = []
+                uncommitted = 0
+
+                for line in f:
+                    offset += len(line)
+                    if line.isspace():
+                        continue
+
+                    try:
+                        row = loads(line)
+                    except ValueError as e:
+                        raise ValueError('{}: bad JSON ending at byte {}: {}'
+                                         .format(path, offset, e))
+
+                    if not isinstance(row, dict) or row.keys() != names:
+                        raise ValueError('{}: the row ending at byte {} '
+                                         'doesn\'t have the columns of {}'
+                                         .format(path, offset, table.name))
+
+                    if last != None and row['id'] <= last:
+                        continue
+
+                    for name in encoded:
+                        row[name] = row[name].encode('ascii')
+
+                    rows.append(row)
+                    if len(rows) < chunk:
+                        continue
+
+                    connection.execute(statement, rows)
+                    inserted += len(rows)
+                    uncommitted += len(rows)
+                    last = rows[-1]['id']
+                    rows = []
+
+                    if checkpoint != None and uncommitted >= every:
+                        connection.commit()
+                        write_checkpoint(checkpoint, offset, last)
+                        uncommitted = 0
+
+                if len(rows) > 0:
+                    connection.execute(statement, rows)
+                    inserted += len(rows)
+                    last = rows[-1]['id']
+
+                if rebuild:
+                    create_index(Base.metadata, connection)
+
+                connection.commit()
+                rebuild = False
+                if checkpoint != None:
+                    write_checkpoint(checkpoint, offset, last)
+        finally:
+            # The import failed, so whatever wasn't committed is rolled back,
+            # which brings back the index if nothing was. If some rows were
+            # committed without it, it's built for them.
+            if rebuild:
+                connection.rollback()
+                create_index(Base.metadata, connection)
+                connection.commit()
+
+    return inserted
+
+@click.command('export')
+@click.argument('table', type=click.Choice(list(TABLES)))
+@click.option('--after', type=int, default=None,
+              help='Only export rows with a greater id.')
+@click.option('-o', '--output', type=click.File('wb'), default='-',
+              help='Where to write the NDJSON (stdout by default).')
+def export_command(table, after, output):
+    '''Export every row of a table as NDJSON.'''
+
+    for chunk in export_rows(TABLES[table], after):
+        output.write(chunk)
+
+@click.command('import')
+@click.argument('table', type=click.Choice(list(TABLES)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--checkpoint', type=click.Path(dir_okay=False), default=None,
+              help='File to keep track of progress in, so that an '
+                   'interrupted import can be carried on.')
+@click.option('--checkpoint-every', type=int, default=CHECKPOINT_ROWS,
+              help='Rows to commit at a time with --checkpoint.')
+def import_command(table, path, checkpoint, checkpoint_every):
+    '''Import rows into a table from an NDJSON export.'''
+
+    try:
+        inserted = import_file(path, TABLES[table], checkpoint,
+                               checkpoint_every)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    except IntegrityError as e:
+        raise click.ClickException('Some of the rows are already there: {}'
+                                   .format(e.orig))
+
+    click.echo('Imported {} {}'.format(inserted, table))
@@ -0,0 +1,156 @@
+'''Password hashing and checking in a pool of worker processes.
+
+bcrypt is slow on purpose, so a single hash at a high cost keeps a CPU busy for
+a good fraction of a second. Doing that on the request thread means a burst of
+logins holds every worker and starves the rest of the API. Instead the work is
+handed to a bounded process pool, and once too many operations are waiting new
+ones fail straight away with `HashingBusy` rather than queueing forever.
+
+Basic usage is like this:
+
+    import hashing
+    hashing.calibrate(0.25)     # Optional, picks the cost for ~250ms hashes
+    h = hashing.hash_password(b'honk')
+    hashing.check_password(b'honk', h)  # => True
+'''
+
+import math
+import multiprocessing
+import os
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+# The cost (log2 of the number of rounds) new hashes are made with. Hashes made
+# with any other cost still check fine, and ones with a lower cost get rehashed
+# on the next login (see `needs_rehash`).
+cost = int(os.getenv('BCRYPT_COST', 14))
+
+# `calibrate` never goes outside of these, however fast or slow the machine is.
+MIN_COST = 10
+MAX_COST = 16
+
+max_workers = int(os.getenv('BCRYPT_WORKERS', os.cpu_count() or 1))
+
+# How many operations can be running or waiting for a worker at once.
+max_pending = int(os.getenv('BCRYPT_MAX_PENDING', 4 * max_workers))
+
+class HashingBusy(Exception):
+    '''Raised when the pool already has `max_pending` operations in it.'''
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(max_pending)
+
+def _hash(password, cost):
+    return bcrypt.hashpw(password, bcrypt.gensalt(cost))
+
+def _check(password, hash):
+    return bcrypt.checkpw(password, hash)
+
+def _exit_with(pid):
+    while True:
+        time.sleep(1)
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            os._exit(0)
+
+def _start_worker(pid):
+    # The workers are children of the fork server rather than of the process
+    # using the pool, and they keep waiting for work if that process is killed
+    # without shutting the pool down (as a server's workers usually are). So
+    # each one watches for it to go away by itself.
+    threading.Thread(target=_exit_with, args=(pid,), daemon=True).start()
+
+def get_pool():
+    '''Create the pool the first time it's needed.
+
+    The workers come from a fork server rather than being forked from this
+    process, since forking a process that already has request threads running
+    can copy locks that are held by threads which don't exist in the child. Like
+    with any non-fork start method, a script that hashes passwords needs the
+    usual `if __name__ == '__main__':` guard.'''
+
+    global _pool
+
+    with _pool_lock:
+        if _pool == None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('forkserver'),
+                initializer=_start_worker,
+                initargs=(os.getpid(),))
+
+    return _pool
+
+def _reset_after_fork():
+    # A forked child can't use its parent's pool (the thread that feeds it
+    # isn't there), so it makes its own if it needs one.
+    global _pool, _pending
+    _pool = None
+    _pending = threading.BoundedSemaphore(max_pending)
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def submit(fn, *args):
+    '''Start running `fn` in the pool, returning a `concurrent.futures.Future`.'''
+
+    if not _pending.acquire(blocking=False):
+        raise HashingBusy()
+
+    try:
+        future = get_pool().submit(fn, *args)
+    except:
+        _pending.release()
+        raise
+
+    future.add_done_callback(lambda future: _pending.release())
+    return future
+
+def hash_password(password):
+    '''Hash `password` (bytes) with the configured cost.'''
+    return submit(_hash, password, cost).result()
+
+def check_password(password, hash):
+    '''Check `password` (bytes) against a hash from `hash_password`.'''
+    return submit(_check, password, hash).result()
+
+def hash_cost(hash):
+    '''Get the cost a hash was made with, e.g. 14 for `$2b$14$...`.'''
+
+    if isinstance(hash, str):
+        hash = hash.encode('utf8')
+
+    return int(hash.split(b'$')[2])
+
+def needs_rehash(hash):
+    '''Whether `hash` was made with a lower cost than new hashes are.
+
+    Only lower, since each worker process calibrates for itself and they can
+    end up a step apart. Rehashing whenever the costs differ would have them
+    rehash each other's hashes back and forth on every login, where this way
+    every hash ends up at the highest of their costs and stays there.'''
+
+    return hash_cost(hash) < cost
+
+def calibrate(target_seconds):
+    '''Pick the cost whose hashes take about `target_seconds` on this machine.
+
+    Each step up in cost doubles the time a hash takes, so it's enough to time
+    one hash at `MIN_COST` and extrapolate from there. This runs in the calling
+    process and is meant to be done once at startup.'''
+
+    global cost
+
+    begin = time.perf_counter()
+    _hash(b'calibration', MIN_COST)
+    elapsed = time.perf_counter() - begin
+
+    steps = math.floor(math.log2(target_seconds / elapsed))
+    cost = max(MIN_COST, min(MAX_COST, MIN_COST + steps))
+
+    return cost
@@ -0,0 +1,465 @@
+/*
+ * A Python binding for the hash table in `../hashtable.c`.
+ *
+ * `hashtable.Table` is an ordered mapping in the style of
+ * `collections.OrderedDict` (`move_to_end`, `popitem(last=False)` and so on),
+ * which can also keep an expiry time with each entry. That's everything
+ * `cache.LRUCache` needs, and it lets the cache keep its entries without a
+ * `(expires, value)` tuple and a float object for each one. Build it with:
+ *
+ *     python setup.py build_ext --inplace
+ *
+ * `cache.py` uses it if it's been built, and an `OrderedDict` otherwise.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <math.h>               /* INFINITY */
+
+#define HT_NO_MAIN
+#define HT_NO_THREADS           /* The GIL already keeps it to one at a time */
+#define HT_MALLOC PyMem_Malloc
+#define HT_CALLOC PyMem_Calloc
+#define HT_FREE PyMem_Free
+#include "hashtable.c"
+
+struct entry {
+        struct ht_entry e;      /* The key and value are strong references */
+        double expires;         /* INFINITY if it never expires */
+};
+
+typedef struct {
+        PyObject_HEAD
+        struct ht h;
+} Table;
+
+static int equal(void *a, void *b)
+{
+        /* `a` is the key in the table, which `__eq__` could remove. */
+        Py_INCREF(a);
+        int result = PyObject_RichCompareBool(a, b, Py_EQ);
+        Py_DECREF(a);
+        return result;
+}
+
+static int check(int err)
+{
+        if (err == HT_CHANGED)
+                PyErr_SetString(PyExc_RuntimeError,
+                                "Table changed during a lookup");
+        else if (err == HT_ERROR && !PyErr_Occurred())
+                PyErr_NoMemory();
+        return err < 0 ? -1 : err;
+}
+
+static int lookup(Table *t, PyObject *key, struct entry **found)
+{
+        Py_hash_t hash = PyObject_Hash(key);
+        if (hash == -1) return -1;
+        return check(ht_find(&t->h, key, (Py_uhash_t)hash,
+                             (struct ht_entry **)found));
+}
+
+static int insert(Table *t, PyObject *key, PyObject *value, double expires,
+                  int move_to_end)
+{
+        Py_hash_t hash = PyObject_Hash(key);
+        if (hash == -1) return -1;
+
+        struct entry *e;
+        int created = check(ht_insert(&t->h, key, (Py_uhash_t)hash,
+                                      (struct ht_entry **)&e));
+        if (created < 0) return -1;
+
+        PyObject *old = e->e.value;
+
+        if (created) {
+                Py_INCREF(key);
+                old = NULL;
+        } else if (move_to_end) {
+                ht_move_to_end(&t->h, &e->e, 1);
+        }
+
+        Py_INCREF(value);
+        e->e.value = value;
+        e->expires = expires;
+
+        /* Last, because it can run arbitrary code. */
+        Py_XDECREF(old);
+        return 0;
+}
+
+/* Remove `e`, returning a new reference to its value. */
+static PyObject *take(Table *t, struct entry *e)
+{
+        PyObject *key = e->e.key, *value = e->e.value;
+        ht_remove(&t->h, &e->e);
+        Py_DECREF(key);
+        return value;
+}
+
+static PyObject *key_error(PyObject *key)
+{
+        PyErr_SetObject(PyExc_KeyError, key);
+        return NULL;
+}
+
+/* Empty the table, releasing every key and value. */
+static int clear(Table *t)
+{
+        /* Releasing the entries can run code that uses the table, so it has
+         * to be empty and usable before that happens. */
+        struct ht old = t->h;
+        if (ht_init_with(&t->h, equal, sizeof (struct entry))) {
+                t->h = old;
+                PyErr_NoMemory();
+                return -1;
+        }
+
+        /* So a lookup that cleared the table notices. */
+        t->h.version = old.version + 1;
+
+        for (struct ht_entry *e = ht_next(&old, NULL); e; e = ht_next(&old, e)) {
+                Py_CLEAR(e->key);
+                Py_CLEAR(e->value);
+        }
+
+        ht_free(&old);
+        return 0;
+}
+
+static PyObject *Table_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+        if (PyTuple_GET_SIZE(args) || (kwds && PyDict_GET_SIZE(kwds))) {
+                PyErr_SetString(PyExc_TypeError, "Table() takes no arguments");
+                return NULL;
+        }
+
+        Table *t = (Table *)type->tp_alloc(type, 0);
+        if (!t) return NULL;
+
+        if (ht_init_with(&t->h, equal, sizeof (struct entry))) {
+                Py_DECREF(t);
+                return PyErr_NoMemory();
+        }
+
+        return (PyObject *)t;
+}
+
+static int Table_traverse(Table *t, visitproc visit, void *arg)
+{
+        for (struct ht_entry *e = ht_next(&t->h, NULL); e; e = ht_next(&t->h, e)) {
+                Py_VISIT(e->key);
+                Py_VISIT(e->value);
+        }
+        return 0;
+}
+
+static int Table_clear(Table *t)
+{
+        return clear(t);
+}
+
+static void Table_dealloc(Table *t)
+{
+        PyObject_GC_UnTrack(t);
+
+        for (struct ht_entry *e = ht_next(&t->h, NULL); e; e = ht_next(&t->h, e)) {
+                Py_CLEAR(e->key);
+                Py_CLEAR(e->value);
+        }
+
+        ht_free(&t->h);
+        Py_TYPE(t)->tp_free((PyObject *)t);
+}
+
+static Py_ssize_t Table_length(Table *t)
+{
+        return t->h.num_keys;
+}
+
+static PyObject *Table_subscript(Table *t, PyObject *key)
+{
+        struct entry *e;
+        if (lookup(t, key, &e)) return NULL;
+        if (!e) return key_error(key);
+        return Py_NewRef(e->e.value);
+}
+
+static int Table_ass_subscript(Table *t, PyObject *key, PyObject *value)
+{
+        if (value)
+                return insert(t, key, value, INFINITY, 0);
+
+        struct entry *e;
+        if (lookup(t, key, &e)) return -1;
+        if (!e) {
+                key_error(key);
+                return -1;
+        }
+
+        Py_DECREF(take(t, e));
+        return 0;
+}
+
+static int Table_contains(Table *t, PyObject *key)
+{
+        struct entry *e;
+        if (lookup(t, key, &e)) return -1;
+        return e != NULL;
+}
+
+/* The items as a list of keys, values or (key, value) tuples. */
+static PyObject *list(Table *t, int what)
+{
+        PyObject *result = PyList_New(t->h.num_keys);
+        if (!result) return NULL;
+
+        Py_ssize_t i = 0;
+        for (struct ht_entry *e = ht_next(&t->h, NULL); e; e = ht_next(&t->h, e)) {
+                PyObject *item = what == 0 ? Py_NewRef(e->key)
+                               : what == 1 ? Py_NewRef(e->value)
+                               : PyTuple_Pack(2, e->key, e->value);
+                if (!item) {
+                        Py_DECREF(result);
+                        return NULL;
+                }
+                PyList_SET_ITEM(result, i++, item);
+        }
+
+        return result;
+}
+
+static PyObject *Table_iter(Table *t)
+{
+        /* Iterating over a copy of the keys means changing the table while
+         * iterating is safe, if not very useful. */
+        PyObject *keys = list(t, 0);
+        if (!keys) return NULL;
+        PyObject *iter = PyObject_GetIter(keys);
+        Py_DECREF(keys);
+        return iter;
+}
+
+static PyObject *Table_keys(Table *t, PyObject *unused)
+{
+        return list(t, 0);
+}
+
+static PyObject *Table_values(Table *t, PyObject *unused)
+{
+        return list(t, 1);
+}
+
+static PyObject *Table_items(Table *t, PyObject *unused)
+{
+        return list(t, 2);
+}
+
+static PyObject *Table_get(Table *t, PyObject *const *args, Py_ssize_t nargs)
+{
+        if (nargs < 1 || nargs > 2) {
+                PyErr_SetString(PyExc_TypeError,
+                                "get expected 1 or 2 arguments");
+                return NULL;
+        }
+
+        struct entry *e;
+        if (lookup(t, args[0], &e)) return NULL;
+        if (e) return Py_NewRef(e->e.value);
+        return Py_NewRef(nargs > 1 ? args[1] : Py_None);
+}
+
+static PyObject *Table_get_fresh(Table *t, PyObject *const *args,
+                                 Py_ssize_t nargs)
+{
+        if (nargs < 2 || nargs > 3) {
+                PyErr_SetString(PyExc_TypeError,
+                                "get_fresh expected 2 or 3 arguments");
+                return NULL;
+        }
+
+        double now = PyFloat_AsDouble(args[1]);
+        if (now == -1.0 && PyErr_Occurred()) return NULL;
+
+        PyObject *missing = nargs > 2 ? args[2] : Py_None;
+
+        struct entry *e;
+        if (lookup(t, args[0], &e)) return NULL;
+        if (!e) return Py_NewRef(missing);
+
+        if (e->expires < now) {
+                Py_DECREF(take(t, e));
+                return Py_NewRef(missing);
+        }
+
+        ht_move_to_end(&t->h, &e->e, 1);
+        return Py_NewRef(e->e.value);
+}
+
+static PyObject *Table_set(Table *t, PyObject *const *args, Py_ssize_t nargs)
+{
+        if (nargs < 2 || nargs > 3) {
+                PyErr_SetString(PyExc_TypeError,
+                                "set expected 2 or 3 arguments");
+                return NULL;
+        }
+
+        double expires = INFINITY;
+        if (nargs > 2 && args[2] != Py_None) {
+                expires = PyFloat_AsDouble(args[2]);
+                if (expires == -1.0 && PyErr_Occurred()) return NULL;
+        }
+
+        if (insert(t, args[0], args[1], expires, 1)) return NULL;
+        Py_RETURN_NONE;
+}
+
+static PyObject *Table_pop(Table *t, PyObject *args)
+{
+        PyObject *key, *missing = NULL;
+        if (!PyArg_UnpackTuple(args, "pop", 1, 2, &key, &missing))
+                return NULL;
+
+        struct entry *e;
+        if (lookup(t, key, &e)) return NULL;
+        if (e) return take(t, e);
+        if (missing) return Py_NewRef(missing);
+        return key_error(key);
+}
+
+static PyObject *Table_popitem(Table *t, PyObject *args, PyObject *kwds)
+{
+        static char *kwlist[] = {"last", NULL};
+        int last = 1;
+        if (!PyArg_ParseTupleAndKeywords(args, kwds, "|p:popitem", kwlist,
+                                         &last))
+                return NULL;
+
+        if (t->h.num_keys == 0) {
+                PyErr_SetString(PyExc_KeyError, "Table is empty");
+                return NULL;
+        }
+
+        struct entry *e = (struct entry *)(last ? t->h.last : t->h.first);
+        PyObject *key = Py_NewRef(e->e.key);
+        PyObject *value = take(t, e);
+        PyObject *item = PyTuple_Pack(2, key, value);
+        Py_DECREF(key);
+        Py_DECREF(value);
+        return item;
+}
+
+static PyObject *Table_move_to_end(Table *t, PyObject *args, PyObject *kwds)
+{
+        static char *kwlist[] = {"key", "last", NULL};
+        PyObject *key;
+        int last = 1;
+        if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|p:move_to_end", kwlist,
+                                         &key, &last))
+                return NULL;
+
+        struct entry *e;
+        if (lookup(t, key, &e)) return NULL;
+        if (!e) return key_error(key);
+
+        ht_move_to_end(&t->h, &e->e, last);
+        Py_RETURN_NONE;
+}
+
+static PyObject *Table_clear_method(Table *t, PyObject *unused)
+{
+        if (clear(t)) return NULL;
+        Py_RETURN_NONE;
+}
+
+static PyObject *Table_sizeof(Table *t, PyObject *unused)
+{
+        return PyLong_FromSize_t(sizeof *t
+                                 + t->h.num_buckets * sizeof *t->h.bucket
+                                 + t->h.num_keys * sizeof (struct entry));
+}
+
+static PyMethodDef Table_methods[] = {
+        {"get", (PyCFunction)(void (*)(void))Table_get, METH_FASTCALL,
+         "get(key, default=None)\n--\n\n"
+         "The value for key, or default if it isn't there."},
+        {"get_fresh", (PyCFunction)(void (*)(void))Table_get_fresh,
+         METH_FASTCALL,
+         "get_fresh(key, now, default=None)\n--\n\n"
+         "The value for key, moving it to the end, or default if it isn't\n"
+         "there or expired before now (in which case it's removed)."},
+        {"set", (PyCFunction)(void (*)(void))Table_set, METH_FASTCALL,
+         "set(key, value, expires=None)\n--\n\n"
+         "Set key to value, expiring at expires, and move it to the end."},
+        {"pop", (PyCFunction)Table_pop, METH_VARARGS,
+         "pop(key[, default])\n--\n\n"
+         "Remove key and return its value, or default if it isn't there."},
+        {"popitem", (PyCFunction)(void (*)(void))Table_popitem,
+         METH_VARARGS | METH_KEYWORDS,
+         "popitem(last=True)\n--\n\n"
+         "Remove and return the last (key, value) pair, or the first one."},
+        {"move_to_end", (PyCFunction)(void (*)(void))Table_move_to_end,
+         METH_VARARGS | METH_KEYWORDS,
+         "move_to_end(key, last=True)\n--\n\n"
+         "Move key to the end, or to the start if last is false."},
+        {"clear", (PyCFunction)Table_clear_method, METH_NOARGS,
+         "Remove everything."},
+        {"keys", (PyCFunction)Table_keys, METH_NOARGS,
+         "A list of the keys, in order."},
+        {"values", (PyCFunction)Table_values, METH_NOARGS,
+         "A list of the values, in order."},
+        {"items", (PyCFunction)Table_items, METH_NOARGS,
+         "A list of (key, value) pairs, in order."},
+        {"__sizeof__", (PyCFunction)Table_sizeof, METH_NOARGS,
+         "The memory used by the table, not counting its keys and values."},
+        {NULL}
+};
+
+static PyMappingMethods Table_as_mapping = {
+        .mp_length = (lenfunc)Table_length,
+        .mp_subscript = (binaryfunc)Table_subscript,
+        .mp_ass_subscript = (objobjargproc)Table_ass_subscript,
+};
+
+static PySequenceMethods Table_as_sequence = {
+        .sq_contains = (objobjproc)Table_contains,
+};
+
+static PyTypeObject TableType = {
+        PyVarObject_HEAD_INIT(NULL, 0)
+        .tp_name = "hashtable.Table",
+        .tp_doc = PyDoc_STR("An ordered hash table with optional expiry times."),
+        .tp_basicsize = sizeof (Table),
+        .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,
+        .tp_new = Table_new,
+        .tp_dealloc = (destructor)Table_dealloc,
+        .tp_traverse = (traverseproc)Table_traverse,
+        .tp_clear = (inquiry)Table_clear,
+        .tp_iter = (getiterfunc)Table_iter,
+        .tp_methods = Table_methods,
+        .tp_as_mapping = &Table_as_mapping,
+        .tp_as_sequence = &Table_as_sequence,
+};
+
+static struct PyModuleDef module = {
+        PyModuleDef_HEAD_INIT,
+        .m_name = "hashtable",
+        .m_doc = "The hash table from hashtable.c as a Python type.",
+        .m_size = -1,
+};
+
+PyMODINIT_FUNC PyInit_hashtable(void)
+{
+        if (PyType_Ready(&TableType) < 0) return NULL;
+
+        PyObject *m = PyModule_Create(&module);
+        if (!m) return NULL;
+
+        if (PyModule_AddObjectRef(m, "Table", (PyObject *)&TableType) < 0) {
+                Py_DECREF(m);
+                return NULL;
+        }
+
+        return m;
+}
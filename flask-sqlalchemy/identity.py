@@ -0,0 +1,51 @@
+'''Resolving the `sub` claim of a JWT to the user it belongs to.
+
+Every `@jwt_required()` endpoint needs `current_user`, so looking it up in the
+database each time adds a query to every authenticated request. Instead the
+columns we need are kept in an `Identity` tuple in an LRU cache, keyed by user
+id. Anything that changes a user has to call `invalidate` after committing.
+
+`Identity` is a plain tuple rather than a `User` so that it can be shared
+between the sessions of different requests. Code that needs the `User` itself
+should query it by `current_user.id`.
+'''
+
+import os
+
+from collections import namedtuple
+
+from sqlalchemy import select
+
+import metrics
+
+from cache import LRUCache
+from model import User
+from session import session
+
+Identity = namedtuple('Identity', ['id', 'name', 'username'])
+
+cache = LRUCache(maxsize=int(os.getenv('IDENTITY_CACHE_SIZE', 10000)),
+                 ttl=float(os.getenv('IDENTITY_CACHE_TTL', 300)))
+
+metrics.register('identity_cache', cache.stats)
+
+def identity_query(id):
+    return select(User.id, User.name, User.username).filter_by(id=id)
+
+def load_identity(id):
+    identity = cache.get(id)
+
+    if identity == None:
+        row = session.execute(identity_query(id)).one_or_none()
+
+        # Don't cache misses, the user might not have been committed yet.
+        if row == None:
+            return None
+
+        identity = Identity(*row)
+        cache.set(id, identity)
+
+    return identity
+
+def invalidate(id):
+    cache.delete(id)
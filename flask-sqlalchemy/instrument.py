@@ -0,0 +1,134 @@
+'''Per-request query instrumentation.
+
+This hooks into the engine's cursor events to count the statements each request
+runs, how long they take in total, and how many times it ran each one. A request
+that goes over `QUERY_BUDGET` statements or runs any one statement more than
+`QUERY_REPEAT_LIMIT` times gets a warning in the log, or fails with
+`QueryBudgetExceeded` when `QUERY_STRICT` is set, which is what the tests should
+run with. Either way the totals are sent back in a `Server-Timing` header.
+
+Statements are told apart by their SQL alone, whatever the parameters, so an N+1
+(the same query for each of a list of rows, with a different id each time)
+shows up as one statement run N times.
+
+Basic usage is like this:
+
+    import instrument
+    app.config.update(QUERY_BUDGET=10, QUERY_REPEAT_LIMIT=2, QUERY_STRICT=True)
+    instrument.init_app(app)
+'''
+
+import contextvars
+import logging
+import time
+
+from collections import Counter
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class QueryBudgetExceeded(Exception):
+    '''Raised at the end of a request that broke the budget in strict mode.'''
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.time += elapsed
+        self.statements[statement] += 1
+
+    def repeated(self, limit):
+        '''The statements run more than `limit` times, and how many times.'''
+        return [(statement, n) for statement, n in self.statements.items()
+                if n > limit]
+
+# A context variable rather than a thread local so this also works for code
+# running on an event loop.
+current_stats = contextvars.ContextVar('current_stats', default=None)
+
+totals = Counter()
+
+metrics.register('queries', lambda: dict(totals))
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    context._query_start = time.perf_counter()
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    stats = current_stats.get()
+    if stats != None:
+        elapsed = time.perf_counter() - context._query_start
+        stats.record(statement, elapsed)
+
+def start_request():
+    current_stats.set(QueryStats())
+
+def finish_request(method, path, budget, repeat_limit, strict):
+    '''Check the current request against the budget and the repeat limit.
+
+    Returns the value for its `Server-Timing` header, or None if the request
+    wasn't being instrumented.'''
+
+    stats = current_stats.get()
+    if stats == None:
+        return None
+
+    current_stats.set(None)
+
+    totals['requests'] += 1
+    totals['statements'] += stats.count
+
+    problems = []
+
+    if stats.count > budget:
+        totals['over_budget'] += 1
+        problems.append('{} queries (budget is {})'.format(stats.count, budget))
+
+    repeated = stats.repeated(repeat_limit)
+    if len(repeated) > 0:
+        totals['repeated'] += 1
+        problems.append('repeated queries: {}'.format('; '.join(
+            '{} ({} times)'.format(statement, n) for statement, n in repeated)))
+
+    if len(problems) > 0:
+        message = '{} {}: {}'.format(method, path, ', '.join(problems))
+        if strict:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+    return 'db;dur={:.2f};desc="{} queries"'.format(stats.time * 1000,
+                                                    stats.count)
+
+def init_engine(engine=Engine):
+    '''Listen to `engine`, or by default to every engine, even ones that are
+    yet to be created. Statements outside of a request aren't counted anyway.'''
+
+    if not event.contains(engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+def init_app(app):
+    init_engine()
+
+    app.before_request(start_request)
+
+    @app.after_request
+    def check_query_budget(response):
+        timing = finish_request(request.method, request.path,
+                                app.config.get('QUERY_BUDGET', 10),
+                                app.config.get('QUERY_REPEAT_LIMIT', 2),
+                                app.config.get('QUERY_STRICT', False))
+        if timing != None:
+            response.headers.add('Server-Timing', timing)
+        return response
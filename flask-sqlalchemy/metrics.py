@@ -0,0 +1,46 @@
+'''Counters from the API's caches, pools and queues.
+
+Any module can publish its counters by registering a function that returns a
+JSON-serializable dict:
+
+    import metrics
+    metrics.register('identity_cache', cache.stats)
+
+`GET /metrics` then returns the result of every registered function, keyed by
+name. They say a lot about the traffic, so like exports it's only for the
+users whose ids are in `ADMIN_USER_IDS`.
+'''
+
+from flask import current_app
+from flask_restx import Namespace, Resource
+from flask_jwt_extended import jwt_required, current_user
+
+api = Namespace('metrics', description='Operational metrics')
+
+sources = {}
+
+def register(name, fn):
+    sources[name] = fn
+
+def snapshot():
+    '''The result of every registered function, keyed by name.'''
+    return {name: fn() for name, fn in sources.items()}
+
+def report(current_user):
+    '''The response to `current_user` asking for the metrics.'''
+
+    if current_user.id not in current_app.config['ADMIN_USER_IDS']:
+        return {
+            'status': 'fail',
+            'message': 'You don\'t have permission to see the metrics'
+        }, 403
+
+    return snapshot()
+
+@api.route('')
+@api.response(403, 'Only admins can see the metrics')
+class Metrics(Resource):
+    @jwt_required()
+    def get(self):
+        '''Get the current value of every registered counter'''
+        return report(current_user)
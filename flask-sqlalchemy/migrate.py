@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+'''Creating and upgrading the database schema.
+
+Nothing creates tables when the app starts, so this has to be run once before
+the first start and again whenever the models change. It creates any tables,
+indexes and search tables that are missing, and adds the columns that have
+been added to a model since its table was created. Running it on a database
+that's already up to date does nothing, so it's safe to run on every deploy.
+
+Basic usage is like this:
+
+    flask --app app init-db
+    python migrate.py           # The same thing
+'''
+
+import click
+
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+
+# SQLAlchemy works with metaclasses to create a list of all the database models
+# defined in `model.py`. This works by storing them all in an object called the
+# `metadata` which is stored in the `Base` (from DeclarativeBase) which all of
+# our models inherit from. In order for the database models to be accessible
+# here for `create_all`, we have to get the same `Base` that was used when we
+# declared the models.
+from model import Base
+from session import get_engine
+
+def add_missing_columns(connection):
+    '''Add columns missing from existing tables, returning their names.
+
+    `create_all` only creates tables that don't exist yet, so it never changes
+    the ones that do. A column added this way has to be nullable or have a
+    `server_default`, since SQLite has no other value to give the existing
+    rows.'''
+
+    added = []
+    inspector = inspect(connection)
+
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column['name']
+                    for column in inspector.get_columns(table.name)}
+
+        for column in table.columns:
+            if column.name in existing:
+                continue
+
+            connection.exec_driver_sql('ALTER TABLE {} ADD COLUMN {}'.format(
+                table.name,
+                CreateColumn(column).compile(dialect=connection.dialect)))
+            added.append('{}.{}'.format(table.name, column.name))
+
+    return added
+
+def init_db(engine=None):
+    '''Bring the schema of the database up to date with the models.'''
+
+    engine = engine or get_engine()
+
+    # The columns go first, since the indexes created below can be on them.
+    with engine.begin() as connection:
+        added = add_missing_columns(connection)
+
+    # This also fires the `after_create` listeners in `model.py`, which create
+    # any missing indexes and the username search table.
+    Base.metadata.create_all(engine)
+
+    return added
+
+@click.command('init-db')
+def init_db_command():
+    '''Create or upgrade the database schema.'''
+
+    for column in init_db():
+        click.echo('Added {}'.format(column))
+    click.echo('The database is up to date')
+
+if __name__ == '__main__':
+    init_db_command()
@@ -1,11 +1,11 @@
-import bcrypt
+import deliverability
+import hashing
 
-from sqlalchemy import ForeignKey, Column
+from sqlalchemy import ForeignKey, Column, Index, event, false, func, update
 from sqlalchemy.types import JSON
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.orm import DeclarativeBase, Mapped, relationship, mapped_column
 
-from email_validator import validate_email
-
 class Base(DeclarativeBase): pass
 
 class User(Base):
@@ -29,23 +29,51 @@ class User(Base):
     validated_email: Mapped[str] = mapped_column(unique=True)
     password_hash: Mapped[str] = mapped_column(nullable=False, unique=True)
 
+    # Whether the domain of `validated_email` is known to accept email. See
+    # `deliverability.py`.
+    email_verified: Mapped[bool] = mapped_column(default=False,
+                                                 server_default=false())
+
     posts: Mapped[list['Post']] = relationship(back_populates='author')
 
+    # Username suggestions match case-insensitively, so the prefix search in
+    # `suggestion.py` needs an index on the lowercased username to seek on.
+    __table_args__ = (
+        Index('ix_users_username_lower', func.lower(username)),
+    )
+
+    # These hand the actual bcrypt work to the pool in `hashing.py`, so they
+    # can raise `hashing.HashingBusy` when it's overloaded.
+
     def set_password(self, password):
-        self.password_hash = bcrypt.hashpw(password.encode('utf8'), bcrypt.gensalt(14))
+        self.password_hash = hashing.hash_password(password.encode('utf8'))
 
     def check_password(self, password):
-        return bcrypt.checkpw(password, self.password_hash)
+        return hashing.check_password(password, self.password_hash)
 
     def set_email(self, email):
         try:
             # email email email email
-            self.validated_email = validate_email(email).email
+            self.validated_email, self.email_verified = \
+                deliverability.validate(email)
             return True, 'Success'
         except Exception as e:
             # NOTE: Might be worth customizing the error messages at some point.
             return False, str(e)
 
+    def verify_email_later(self):
+        '''Have the email's domain checked in the background if it hasn't been
+        yet. Call this after committing, since it needs the user's id.'''
+
+        if self.email_verified:
+            return
+
+        # Only if it's still the same address by the time the check is done.
+        deliverability.verify_later(self.validated_email, update(User)
+            .where(User.id == self.id,
+                   User.validated_email == self.validated_email)
+            .values(email_verified=True))
+
     def update(self, user_data):
         '''Update the user'''
 
@@ -68,6 +96,11 @@ class User(Base):
         if len(user_data) > 0:
             return False, 'Extraneous data in update'
 
+        if name != None:
+            self.name = name
+        if username != None:
+            self.username = username
+
         return True, 'Success'
 
 class Post(Base):
@@ -77,3 +110,107 @@ class Post(Base):
     author_id: Mapped[int] = mapped_column(ForeignKey('users.id'))
     author: Mapped['User'] = relationship(back_populates='posts')
     body = Column(JSON)
+
+    # Feeds are paged by id (see `post.py`), so an author's feed is a seek into
+    # this index rather than a scan of all their posts.
+    __table_args__ = (
+        Index('ix_posts_author_id_id', 'author_id', 'id'),
+    )
+
+# `create_all` skips the indexes of tables that already exist, which would leave
+# older databases without any index added since they were created.
+@event.listens_for(Base.metadata, 'after_create')
+def create_missing_indexes(target, connection, **kw):
+    for table in target.sorted_tables:
+        for index in table.indexes:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+def create_search_index(connection, name, table, column, content=None,
+                        value='{}.{}', tokenize=None):
+    '''Create the FTS5 index `name` over `column` of `table`, if it isn't
+    there, along with the triggers that keep it in sync and fill it with the
+    rows already in `table`.
+
+    It's an external content table, so it only stores the index itself and
+    reads the text from `content` (by default `table`) when it needs it. The
+    triggers index `value`, formatted with `new` or `old` and `column`, which
+    has to give the same text as `content` does.'''
+
+    if connection.dialect.name != 'sqlite':
+        return
+
+    exists = connection.exec_driver_sql(
+        'SELECT 1 FROM sqlite_master WHERE name = ?', (name,)
+    ).first()
+
+    if exists:
+        return
+
+    new = value.format('new', column)
+    old = value.format('old', column)
+    options = ", tokenize='{}'".format(tokenize) if tokenize != None else ''
+
+    connection.exec_driver_sql(
+        "CREATE VIRTUAL TABLE {0} USING fts5({1}, content='{2}', "
+        "content_rowid='id'{3})"
+        .format(name, column, content or table, options)
+    )
+    connection.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS {0}_insert AFTER INSERT ON {1} BEGIN "
+        "INSERT INTO {0}(rowid, {2}) VALUES (new.id, {3}); END"
+        .format(name, table, column, new)
+    )
+    connection.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS {0}_delete AFTER DELETE ON {1} BEGIN "
+        "INSERT INTO {0}({0}, rowid, {2}) VALUES ('delete', old.id, {3}); END"
+        .format(name, table, column, old)
+    )
+    connection.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS {0}_update AFTER UPDATE OF {2} "
+        "ON {1} BEGIN "
+        "INSERT INTO {0}({0}, rowid, {2}) VALUES ('delete', old.id, {3}); "
+        "INSERT INTO {0}(rowid, {2}) VALUES (new.id, {4}); END"
+        .format(name, table, column, old, new)
+    )
+    connection.exec_driver_sql(
+        "INSERT INTO {0}({0}) VALUES ('rebuild')".format(name)
+    )
+
+def drop_search_index(connection, name):
+    '''Drop the FTS5 index `name` and its triggers, if they're there. Bulk
+    inserts drop it and create it again afterwards, which is a lot quicker
+    than keeping it up to date row by row.'''
+
+    for trigger in ['insert', 'delete', 'update']:
+        connection.exec_driver_sql(
+            'DROP TRIGGER IF EXISTS {}_{}'.format(name, trigger))
+    connection.exec_driver_sql('DROP TABLE IF EXISTS {}'.format(name))
+
+# The suggestion endpoint also matches usernames that merely contain the search
+# string, which a B-tree index can't help with. This is a trigram index over
+# `users.username`.
+#
+# This is hooked into the metadata rather than the `users` table so that it's
+# also created (and backfilled) for databases that existed before the index.
+@event.listens_for(Base.metadata, 'after_create')
+def create_username_index(target, connection, **kw):
+    create_search_index(connection, 'users_username_fts', 'users', 'username',
+                        tokenize='trigram')
+
+# Post search (see `post.py`) goes through an FTS5 index of the post bodies.
+# `body` is a JSON column, so what's stored is the body JSON encoded, with
+# quotes around it and non-ASCII characters escaped. The index is of the
+# decoded text instead, and its content table is a view giving that text, so
+# FTS5 only stores the index itself and `snippet` can still read the bodies.
+@event.listens_for(Base.metadata, 'after_create')
+def create_post_body_index(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+
+    connection.exec_driver_sql(
+        "CREATE VIEW IF NOT EXISTS posts_body_text AS "
+        "SELECT id, json_extract(body, '$') AS body FROM posts"
+    )
+    create_search_index(connection, 'posts_body_fts', 'posts', 'body',
+                        content='posts_body_text',
+                        value="json_extract({}.{}, '$')")
@@ -1,49 +1,392 @@
-from flask import request
+import html
+import logging
+import secrets
+
+from flask import request, current_app
 from flask_restx import Namespace, Resource, fields
 from flask_jwt_extended import jwt_required, current_user
+from sqlalchemy import bindparam, insert, select, text
+from sqlalchemy.orm import joinedload, contains_eager
+
+import writebehind
 
 from model import User, Post
+from response_cache import responses
 from session import session
-from schema import PostSchema
+from schema import post_schema, posts_schema
 
 api = Namespace('post', description='Post operations')
 
+logger = logging.getLogger(__name__)
+
+# Pages of the feed are bounded, no matter what the client asks for.
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# The most posts `/post/bulk` takes in one request.
+MAX_BULK_POSTS = 1000
+
+# Seconds a request waits for its post to be committed in write-behind mode.
+WRITE_BEHIND_TIMEOUT = 30
+
+# The most words a search can have.
+MAX_SEARCH_TERMS = 16
+
+# Only this many of the newest posts matching a search are ranked. Ranking is
+# most of the work of a search, so this keeps a search for a common word about
+# as quick as one for a rare word, at the cost of older posts only turning up
+# for searches that don't match many newer ones.
+SEARCH_WINDOW = 10000
+
+# What `snippet()` puts around the words matched, to be swapped for `<mark>`
+# tags once the rest of the snippet has been escaped. They're random so that no
+# post can have them in it.
+SNIPPET_MARKERS = ('\x02' + secrets.token_hex(8),
+                   '\x03' + secrets.token_hex(8))
+
+def feed(author, after, limit):
+    '''A query for a page of posts, newest first, optionally only those by
+    `author`.
+
+    This is keyset pagination: `after` is the id of the last post on the
+    previous page and the next page starts below it, so the database seeks
+    straight to it (through `ix_posts_author_id_id` for an author's feed)
+    instead of counting its way past an OFFSET. The authors come back in the
+    same query.'''
+
+    query = select(Post)
+
+    if author != None:
+        query = query.join(Post.author) \
+                     .options(contains_eager(Post.author)) \
+                     .where(User.username == author)
+    else:
+        query = query.options(joinedload(Post.author))
+
+    if after != None:
+        query = query.where(Post.id < after)
+
+    return query.order_by(Post.id.desc()).limit(limit)
+
+def parse_feed_cursor(cursor):
+    '''Turn a cursor from `next` back into the id of the last post on the
+    previous page. Raises ValueError if it isn't one.'''
+
+    if cursor == None:
+        return None
+
+    try:
+        return int(cursor)
+    except ValueError:
+        raise ValueError('Invalid cursor') from None
+
+# Searching takes a few queries: one for a page of the best matches, and one
+# each for their snippets and their posts. They're built here rather than run
+# so that `bench/search.py` can time them (see `search` for running them).
+
+def search_match(q):
+    '''An FTS5 query for posts containing every word in `q`.
+
+    Each word is quoted, so the client can't use (or trip over) FTS5's query
+    syntax. Raises ValueError if there aren't any words or there are too
+    many.'''
+
+    words = (q or '').split()
+
+    if len(words) == 0:
+        raise ValueError('Expected something to search for in q')
+    if len(words) > MAX_SEARCH_TERMS:
+        raise ValueError('At most {} words can be searched for at once'
+                         .format(MAX_SEARCH_TERMS))
+
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+def parse_search_cursor(cursor):
+    '''Turn a cursor from `next` back into the rank and id of the last result
+    on the previous page. Raises ValueError if it isn't one.'''
+
+    if cursor == None:
+        return None
+
+    rank, _, id = cursor.rpartition(':')
+    try:
+        return float(rank), int(id)
+    except ValueError:
+        raise ValueError('Invalid cursor') from None
+
+def search_page(match, after, limit):
+    '''A query for the ids and BM25 ranks of a page of posts matching
+    `match`, best first.
+
+    Only the newest `SEARCH_WINDOW` matches are ranked: FTS5 hands back
+    matches in rowid order, so it can stop after those rather than ranking
+    them all. This is keyset pagination on `(rank, id)`: `after` is the pair
+    for the last post on the previous page, so nothing is skipped over with
+    an OFFSET. Snippets are left to `search_snippets` so they're only made for
+    the posts on the page. Ranks can shift a little as posts come and go, so
+    a post can now and then move across a page boundary.'''
+
+    sql = 'SELECT id, rank FROM (SELECT rowid AS id, rank ' \
+          'FROM posts_body_fts WHERE posts_body_fts MATCH :match ' \
+          'ORDER BY rowid DESC LIMIT :window) '
+    if after != None:
+        sql += 'WHERE rank > :rank OR (rank = :rank AND id > :id) '
+    sql += 'ORDER BY rank, id LIMIT :limit'
+
+    query = text(sql).bindparams(match=match, window=SEARCH_WINDOW,
+                                 limit=limit)
+    if after != None:
+        query = query.bindparams(rank=after[0], id=after[1])
+    return query
+
+def search_snippets(match, ids):
+    '''A query for a snippet of each post in `ids` around the words matched,
+    which are between the `SNIPPET_MARKERS` (see `highlight`).'''
+
+    return text("SELECT rowid AS id, snippet(posts_body_fts, 0, :start, "
+                ":end, '…', 16) AS snippet FROM posts_body_fts "
+                "WHERE posts_body_fts MATCH :match AND rowid IN :ids") \
+        .bindparams(bindparam('ids', expanding=True)) \
+        .bindparams(match=match, ids=list(ids), start=SNIPPET_MARKERS[0],
+                    end=SNIPPET_MARKERS[1])
+
+def highlight(snippet):
+    '''HTML for a snippet from `search_snippets`: the body escaped, with the
+    words matched wrapped in `<mark>` tags.'''
+
+    if snippet == None:
+        return None
+
+    start, end = SNIPPET_MARKERS
+    return html.escape(snippet).replace(start, '<mark>') \
+                               .replace(end, '</mark>')
+
+def search_posts(ids):
+    '''A query for the posts in `ids`, and their authors.'''
+
+    return select(Post).options(joinedload(Post.author)) \
+                       .where(Post.id.in_(list(ids)))
+
+def search_results(page, snippets, posts, limit):
+    '''The response for a page of search results, from the rows of the
+    three queries above.'''
+
+    snippets = {row.id: highlight(row.snippet) for row in snippets}
+    posts = {p.id: p for p in posts}
+    results = []
+
+    # A post deleted since the page was found is left out.
+    for row in page:
+        if row.id in posts:
+            result = post_schema.dump(posts[row.id])
+            result['snippet'] = snippets.get(row.id)
+            results.append(result)
+
+    return {
+        'status': 'success',
+        'results': results,
+        'next': '{!r}:{}'.format(page[-1].rank, page[-1].id)
+                if len(page) == limit else None
+    }
+
+# These are the request logic of each route, called by the resources below.
+# Each one returns what a flask-restx method would.
+
+def search(args):
+    '''A page of the posts matching the query string `args`.'''
+
+    limit = args.get('limit', DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    try:
+        match = search_match(args.get('q'))
+        after = parse_search_cursor(args.get('after'))
+    except ValueError as e:
+        return {
+            'status': 'fail',
+            'message': str(e)
+        }, 400
+
+    page = session.execute(search_page(match, after, limit)).all()
+    ids = [row.id for row in page]
+    snippets, posts = [], []
+
+    if len(ids) > 0:
+        snippets = session.execute(search_snippets(match, ids)).all()
+        posts = session.scalars(search_posts(ids)).all()
+
+    return search_results(page, snippets, posts, limit)
+
+@responses.cached(tags=lambda data: ['user:' + data['author']['username']])
+def find_post(id):
+    '''Public information about a post, cached by the request's path.'''
+
+    post = session.query(Post).options(joinedload(Post.author)) \
+                  .filter_by(id=id).one_or_none()
+    if post == None:
+        return {
+            'status': 'fail',
+            'message': 'No such post exists'
+        }, 404
+    else:
+        return post_schema.dump(post)
+
+def feed_page(args):
+    '''A page of the feed, for the query string `args`.'''
+
+    limit = args.get('limit', DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    try:
+        after = parse_feed_cursor(args.get('after'))
+    except ValueError as e:
+        return {
+            'status': 'fail',
+            'message': str(e)
+        }, 400
+
+    posts = session.scalars(feed(args.get('author'), after, limit)).all()
+
+    return {
+        'status': 'success',
+        'results': posts_schema.dump(posts),
+        'next': posts[-1].id if len(posts) == limit else None
+    }
+
+def create_post(current_user, data):
+    '''Create a post by `current_user` from the JSON `data` of a request.'''
+
+    try:
+        p = post_schema.load(data)
+    except Exception as e:
+        logger.info('Couldn\'t deserialize post: %s', e)
+        return {
+                'status': 'fail',
+                'message': 'Couldn\'t deserialize post'
+        }, 500
+
+    p.author_id = current_user.id
+
+    # In write-behind mode the post is committed along with any others
+    # that arrive around the same time (see `writebehind.py`). Either way
+    # it's durable by the time we say it was created.
+    if current_app.config['POST_WRITE_BEHIND']:
+        future = writebehind.posts.submit({
+            'author_id': p.author_id,
+            'body': p.body
+        })
+
+        try:
+            id = future.result(timeout=WRITE_BEHIND_TIMEOUT)
+        except TimeoutError:
+            # It's still queued, so it may well be committed after all, and
+            # the client shouldn't just send it again.
+            future.add_done_callback(invalidate_written_post)
+            return {
+                'status': 'fail',
+                'message': 'Timed out saving the post; it may still be '
+                           'created, so check before trying again'
+            }, 503
+    else:
+        session.add(p)
+        session.commit()
+        id = p.id
+
+    # SQLite hands out the id of the newest post again if it was deleted, so
+    # there could be a stale response for it.
+    responses.invalidate('/post/{}?'.format(id))
+
+    return {
+        'status': 'success',
+        'message': 'Post created successfully'
+    }
+
+def invalidate_written_post(future):
+    '''Invalidate the response for a post from the write-behind writer, once
+    it's been committed.'''
+
+    if future.exception() == None:
+        responses.invalidate('/post/{}?'.format(future.result()))
+
+def create_posts(current_user, posts):
+    '''Create the posts in the JSON array `posts` by `current_user`.
+
+    Every valid post is inserted in a single transaction with one
+    executemany, so a burst of posts costs one commit instead of one per
+    post. Invalid posts are skipped and reported in `errors`, keyed by their
+    index in the array.'''
+
+    if not isinstance(posts, list):
+        return {
+            'status': 'fail',
+            'message': 'Expected an array of posts'
+        }, 400
+
+    if len(posts) > MAX_BULK_POSTS:
+        return {
+            'status': 'fail',
+            'message': 'At most {} posts can be created at once'
+                       .format(MAX_BULK_POSTS)
+        }, 413
+
+    errors = posts_schema.validate(posts)
+    rows = [{'author_id': current_user.id, 'body': post['body']}
+            for i, post in enumerate(posts) if i not in errors]
+
+    if len(rows) > 0:
+        ids = session.scalars(insert(Post).returning(Post.id), rows).all()
+        session.commit()
+
+        # Like for a single post, any of the ids could have been handed out
+        # before to a post that's since been deleted.
+        for id in ids:
+            responses.invalidate('/post/{}?'.format(id))
+
+    return {
+        'status': 'success' if len(rows) > 0 or len(posts) == 0 else 'fail',
+        'message': 'Created {} of {} posts'.format(len(rows), len(posts)),
+        'errors': errors
+    }
+
+@api.route('/search')
+class PostSearch(Resource):
+    @jwt_required()
+    @api.param('q', 'The words the posts have to contain')
+    @api.param('after', 'The `next` cursor from the previous page')
+    @api.param('limit', 'The maximum number of posts to return')
+    def get(self):
+        '''Search posts by the words in their bodies, best matches first'''
+        return search(request.args)
+
 @api.route('/<int:id>')
 @api.param('id', 'The id of the desired post')
 class PostResource(Resource):
     @jwt_required()
     def get(self, id):
         '''Get public information about a post'''
-        post = session.query(Post).filter_by(id=id)
-        if post.count() == 0:
-            return {
-                'status': 'fail',
-                'message': 'No such post exists'
-            }, 404
-        else:
-            return PostSchema().dump(post.first())
+        return find_post(id)
 
 @api.route('')
 class NewPost(Resource):
     @jwt_required()
+    @api.param('author', 'Only get posts by the user with this username')
+    @api.param('after', 'The `next` cursor from the previous page')
+    @api.param('limit', 'The maximum number of posts to return')
+    def get(self):
+        '''Get a page of the feed of all posts or one author's posts'''
+        return feed_page(request.args)
+
+    @jwt_required()
+    @api.response(503, 'Timed out saving the post, which may still be created')
     def post(self):
         '''Create a new post'''
-        
-        try:
-            p = PostSchema().load(request.json)
-        except Exception as e:
-            print(e.__str__())
-            return {
-                    'status': 'fail',
-                    'message': 'Couldn\'t deserialize post'
-            }, 500
+        return create_post(current_user, request.json)
 
-        p.author = current_user
-
-        session.add(p)
-        session.commit()
+@api.route('/bulk')
+class BulkPost(Resource):
+    @jwt_required()
+    def post(self):
+        '''Create many posts at once
 
-        return {
-            'status': 'success',
-            'message': 'Post created successfully'
-        }
+        Expects a JSON array of posts. See `create_posts`.'''
+        return create_posts(current_user, request.json)
@@ -0,0 +1,248 @@
+'''Caching of whole GET responses, with ETags and conditional GETs.
+
+Public information about users and posts rarely changes, so there's no need to
+query and serialize it again on every request. A cached endpoint stores the
+encoded body of each 200 response along with a strong ETag (a hash of the
+body), keyed by the request path. Clients that send the ETag back in
+`If-None-Match` get an empty 304 instead of the body.
+
+Each entry is also given tags (see `cached`), and anything that changes the
+data behind a response has to invalidate its key or one of its tags after it
+commits. A response that was being made while that happened isn't cached,
+since it may have read the data from before the change.
+
+The entries are kept in each process, and an invalidation only reaches the
+process that made the change. With several worker processes, entries also
+expire after `RESPONSE_CACHE_TTL` seconds so the others can't serve an old
+response (or its ETag) for longer than that.
+
+Basic usage is like this:
+
+    from response_cache import responses
+
+    class UserResource(Resource):
+        @jwt_required()
+        @responses.cached(tags=lambda data: ['user:' + data['username']])
+        def get(self, username):
+            ...
+
+    responses.invalidate_tag('user:goose')
+'''
+
+import functools
+import hashlib
+import os
+import threading
+
+from collections import Counter, defaultdict
+
+from flask import request, make_response
+from flask_restx.utils import unpack
+
+import metrics
+
+from cache import LRUCache
+from encoding import dumps
+
+class Backend:
+    '''What `ResponseCache` needs from the store it keeps entries in.
+
+    The values are `(body, etag)` tuples of bytes and a string (the ETag
+    without its quotes). A backend is
+    free to forget entries whenever it likes, e.g. to stay under a size
+    limit.'''
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        '''Returns the keys of any entries evicted to make room, so that
+        `ResponseCache` can forget their tags.'''
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+class MemoryBackend(Backend):
+    '''Keeps entries in this process, evicting the least recently used.
+
+    An invalidation only reaches the process that made it, so with several
+    worker processes the others can go on serving the old response. Entries
+    expire `ttl` seconds after they're stored to put a bound on that.'''
+
+    def __init__(self, maxsize, ttl=None):
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value):
+        return self.entries.set(key, value)
+
+    def delete(self, key):
+        self.entries.delete(key)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return self.entries.stats()
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.not_modified = 0
+
+        # Which keys have each tag, and which tags each key has.
+        self._tags = defaultdict(set)
+        self._key_tags = {}
+
+        # Invalidations are numbered, and `_invalidated` has the number each
+        # key and tag was last invalidated at. It only has to go back as far
+        # as the oldest response still being made, whose number is in
+        # `_making` along with the others (see `begin`).
+        self._generation = 0
+        self._invalidated = {}
+        self._making = Counter()
+
+        self._lock = threading.Lock()
+
+    def begin(self):
+        '''Note that a response is being made, before reading anything for
+        it. The number returned goes to `store` and then `end`.'''
+
+        with self._lock:
+            self._making[self._generation] += 1
+            return self._generation
+
+    def end(self, start):
+        with self._lock:
+            self._making[start] -= 1
+            if self._making[start] == 0:
+                del self._making[start]
+
+            oldest = min(self._making, default=self._generation)
+            for name in [name for name, generation in self._invalidated.items()
+                         if generation <= oldest]:
+                del self._invalidated[name]
+
+    def store(self, key, data, tags, start):
+        '''Encode `data` and cache it under `key`, returning the new entry.
+
+        If `key` or any of `tags` has been invalidated since `start` (from
+        `begin`), the data may be from before the change, so the entry is
+        returned without being cached.'''
+
+        # Sorted so every worker comes up with the same ETag.
+        body = dumps(data, sort_keys=True) + b'\n'
+        entry = (body, hashlib.sha1(body).hexdigest())
+
+        with self._lock:
+            for name in [('key', key)] + [('tag', tag) for tag in tags]:
+                if self._invalidated.get(name, start) > start:
+                    return entry
+
+            evicted = self.backend.set(key, entry) or []
+
+            self._forget(key)
+            self._key_tags[key] = tags
+            for tag in tags:
+                self._tags[tag].add(key)
+
+            for evicted_key in evicted:
+                self._forget(evicted_key)
+
+        return entry
+
+    def _forget(self, key):
+        '''Take `key` out of the sets of keys with each of its tags.'''
+
+        for tag in self._key_tags.pop(key, []):
+            keys = self._tags.get(tag)
+            if keys != None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self._tags[tag]
+
+    def respond(self, body, etag):
+        if request.if_none_match.contains(etag):
+            self.not_modified += 1
+            response = make_response('', 304)
+        else:
+            response = make_response(body, 200)
+            response.headers['Content-Type'] = 'application/json'
+
+        # `no-cache` lets clients and proxies keep the response, but they have
+        # to check it's still current (which also checks the JWT) before they
+        # reuse it.
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def cached(self, tags=lambda data: []):
+        '''Cache the successful responses of a GET method.
+
+        `tags` is given the data the method returned and gives back the tags
+        of the entry. Anything other than a 200 isn't cached.'''
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                key = request.full_path
+                entry = self.backend.get(key)
+
+                if entry == None:
+                    start = self.begin()
+                    try:
+                        data, code, headers = unpack(fn(*args, **kwargs))
+
+                        if code != 200:
+                            return data, code, headers
+
+                        entry = self.store(key, data, tags(data), start)
+                    finally:
+                        self.end(start)
+
+                return self.respond(*entry)
+
+            return wrapper
+
+        return decorator
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._invalidated[('key', key)] = self._generation
+            self._forget(key)
+
+        self.backend.delete(key)
+
+    def invalidate_tag(self, tag):
+        with self._lock:
+            self._generation += 1
+            self._invalidated[('tag', tag)] = self._generation
+            keys = self._tags.pop(tag, set())
+            for key in keys:
+                self._forget(key)
+
+        for key in keys:
+            self.backend.delete(key)
+
+    def stats(self):
+        return dict(self.backend.stats(), not_modified=self.not_modified)
+
+# How stale a response can be in a worker that didn't see the change. Set it to
+# 0 for no limit when there's only one process.
+ttl = float(os.getenv('RESPONSE_CACHE_TTL', 60))
+
+responses = ResponseCache(
+    MemoryBackend(maxsize=int(os.getenv('RESPONSE_CACHE_SIZE', 10000)),
+                  ttl=ttl if ttl > 0 else None))
+
+metrics.register('response_cache', responses.stats)
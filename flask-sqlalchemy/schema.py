@@ -3,21 +3,32 @@
 These schemas decentralize and standardize serialization and deserialization of
 database entities consistently across API endpoints.
 
+The instances at the bottom of this module are shared by every request rather
+than each one building its own. Building a schema takes longer than dumping a
+single object with it (see `bench/serialize.py`), so that's most of the time
+for routes that return one user or post, though it's lost in the noise for
+big lists.
+
 Examples:
 
     # Partially deserialize a user (i.e. allow required fields to be omitted)
 
-    from schema import UserSchema
-    user_data = UserSchema(partial=True).load(request.json)
+    from schema import user_update_schema
+    user_data = user_update_schema.load(request.json)
 
     # Or serialize a user
 
-    from flask_jwt_extended import current_user
-    from schema import UserSchema
-    user_data = UserSchema().dump(current_user) # Could return from a Flask route
+    from schema import user_schema
+    user_data = user_schema.dump(user) # Could return from a Flask route
+
+    # Or serialize query results without going through Marshmallow at all
+
+    from schema import user_rows
+    rows = session.query(*user_rows.columns).all()
+    users = user_rows.dump(rows)
 '''
 
-from marshmallow import Schema, fields, post_load
+from marshmallow import Schema, fields, post_load, pre_load
 from model import User, Post
 
 # In the API endpoint modules obviously you need to be able create and update
@@ -34,12 +45,60 @@ class UserSchema(Schema):
 
     @post_load
     def make_user(self, data, **kwargs):
+        # Partial loads are updates to an existing user (see `User.update`).
+        if self.partial:
+            return data
         return User(**data)
 
 class PostSchema(Schema):
-    author = fields.Nested(UserSchema)
+    id = fields.Int(dump_only=True)
+    author = fields.Nested(UserSchema, dump_only=True)
     body = fields.Str(required=True)
 
+    @pre_load
+    def drop_author(self, data, **kwargs):
+        # A post's author is whoever is making it, so one in the request is
+        # ignored (as it always has been) rather than loaded as a new user.
+        if isinstance(data, dict):
+            data = {k: v for k, v in data.items() if k != 'author'}
+        return data
+
     @post_load
     def make_post(self, data, **kwargs):
         return Post(**data)
+
+class RowDumper:
+    '''Dump rows of plain column values the way a schema would, but faster.
+
+    Marshmallow does a lot of work per field per object, which dominates the
+    cost of big list responses. For read-only shapes made only of simple
+    fields the result is just the column values under the field names, so
+    this works out the columns once from the schema and then dumps rows
+    straight into dicts. Any columns selected after `columns` are ignored by
+    `dump`, so a query can tack on things it needs for itself, like an id for a
+    cursor.'''
+
+    SIMPLE_FIELDS = (fields.String, fields.Integer, fields.Boolean)
+
+    def __init__(self, schema, model):
+        self.names = []
+        self.columns = []
+
+        for name, field in schema.dump_fields.items():
+            if type(field) not in self.SIMPLE_FIELDS:
+                raise TypeError('{} can\'t be dumped from a row'.format(name))
+
+            self.names.append(field.data_key or name)
+            self.columns.append(getattr(model, field.attribute or name))
+
+    def dump(self, rows):
+        names = self.names
+        return [dict(zip(names, row)) for row in rows]
+
+user_schema = UserSchema()
+user_update_schema = UserSchema(partial=True)
+users_schema = UserSchema(many=True)
+post_schema = PostSchema()
+posts_schema = PostSchema(many=True)
+
+user_rows = RowDumper(user_schema, User)
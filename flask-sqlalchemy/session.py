@@ -1,16 +1,86 @@
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.orm import sessionmaker
-
-# SQLAlchemy works with metaclasses to create a list of all the database models
-# defined in `model.py`. This works by storing them all in an object called the
-# `metadata` which is stored in the `Base` (from DeclarativeBase) which all of
-# our models inherit from. In order for the database models to be accessible
-# here for `create_all` and so we can create the session, we have to get the
-# same `Base` that was used when we declared the models.
-from model import Base
-
-engine = create_engine('sqlite:///database.sqlite3')
-Base.metadata.create_all(engine)
-
-Session = sessionmaker(bind=engine, autoflush=False)
-session = Session()
+import os
+import threading
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session as OrmSession, sessionmaker, scoped_session
+
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///database.sqlite3')
+
+# Applied to every new SQLite connection. WAL lets readers carry on while
+# somebody is writing, and with WAL `synchronous=NORMAL` only gives up
+# durability of the last few transactions on power loss (not on a crash of the
+# process), which is a good trade for not fsyncing on every commit. The mmap
+# and cache sizes are in bytes and KiB (negative means KiB) respectively.
+# `busy_timeout` makes a writer wait for the lock instead of failing straight
+# away with "database is locked".
+SQLITE_PRAGMAS = [
+    'journal_mode=WAL',
+    'synchronous=NORMAL',
+    'mmap_size=268435456',
+    'cache_size=-65536',
+    'busy_timeout=5000',
+]
+
+# The engine is made the first time something needs a connection rather than
+# when this is imported, so importing the app is cheap and a pre-forking server
+# doesn't hand its workers a pool it has already used. See `get_engine`.
+engine = None
+_engine_lock = threading.Lock()
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute('PRAGMA ' + pragma)
+    cursor.close()
+
+def use_sqlite_pragmas(engine):
+    '''Apply `SQLITE_PRAGMAS` to the engine's connections, if it's SQLite.'''
+
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', set_sqlite_pragmas)
+
+def get_engine():
+    '''Create the engine for `DATABASE_URL` the first time it's needed.
+
+    Creating it doesn't connect to the database, and the schema is created
+    separately by `migrate.py`.'''
+
+    global engine
+
+    if engine != None:
+        return engine
+
+    with _engine_lock:
+        if engine == None:
+            engine = create_engine(
+                DATABASE_URL,
+                pool_size=int(os.getenv('DATABASE_POOL_SIZE', 5)),
+                max_overflow=int(os.getenv('DATABASE_MAX_OVERFLOW', 10)),
+                pool_timeout=30,
+                pool_recycle=3600)
+            use_sqlite_pragmas(engine)
+
+    return engine
+
+def dispose_after_fork():
+    # A forked worker mustn't use the connections it inherited, but it mustn't
+    # close them either because they still belong to the parent. This gives the
+    # child an empty pool of its own.
+    if engine != None:
+        engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=dispose_after_fork)
+
+class LazySession(OrmSession):
+    '''A `Session` that's bound to whatever `get_engine` returns.'''
+
+    def get_bind(self, *args, **kwargs):
+        return get_engine()
+
+Session = sessionmaker(class_=LazySession, autoflush=False)
+
+# `session` is a proxy to a separate `Session` for each thread, so every module
+# can keep importing it like a global. The app removes the current thread's
+# session when each request ends (see `app.py`), which returns its connection
+# to the pool and throws away its identity map.
+session = scoped_session(Session)
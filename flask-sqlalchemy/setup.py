@@ -0,0 +1,16 @@
+'''Builds the optional `hashtable` extension that backs `cache.LRUCache`:
+
+    python setup.py build_ext --inplace
+
+Everything works without it, just with bigger caches.
+'''
+
+from setuptools import Extension, setup
+
+setup(
+    name='honk-hashtable',
+    ext_modules=[
+        Extension('hashtable', ['hashtablemodule.c'], include_dirs=['..'],
+                  depends=['../hashtable.c'])
+    ]
+)
@@ -1,21 +1,146 @@
+import string
+
+from flask import request
 from flask_restx import Namespace, Resource, fields
 from flask_jwt_extended import jwt_required
+from sqlalchemy import func, select, text, tuple_
 
 from model import User
 from session import session
-from schema import UserSchema
+from schema import user_rows
 
 api = Namespace('suggestion', description='Suggestions')
 
+# Every page of suggestions is bounded, no matter what the client asks for.
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# The smallest search string the trigram index can match on. Anything shorter
+# only gets prefix matches.
+TRIGRAM_LENGTH = 3
+
+# SQLite's lower() only folds ASCII letters, so the needle and the cursor keys
+# are folded the same way to line up with `ix_users_username_lower`.
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def prefix_matches(needle, after, limit):
+    '''A query for usernames starting with `needle`, in alphabetical order.
+
+    This is a range scan over `ix_users_username_lower` rather than a `LIKE`,
+    which SQLite won't use an index for. `after` is the `(key, id)` of the last
+    suggestion on the previous page. Rows come back as the columns of
+    `user_rows` followed by the id.'''
+
+    key = func.lower(User.username)
+    query = select(*user_rows.columns, User.id) \
+            .where(key >= needle, key < needle + '\U0010ffff')
+
+    if after != None:
+        query = query.where(tuple_(key, User.id) > tuple_(*after))
+
+    return query.order_by(key, User.id).limit(limit)
+
+def substring_matches(needle, after, limit):
+    '''A query for usernames containing `needle` anywhere but at the start,
+    oldest first.
+
+    These come out of the trigram index in `users_username_fts`, which hands
+    back matches in rowid order, so a page never has to sort every match.
+    `after` is the id of the last suggestion on the previous page. Rows are
+    the same shape as from `prefix_matches`. Returns None if `needle` is too
+    short to search for.'''
+
+    if len(needle) < TRIGRAM_LENGTH:
+        return None
+
+    # Quote the needle so FTS5 treats it as one string instead of a query.
+    ids = text('SELECT rowid FROM users_username_fts '
+               'WHERE users_username_fts MATCH :match')
+    ids = ids.bindparams(match='"{}"'.format(needle.replace('"', '""')))
+
+    # Prefix matches were already suggested by `prefix_matches`.
+    prefix = needle.replace('\\', '\\\\')
+    prefix = prefix.replace('%', '\\%').replace('_', '\\_')
+    query = select(*user_rows.columns, User.id).where(
+        User.id.in_(ids),
+        func.lower(User.username).notlike(prefix + '%', escape='\\'))
+
+    if after != None:
+        query = query.where(User.id > after)
+
+    return query.order_by(User.id).limit(limit)
+
+def parse_cursor(cursor):
+    '''Turn a cursor from `next` back into a tier and a position.
+
+    Prefix matches come first and are paged by `(key, id)`, so their cursors
+    look like `p:<id>:<key>`. Substring matches are paged by id and look like
+    `s:<id>`.'''
+
+    if cursor == None:
+        return 'p', None
+
+    tier, _, rest = cursor.partition(':')
+
+    if tier == 'p':
+        id, _, key = rest.partition(':')
+        return tier, (key, int(id))
+    if tier == 's':
+        return tier, int(rest)
+
+    raise ValueError('Unknown cursor tier {}'.format(tier))
+
+def make_cursor(tier, row):
+    '''The cursor for the page after the one ending with `row`.'''
+
+    if tier == 'p':
+        return 'p:{}:{}'.format(row.id, row.username.translate(ASCII_LOWER))
+    return 's:{}'.format(row.id)
+
+def suggest(username, args):
+    '''A page of usernames like `username`, for the query string `args`.'''
+
+    needle = username.translate(ASCII_LOWER)
+    limit = args.get('limit', DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    try:
+        tier, after = parse_cursor(args.get('cursor'))
+    except ValueError:
+        return {
+            'status': 'fail',
+            'message': 'Invalid cursor'
+        }, 400
+
+    results = []
+    next = None
+
+    if tier == 'p':
+        results = session.execute(prefix_matches(needle, after, limit)).all()
+        if len(results) == limit:
+            next = make_cursor(tier, results[-1])
+        else:
+            tier, after = 's', None
+
+    if tier == 's':
+        query = substring_matches(needle, after, limit - len(results))
+        if query != None:
+            results += session.execute(query).all()
+        if len(results) == limit:
+            next = make_cursor(tier, results[-1])
+
+    return {
+        'status': 'success',
+        'results': user_rows.dump(results),
+        'next': next
+    }
+
 @api.route('/username/<string:username>')
 @api.param('username', 'Partially completed username')
+@api.param('limit', 'The maximum number of suggestions to return')
+@api.param('cursor', 'The `next` cursor from the previous page')
 class UsernameSuggestion(Resource):
     @jwt_required()
     def get(self, username):
         '''Get usernames similar to a given username'''
-        filter = User.username.like('%{}%'.format(username))
-        results = session.query(User).filter(filter).all()
-        return {
-            'status': 'success',
-            'results': UserSchema(many=True).dump(results)
-        }
+        return suggest(username, request.args)
@@ -13,10 +13,14 @@ Basic usage is like this:
 from flask import request
 from flask_restx import Namespace, Resource, fields, marshal_with
 from flask_jwt_extended import jwt_required, current_user
+from sqlalchemy.exc import IntegrityError
+
+import identity
 
 from model import User
+from response_cache import responses
 from session import session
-from schema import UserSchema
+from schema import user_schema, user_update_schema
 
 api = Namespace('user', description='User operations')
 
@@ -25,90 +29,134 @@ full_user_model = api.model('User', {
     'username': fields.String(description='The user\'s username'),
 })
 
-@api.route('/<string:username>')
-@api.response(404, 'No such user')
-@api.param('username', 'The username of the desired user')
-class UserResource(Resource):
-    @jwt_required()
-    @marshal_with(full_user_model)
-    def get(self, username):
-        '''Get public information about a user'''
-        u = session.query(User).filter_by(username=username)
-        if u.count() == 0:
-            return {
-                'status': 'fail',
-                'message': 'No such user exists'
-            }, 404
-        return UserSchema().dump(u.first())
-
-    @jwt_required()
-    def put(self, username):
-        '''Update an existing user'''
-
-        u = session.query(User).filter_by(username=username)
+# These are the request logic of each route, called by the resource below.
 
-        if u.count() == 0:
-            return {
-                'status': 'fail',
-                'message': 'No such user exists'
-            }, 404
+@responses.cached(tags=lambda data: ['user:' + data['username']])
+@marshal_with(full_user_model)
+def find_user(username):
+    '''Public information about a user, cached by the request's path.'''
 
-        u = u.first()
+    u = session.query(User).filter_by(username=username).one_or_none()
+    if u == None:
+        return {
+            'status': 'fail',
+            'message': 'No such user exists'
+        }, 404
+    return user_schema.dump(u)
 
-        if u != current_user:
-            return {
-                'status': 'fail',
-                'message': 'You don\'t have permission to update that user'
-            }, 403
-
-        # `password` isn't a valid property of `User`, but the user thinks it
-        # is so we have to snag it here before we validate the rest of the
-        # request. Same thing with `email`.
-
-        password = request.json.pop('password', None)
-        email = request.json.pop('email', None)
-
-        # During registration the user has to specify all of the required
-        # fields like the username and password. This is a partial update
-        # though, where we still want the request to roughly correspond to a
-        # user and Marshmallow's validation is the way to go. In olden days we
-        # would've used flask-restx's parsers. By setting `partial=True` when
-        # we create the schema we allow these partial updates we want.
-        try:
-            schema = UserSchema(partial=True)
-            user_data = schema.load(request.json)
-        except:
-            return {
-                'status': 'fail',
-                'message': 'Couldn\'t deserialize user'
-            }
+def update_user(current_user, username, data):
+    '''Update a user from the JSON `data` of a request.'''
 
-        # Update the email first because it could fail and we want to return
-        # early if it does.
-        if email != None:
-            email_status, email_error = u.set_email(email)
+    u = session.query(User).filter_by(username=username).one_or_none()
 
-            if not email_status:
-                return {
-                        'status': 'fail',
-                        'message': email_error
-                }
+    if u == None:
+        return {
+            'status': 'fail',
+            'message': 'No such user exists'
+        }, 404
 
-        if password != None:
-            u.set_password(password)
+    if u.id != current_user.id:
+        return {
+            'status': 'fail',
+            'message': 'You don\'t have permission to update that user'
+        }, 403
+
+    # `password` isn't a valid property of `User`, but the user thinks it
+    # is so we have to snag it here before we validate the rest of the
+    # request. Same thing with `email`.
+
+    password = data.pop('password', None)
+    email = data.pop('email', None)
+
+    # During registration the user has to specify all of the required
+    # fields like the username and password. This is a partial update
+    # though, where we still want the request to roughly correspond to a
+    # user and Marshmallow's validation is the way to go. In olden days we
+    # would've used flask-restx's parsers. By setting `partial=True` when
+    # we create the schema (see `user_update_schema`) we allow these
+    # partial updates we want.
+    try:
+        user_data = user_update_schema.load(data)
+    except:
+        return {
+            'status': 'fail',
+            'message': 'Couldn\'t deserialize user'
+        }
 
-        update_status, update_message = u.update(user_data)
+    # Update the email first because it could fail and we want to return
+    # early if it does.
+    if email != None:
+        email_status, email_error = u.set_email(email)
 
-        if not update_status:
+        if not email_status:
             return {
                     'status': 'fail',
-                    'message': update_message
+                    'message': email_error
             }
 
-        session.add(u)
-        session.commit()
+    if password != None:
+        u.set_password(password)
 
+    update_status, update_message = u.update(user_data)
+
+    if not update_status:
         return {
-            'status': 'success',
-            'message': 'Updated user successfully'
+                'status': 'fail',
+                'message': update_message
         }
+
+    # Usernames and emails are unique, so check the new ones aren't someone
+    # else's. Without this the commit below would fail with a 500.
+    taken = session.query(User).filter(User.id != u.id)
+    if u.username != username and \
+            taken.filter(User.username == u.username).count() > 0:
+        return {
+            'status': 'fail',
+            'message': 'Username already in use'
+        }, 409
+    if email != None and taken.filter(
+            User.validated_email == u.validated_email).count() > 0:
+        return {
+            'status': 'fail',
+            'message': 'Email already in use'
+        }, 409
+
+    session.add(u)
+    try:
+        session.commit()
+    except IntegrityError:
+        # Somebody else took it since the check above.
+        session.rollback()
+        return {
+            'status': 'fail',
+            'message': 'Username or email already in use'
+        }, 409
+
+    if email != None:
+        u.verify_email_later()
+
+    # Posts are tagged with their author's username too, since they
+    # include the author.
+    identity.invalidate(u.id)
+    responses.invalidate_tag('user:' + username)
+    responses.invalidate_tag('user:' + u.username)
+
+    return {
+        'status': 'success',
+        'message': 'Updated user successfully'
+    }
+
+@api.route('/<string:username>')
+@api.response(404, 'No such user')
+@api.param('username', 'The username of the desired user')
+class UserResource(Resource):
+    @jwt_required()
+    @api.response(200, 'Success', full_user_model)
+    def get(self, username):
+        '''Get public information about a user'''
+        return find_user(username)
+
+    @jwt_required()
+    def put(self, username):
+        '''Update an existing user'''
+        return update_user(current_user, username, request.json)
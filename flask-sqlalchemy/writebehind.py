@@ -0,0 +1,138 @@
+'''Group commit for rows that are written one request at a time.
+
+Committing costs an fsync, so when lots of requests each insert one row and
+commit, most of their time goes to waiting on the disk. A `GroupCommitWriter`
+instead collects the rows from concurrent requests in a queue, and a background
+thread inserts whatever has arrived every `interval` seconds (or as soon as
+`batch_size` rows are waiting) in a single transaction. Each request still
+waits for the commit that contains its row, so nothing is acknowledged before
+it's durable.
+
+Basic usage is like this:
+
+    from writebehind import posts
+    id = posts.submit({'author_id': 1, 'body': 'honk'}).result()  # Blocks
+'''
+
+import os
+import queue
+import threading
+import time
+
+from concurrent.futures import Future
+
+from sqlalchemy import insert
+
+import metrics
+
+from model import Post
+from session import Session
+
+class GroupCommitWriter:
+    def __init__(self, model, interval=0.005, batch_size=100):
+        self.model = model
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self.batches = 0
+        self.rows = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.flush_time = 0.0
+        self.last_flush_time = 0.0
+
+        self._lock = threading.Lock()
+        self._reset()
+
+        # The writer thread doesn't survive a fork, so a forked worker has to
+        # start its own.
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def submit(self, row):
+        '''Queue a dict of column values to be inserted.
+
+        Returns a `Future` that's resolved with the row's id once it's
+        committed, or has the exception if inserting it failed.'''
+
+        with self._lock:
+            if self._thread == None:
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name='group-commit-writer')
+                self._thread.start()
+
+        future = Future()
+        self._queue.put((row, future))
+        return future
+
+    def _run(self):
+        while True:
+            # Block until there's something to write, then give the requests
+            # right behind it until the deadline to join the same commit.
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        begin = time.perf_counter()
+        statement = insert(self.model).returning(self.model.id)
+
+        try:
+            with Session() as session:
+                # The rows are given increasing ids in the order they're
+                # inserted, but RETURNING doesn't promise to keep to it.
+                ids = sorted(session.scalars(statement,
+                                             [row for row, _ in batch]))
+                session.commit()
+        except Exception:
+            # One bad row shouldn't fail everyone else in the group, so find
+            # out which one it was by inserting them one at a time.
+            for row, future in batch:
+                try:
+                    with Session() as session:
+                        id = session.scalar(statement, row)
+                        session.commit()
+                    future.set_result(id)
+                except Exception as e:
+                    future.set_exception(e)
+        else:
+            for id, (_, future) in zip(ids, batch):
+                future.set_result(id)
+
+        self.last_flush_time = time.perf_counter() - begin
+        self.flush_time += self.last_flush_time
+        self.batches += 1
+        self.rows += len(batch)
+        self.last_batch_size = len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'batches': self.batches,
+            'rows': self.rows,
+            'last_batch_size': self.last_batch_size,
+            'max_batch_size': self.max_batch_size,
+            'last_flush_ms': self.last_flush_time * 1000,
+            'mean_flush_ms': self.flush_time * 1000 / max(self.batches, 1)
+        }
+
+posts = GroupCommitWriter(
+    Post,
+    interval=float(os.getenv('POST_WRITE_BEHIND_MS', 5)) / 1000,
+    batch_size=int(os.getenv('POST_WRITE_BEHIND_ROWS', 100)))
+
+metrics.register('post_writer', posts.stats)
@@ -1,70 +1,1057 @@
-#include <stdlib.h>             /* malloc */
+#ifndef HT_NO_MAIN
+#define _POSIX_C_SOURCE 200809L /* fork and getrusage, for the benchmarks */
+#endif
+
+#include <stdlib.h>             /* malloc, calloc, free */
 #include <stdio.h>              /* printf */
-#include <string.h>             /* memset */
-#include <time.h>               /* time, clock, clock_t */
+#include <string.h>             /* memset, strcmp */
+#include <time.h>               /* time, clock, timespec_get */
 #include <inttypes.h>           /* uint64_t */
+#include <stddef.h>             /* offsetof */
+
+/*
+ * A chained hash table that grows (and shrinks) with the number of keys. Each
+ * entry keeps its full hash, so rehashing never has to hash a key again and
+ * most mismatches in a chain are ruled out without comparing keys. The entries
+ * are also linked together in insertion order, which is the order they're
+ * iterated in, and `ht_move_to_end` makes that usable as an LRU order.
+ *
+ * Keys are opaque. The table is given each key's hash by the caller and
+ * compares keys with the `equal` function it was set up with, so the same code
+ * serves the string keys in `main` and the Python objects in
+ * `flask-sqlalchemy/hashtablemodule.c`, which includes this file with
+ * HT_NO_MAIN defined and its own allocator.
+ *
+ * Further down is an open addressing table with the same interface (`st_*`),
+ * a store of interned keys (`ht_intern`), and a table that threads can share
+ * (`ht_shards_*`, unless HT_NO_THREADS is defined). `main` can benchmark the
+ * tables against each other, interned keys against a malloc per key, and the
+ * shared table with more and more threads:
+ *
+ *     cc -O2 -pthread -o hashtable hashtable.c
+ *     ./hashtable bench
+ *     ./hashtable alloc
+ *     ./hashtable threads
+ */
+
+#ifndef HT_MALLOC
+#include <stdatomic.h>          /* atomic_fetch_add_explicit */
+
+/* Counted, so the benchmarks can say how many allocations were made. Atomic,
+ * since the shared table is allocated from by many threads at once. Relaxed,
+ * since nothing else is ordered by it. */
+static _Atomic size_t ht_allocations;
+static void *ht_counted(void *p)
+{
+        atomic_fetch_add_explicit(&ht_allocations, 1, memory_order_relaxed);
+        return p;
+}
+#define HT_MALLOC(size) ht_counted(malloc(size))
+#define HT_CALLOC(count, size) ht_counted(calloc(count, size))
+#define HT_FREE free
+#endif
+
+/*
+ * Arenas and slabs, for allocating lots of small things without a malloc (and
+ * its header) each.
+ *
+ * An arena hands out memory from big blocks, and can only free it all at once,
+ * with `ht_arena_reset` or `ht_arena_free`. A slab is an arena of objects of
+ * one size, which also keeps the ones it's given back on a free list to hand
+ * out again. A table with `slab` set gets its entries from it, and `ht_free`
+ * leaves them for the slab to free all at once.
+ */
+
+#define HT_ARENA_MIN_BLOCK 4096
+#define HT_ARENA_MAX_BLOCK (1 << 20)
+
+/* Enough for pointers, uint64_t and doubles, which is all that's kept in them
+ * (max_align_t would waste up to 8 bytes on every key). */
+union ht_align {
+        void *p;
+        uint64_t u;
+        double d;
+};
+
+#define HT_ALIGN(size) \
+        (((size) + _Alignof(union ht_align) - 1) \
+         & ~(_Alignof(union ht_align) - 1))
+
+struct ht_arena {
+        struct ht_block {
+                struct ht_block *prev;
+                size_t size;    /* Not counting this header */
+        } *block;
+
+        size_t used;            /* Of the current block */
+        size_t next_size;       /* Blocks double in size up to a limit */
+};
+
+static char *ht_block_data(struct ht_block *block)
+{
+        return (char *)block + HT_ALIGN(sizeof *block);
+}
+
+void ht_arena_init(struct ht_arena *a)
+{
+        memset(a, 0, sizeof *a);
+        a->next_size = HT_ARENA_MIN_BLOCK;
+}
+
+void *ht_arena_alloc(struct ht_arena *a, size_t size)
+{
+        size = HT_ALIGN(size);
+
+        if (!a->block || a->used + size > a->block->size) {
+                size_t block_size = size > a->next_size ? size : a->next_size;
+                struct ht_block *block =
+                        HT_MALLOC(HT_ALIGN(sizeof *block) + block_size);
+                if (!block) return NULL;
+
+                block->prev = a->block;
+                block->size = block_size;
+                a->block = block;
+                a->used = 0;
+
+                if (a->next_size < HT_ARENA_MAX_BLOCK) a->next_size *= 2;
+        }
+
+        void *p = ht_block_data(a->block) + a->used;
+        a->used += size;
+        return p;
+}
+
+/* Free everything in the arena, keeping its newest (and biggest) block. */
+void ht_arena_reset(struct ht_arena *a)
+{
+        if (!a->block) return;
+
+        struct ht_block *block = a->block->prev;
+        while (block) {
+                struct ht_block *prev = block->prev;
+                HT_FREE(block);
+                block = prev;
+        }
+
+        a->block->prev = NULL;
+        a->used = 0;
+}
+
+void ht_arena_free(struct ht_arena *a)
+{
+        ht_arena_reset(a);
+        HT_FREE(a->block);
+        ht_arena_init(a);
+}
+
+struct ht_slab {
+        struct ht_arena arena;
+        size_t size;
+        void *free;             /* Linked through their first pointer */
+};
+
+void ht_slab_init(struct ht_slab *s, size_t size)
+{
+        ht_arena_init(&s->arena);
+        s->size = size > sizeof (void *) ? size : sizeof (void *);
+        s->free = NULL;
+}
+
+void *ht_slab_alloc(struct ht_slab *s)
+{
+        void *p = s->free;
+
+        if (!p) return ht_arena_alloc(&s->arena, s->size);
+
+        s->free = *(void **)p;
+        return p;
+}
+
+void ht_slab_release(struct ht_slab *s, void *p)
+{
+        *(void **)p = s->free;
+        s->free = p;
+}
+
+void ht_slab_reset(struct ht_slab *s)
+{
+        ht_arena_reset(&s->arena);
+        s->free = NULL;
+}
+
+void ht_slab_free(struct ht_slab *s)
+{
+        ht_arena_free(&s->arena);
+        s->free = NULL;
+}
+
+#define HT_MIN_BUCKETS 8
+
+/* Grow once there are more keys than `max_load` percent of the buckets (75
+ * unless it's changed after `ht_init_with`), shrink below 1/8. */
+#define HT_MAX_LOAD 75
+#define HT_GROW_AT(h) ((h)->num_buckets * (h)->max_load / 100)
+#define HT_SHRINK_AT(h) ((h)->num_buckets / 8)
+
+/* What `ht_find` and `ht_insert` return when something went wrong. */
+#define HT_ERROR -1             /* `equal` or an allocation failed */
+#define HT_CHANGED -2           /* `equal` changed the table */
+
+struct ht {
+        struct ht_entry {
+                uint64_t hash;
+                void *key;
+                void *value;
+                struct ht_entry *next;            /* In the same bucket */
+                struct ht_entry *before, *after;  /* In insertion order */
+        } **bucket;
+
+        size_t num_buckets;     /* Always a power of two */
+        size_t num_keys;
+        unsigned max_load;      /* Percent */
+
+        struct ht_entry *first, *last;
+
+        /* 1 if equal, 0 if not, or HT_ERROR. */
+        int (*equal)(void *a, void *b);
+
+        /* Callers can put their own data after `struct ht_entry`. */
+        size_t entry_size;
+
+        /* Where entries come from if it's set, rather than HT_MALLOC. Its
+         * objects have to be at least `entry_size`. */
+        struct ht_slab *slab;
+
+        /* Bumped on every change, to notice `equal` changing the table. */
+        unsigned long version;
+};
+
+int ht_init_with(struct ht *h, int (*equal)(void *, void *), size_t entry_size)
+{
+        memset(h, 0, sizeof *h);
+        h->bucket = HT_CALLOC(HT_MIN_BUCKETS, sizeof *h->bucket);
+        if (!h->bucket) return HT_ERROR;
+        h->num_buckets = HT_MIN_BUCKETS;
+        h->max_load = HT_MAX_LOAD;
+        h->equal = equal;
+        h->entry_size = entry_size;
+        return 0;
+}
+
+/* Spread the high bits of the hash into the ones used to pick a bucket. */
+static size_t ht_index(struct ht *h, uint64_t hash)
+{
+        return (hash ^ (hash >> 29) ^ (hash >> 47)) & (h->num_buckets - 1);
+}
+
+static int ht_resize(struct ht *h, size_t num_buckets)
+{
+        struct ht_entry **bucket = HT_CALLOC(num_buckets, sizeof *bucket);
+        if (!bucket) return HT_ERROR;
+
+        HT_FREE(h->bucket);
+        h->bucket = bucket;
+        h->num_buckets = num_buckets;
+        h->version++;
+
+        /* The insertion order list already has every entry on it. */
+        for (struct ht_entry *e = h->first; e; e = e->after) {
+                size_t i = ht_index(h, e->hash);
+                e->next = h->bucket[i];
+                h->bucket[i] = e;
+        }
+
+        return 0;
+}
+
+/*
+ * Find the entry for `key`, setting `*found` to it or to NULL if there isn't
+ * one. Returns 0, or HT_ERROR or HT_CHANGED if `equal` failed or changed the
+ * table (in which case `*found` is meaningless).
+ */
+int ht_find(struct ht *h, void *key, uint64_t hash, struct ht_entry **found)
+{
+        for (struct ht_entry *e = h->bucket[ht_index(h, hash)]; e; e = e->next) {
+                if (e->hash != hash) continue;
+                if (e->key == key) {
+                        *found = e;
+                        return 0;
+                }
+
+                unsigned long version = h->version;
+                int equal = h->equal(e->key, key);
+                if (equal < 0) return HT_ERROR;
+                if (h->version != version) return HT_CHANGED;
+                if (equal) {
+                        *found = e;
+                        return 0;
+                }
+        }
+
+        *found = NULL;
+        return 0;
+}
+
+/*
+ * Find or add the entry for `key`. A new entry goes at the end of the order and
+ * has no value yet. Returns 1 if the entry is new, 0 if it was already there,
+ * or HT_ERROR/HT_CHANGED like `ht_find`.
+ */
+int ht_insert(struct ht *h, void *key, uint64_t hash, struct ht_entry **entry)
+{
+        int err = ht_find(h, key, hash, entry);
+        if (err) return err;
+        if (*entry) return 0;
+
+        if (h->num_keys + 1 > HT_GROW_AT(h)
+            && ht_resize(h, h->num_buckets * 2))
+                return HT_ERROR;
+
+        struct ht_entry *e = h->slab ? ht_slab_alloc(h->slab)
+                                     : HT_MALLOC(h->entry_size);
+        if (!e) return HT_ERROR;
+
+        size_t i = ht_index(h, hash);
+        *e = (struct ht_entry) {
+                .hash = hash,
+                .key = key,
+                .next = h->bucket[i],
+                .before = h->last,
+        };
+
+        h->bucket[i] = e;
+        if (h->last) h->last->after = e;
+        else h->first = e;
+        h->last = e;
+
+        h->num_keys++;
+        h->version++;
+        *entry = e;
+        return 1;
+}
+
+static void ht_unlink_order(struct ht *h, struct ht_entry *e)
+{
+        if (e->before) e->before->after = e->after;
+        else h->first = e->after;
+        if (e->after) e->after->before = e->before;
+        else h->last = e->before;
+}
+
+/*
+ * Remove an entry found with `ht_find` and free it. Its key and value are the
+ * caller's to free, so take them out first.
+ */
+void ht_remove(struct ht *h, struct ht_entry *e)
+{
+        struct ht_entry **link = &h->bucket[ht_index(h, e->hash)];
+        while (*link != e) link = &(*link)->next;
+        *link = e->next;
+
+        ht_unlink_order(h, e);
+        if (h->slab) ht_slab_release(h->slab, e);
+        else HT_FREE(e);
+
+        h->num_keys--;
+        h->version++;
+
+        /* Failing to shrink is harmless, the table is just bigger than it
+         * needs to be. */
+        if (h->num_buckets > HT_MIN_BUCKETS
+            && h->num_keys < HT_SHRINK_AT(h))
+                ht_resize(h, h->num_buckets / 2);
+}
+
+/* Move an entry to the end of the order, or to the start if `last` is 0. */
+void ht_move_to_end(struct ht *h, struct ht_entry *e, int last)
+{
+        if (last ? h->last == e : h->first == e) return;
+
+        ht_unlink_order(h, e);
+
+        if (last) {
+                e->before = h->last;
+                e->after = NULL;
+                h->last->after = e;
+                h->last = e;
+        } else {
+                e->before = NULL;
+                e->after = h->first;
+                h->first->before = e;
+                h->first = e;
+        }
+
+        h->version++;
+}
+
+/*
+ * Iterate in order: `ht_next(h, NULL)` is the first entry and `ht_next(h, e)`
+ * the one after `e`, or NULL at the end. Don't remove `e` before moving on.
+ */
+struct ht_entry *ht_next(struct ht *h, struct ht_entry *e)
+{
+        return e ? e->after : h->first;
+}
+
+/* Free every entry (but not the keys or values) and the table's buckets. With
+ * a slab the entries are left to `ht_slab_reset` or `ht_slab_free`. */
+void ht_free(struct ht *h)
+{
+        struct ht_entry *e = h->slab ? NULL : h->first;
+
+        while (e) {
+                struct ht_entry *after = e->after;
+                HT_FREE(e);
+                e = after;
+        }
+
+        HT_FREE(h->bucket);
+        memset(h, 0, sizeof *h);
+}
+
+/*
+ * An open addressing hash table in the style of Abseil's "Swiss tables", with
+ * the same interface as the chained table above so the two can be compared.
+ *
+ * The slots are in one flat array, with a separate array of one control byte
+ * per slot: ST_EMPTY, ST_DELETED (a tombstone), or the low 7 bits of the full
+ * slot's mixed hash. A lookup checks a whole group of 8 control bytes at once as
+ * a uint64_t, and only looks at the slots whose byte matches, so most
+ * mismatches never touch a slot. Groups are probed in triangular order, which
+ * visits every group because there's a power of two of them, and a probe stops
+ * at the first group with an empty slot in it.
+ *
+ * There's no insertion order, so iteration is in slot order, and there's
+ * nothing like `ht_move_to_end`.
+ */
+
+#define ST_GROUP 8              /* Slots per group, one control byte each */
+#define ST_MIN_SLOTS 16
+#define ST_MAX_LOAD 87          /* Percent of slots, counting tombstones */
+
+#define ST_EMPTY 0x80
+#define ST_DELETED 0xfe
+
+#define ST_LSB 0x0101010101010101u
+#define ST_MSB 0x8080808080808080u
+
+struct st {
+        uint8_t *ctrl;
+        struct st_slot {
+                uint64_t hash;
+                void *key;
+                void *value;
+        } *slot;
+
+        size_t num_slots;       /* A power of two, and a multiple of ST_GROUP */
+        size_t num_keys;
+        size_t num_deleted;
+        unsigned max_load;      /* Percent, below 100 so a probe always ends */
+
+        int (*equal)(void *a, void *b);
+        unsigned long version;
+};
+
+/* The group's control bytes, with the first one in the low byte. */
+static uint64_t st_group(const uint8_t *ctrl)
+{
+        uint64_t group;
+        memcpy(&group, ctrl, sizeof group);
+#if defined(__BYTE_ORDER__) && __BYTE_ORDER__ == __ORDER_BIG_ENDIAN__
+        group = __builtin_bswap64(group);
+#endif
+        return group;
+}
+
+/* The top bit of each byte that might be `h2`. There can be false positives,
+ * but only above a true match. */
+static uint64_t st_match(uint64_t group, uint8_t h2)
+{
+        uint64_t x = group ^ (ST_LSB * h2);
+        return (x - ST_LSB) & ~x & ST_MSB;
+}
+
+/* ST_EMPTY is the only control byte with the top bit set and bit 1 clear. */
+static uint64_t st_match_empty(uint64_t group)
+{
+        return group & ~group << 6 & ST_MSB;
+}
+
+static uint64_t st_match_empty_or_deleted(uint64_t group)
+{
+        return group & ST_MSB;
+}
+
+/* The position in its group of the lowest byte in a match. */
+static size_t st_first(uint64_t match)
+{
+#if defined(__GNUC__)
+        return __builtin_ctzll(match) / 8;
+#else
+        size_t i = 0;
+        while (!(match & 0x80)) match >>= 8, i++;
+        return i;
+#endif
+}
+
+static uint64_t st_mix(uint64_t hash)
+{
+        hash ^= hash >> 33;
+        hash *= 0xff51afd7ed558ccdu;
+        return hash ^ hash >> 29;
+}
+
+static size_t st_limit(struct st *s, size_t num_slots)
+{
+        return num_slots * s->max_load / 100;
+}
+
+int st_init_with(struct st *s, int (*equal)(void *, void *))
+{
+        memset(s, 0, sizeof *s);
+        s->ctrl = HT_MALLOC(ST_MIN_SLOTS);
+        s->slot = HT_MALLOC(ST_MIN_SLOTS * sizeof *s->slot);
+
+        if (!s->ctrl || !s->slot) {
+                HT_FREE(s->ctrl);
+                HT_FREE(s->slot);
+                return HT_ERROR;
+        }
+
+        memset(s->ctrl, ST_EMPTY, ST_MIN_SLOTS);
+        s->num_slots = ST_MIN_SLOTS;
+        s->max_load = ST_MAX_LOAD;
+        s->equal = equal;
+        return 0;
+}
+
+/* The first empty or deleted slot in the probe sequence for `mixed`. */
+static size_t st_free_slot(struct st *s, uint64_t mixed)
+{
+        size_t mask = s->num_slots / ST_GROUP - 1;
+        size_t group = (mixed >> 7) & mask;
+
+        for (size_t step = 1; ; step++) {
+                uint64_t match = st_match_empty_or_deleted(
+                        st_group(s->ctrl + group * ST_GROUP));
+                if (match) return group * ST_GROUP + st_first(match);
+                group = (group + step) & mask;
+        }
+}
+
+static int st_resize(struct st *s, size_t num_slots)
+{
+        struct st old = *s;
+
+        s->ctrl = HT_MALLOC(num_slots);
+        s->slot = HT_MALLOC(num_slots * sizeof *s->slot);
+
+        if (!s->ctrl || !s->slot) {
+                HT_FREE(s->ctrl);
+                HT_FREE(s->slot);
+                *s = old;
+                return HT_ERROR;
+        }
+
+        memset(s->ctrl, ST_EMPTY, num_slots);
+        s->num_slots = num_slots;
+        s->num_deleted = 0;
+        s->version++;
+
+        for (size_t i = 0; i < old.num_slots; i++) {
+                if (old.ctrl[i] & 0x80) continue;
+                size_t j = st_free_slot(s, st_mix(old.slot[i].hash));
+                s->ctrl[j] = old.ctrl[i];
+                s->slot[j] = old.slot[i];
+        }
+
+        HT_FREE(old.ctrl);
+        HT_FREE(old.slot);
+        return 0;
+}
+
+/* Like `ht_find`. */
+int st_find(struct st *s, void *key, uint64_t hash, struct st_slot **found)
+{
+        uint64_t mixed = st_mix(hash);
+        uint8_t h2 = mixed & 0x7f;
+        size_t mask = s->num_slots / ST_GROUP - 1;
+        size_t group = (mixed >> 7) & mask;
+
+        for (size_t step = 1; ; step++) {
+                uint64_t bytes = st_group(s->ctrl + group * ST_GROUP);
+
+                for (uint64_t match = st_match(bytes, h2); match;
+                     match &= match - 1) {
+                        size_t i = group * ST_GROUP + st_first(match);
+                        struct st_slot *slot = s->slot + i;
+
+                        if (s->ctrl[i] != h2 || slot->hash != hash) continue;
+                        if (slot->key == key) {
+                                *found = slot;
+                                return 0;
+                        }
+
+                        unsigned long version = s->version;
+                        int equal = s->equal(slot->key, key);
+                        if (equal < 0) return HT_ERROR;
+                        if (s->version != version) return HT_CHANGED;
+                        if (equal) {
+                                *found = slot;
+                                return 0;
+                        }
+                }
+
+                if (st_match_empty(bytes)) break;
+                group = (group + step) & mask;
+        }
+
+        *found = NULL;
+        return 0;
+}
+
+/* Like `ht_insert`, except a new slot isn't at the end of anything. */
+int st_insert(struct st *s, void *key, uint64_t hash, struct st_slot **slot)
+{
+        int err = st_find(s, key, hash, slot);
+        if (err) return err;
+        if (*slot) return 0;
+
+        if (s->num_keys + s->num_deleted + 1 > st_limit(s, s->num_slots)) {
+                /* If tombstones are most of the load, getting rid of them by
+                 * rehashing at the same size is enough. */
+                size_t num_slots = s->num_slots;
+                if (s->num_keys + 1 > st_limit(s, num_slots) / 2)
+                        num_slots *= 2;
+                if (st_resize(s, num_slots)) return HT_ERROR;
+        }
+
+        uint64_t mixed = st_mix(hash);
+        size_t i = st_free_slot(s, mixed);
+
+        if (s->ctrl[i] == ST_DELETED) s->num_deleted--;
+        s->ctrl[i] = mixed & 0x7f;
+        s->slot[i] = (struct st_slot) { .hash = hash, .key = key };
+
+        s->num_keys++;
+        s->version++;
+        *slot = s->slot + i;
+        return 1;
+}
+
+/* Like `ht_remove`. */
+void st_remove(struct st *s, struct st_slot *slot)
+{
+        size_t i = slot - s->slot;
+
+        /* A group with an empty slot has never been full since the last
+         * rehash, so no probe has gone past it and this slot can be empty
+         * too. Otherwise a probe might have, and it needs a tombstone to keep
+         * going. */
+        if (st_match_empty(st_group(s->ctrl + i / ST_GROUP * ST_GROUP))) {
+                s->ctrl[i] = ST_EMPTY;
+        } else {
+                s->ctrl[i] = ST_DELETED;
+                s->num_deleted++;
+        }
+
+        s->num_keys--;
+        s->version++;
+
+        if (s->num_slots > ST_MIN_SLOTS && s->num_keys < s->num_slots / 8)
+                st_resize(s, s->num_slots / 2);
+}
+
+/* Like `ht_next`, but in slot order. */
+struct st_slot *st_next(struct st *s, struct st_slot *slot)
+{
+        for (size_t i = slot ? (size_t)(slot - s->slot) + 1 : 0;
+             i < s->num_slots; i++)
+                if (!(s->ctrl[i] & 0x80)) return s->slot + i;
+        return NULL;
+}
+
+/* Like `ht_free`. */
+void st_free(struct st *s)
+{
+        HT_FREE(s->ctrl);
+        HT_FREE(s->slot);
+        memset(s, 0, sizeof *s);
+}
+
+/*
+ * Interned string keys. Each different string is stored once, in an arena,
+ * after its hash and length. Tables keyed by interned keys never hash or
+ * compare their text again: equal keys are the same pointer, which `ht_find`
+ * and `st_find` check first, and any other key with the same hash is told
+ * apart by `ht_key_equal` looking at the lengths before the text.
+ *
+ * The store finds keys with a chained table of its own, linked through the
+ * keys themselves, so it costs a pointer per key and about one per bucket.
+ */
+
+struct ht_key {
+        struct ht_key *next;    /* In the same bucket of the store */
+        uint64_t hash;
+        uint32_t len;
+        char text[];            /* With a NUL after it, so it's a C string */
+};
+
+struct ht_keys {
+        struct ht_key **bucket;
+        size_t num_buckets;     /* A power of two, no more than the keys */
+        size_t num_keys;
+        struct ht_arena arena;  /* Where the keys are kept */
+};
+
+/* The hash `ht_intern` gives a key, djb2. */
+uint64_t ht_hash_string(const char *text, size_t len)
+{
+        uint64_t hash = 5381;
+
+        for (size_t i = 0; i < len; i++)
+                hash = ((hash << 5) + hash) + text[i];
+
+        return hash;
+}
+
+int ht_key_equal(void *a, void *b)
+{
+        struct ht_key *x = a, *y = b;
+        return x == y || (x->len == y->len && x->hash == y->hash
+                          && !memcmp(x->text, y->text, x->len));
+}
+
+int ht_keys_init(struct ht_keys *k)
+{
+        memset(k, 0, sizeof *k);
+        ht_arena_init(&k->arena);
+        k->bucket = HT_CALLOC(HT_MIN_BUCKETS, sizeof *k->bucket);
+        if (!k->bucket) return HT_ERROR;
+        k->num_buckets = HT_MIN_BUCKETS;
+        return 0;
+}
+
+static size_t ht_keys_index(struct ht_keys *k, uint64_t hash)
+{
+        return (hash ^ (hash >> 29) ^ (hash >> 47)) & (k->num_buckets - 1);
+}
+
+static int ht_keys_grow(struct ht_keys *k)
+{
+        size_t num_buckets = k->num_buckets * 2;
+        struct ht_key **bucket = HT_CALLOC(num_buckets, sizeof *bucket);
+        if (!bucket) return HT_ERROR;
+
+        struct ht_key **old = k->bucket;
+        size_t num_old = k->num_buckets;
+        k->bucket = bucket;
+        k->num_buckets = num_buckets;
+
+        for (size_t i = 0; i < num_old; i++) {
+                struct ht_key *key = old[i];
+                while (key) {
+                        struct ht_key *next = key->next;
+                        size_t j = ht_keys_index(k, key->hash);
+                        key->next = bucket[j];
+                        bucket[j] = key;
+                        key = next;
+                }
+        }
+
+        HT_FREE(old);
+        return 0;
+}
+
+/* The interned key for the `len` bytes at `text`, or NULL if an allocation
+ * failed or it's 4GB or more. */
+struct ht_key *ht_intern(struct ht_keys *k, const char *text, size_t len)
+{
+        if (len > UINT32_MAX) return NULL;
+
+        uint64_t hash = ht_hash_string(text, len);
+        struct ht_key **bucket = &k->bucket[ht_keys_index(k, hash)];
+
+        for (struct ht_key *key = *bucket; key; key = key->next)
+                if (key->hash == hash && key->len == len
+                    && !memcmp(key->text, text, len))
+                        return key;
+
+        struct ht_key *key = ht_arena_alloc(&k->arena,
+                                            offsetof(struct ht_key, text)
+                                            + len + 1);
+        if (!key) return NULL;
+
+        memcpy(key->text, text, len);
+        key->text[len] = 0;
+        key->len = len;
+        key->hash = hash;
+        key->next = *bucket;
+        *bucket = key;
+
+        /* If growing fails the key is still in, the chains are just longer
+         * than they should be. */
+        if (++k->num_keys > k->num_buckets) ht_keys_grow(k);
+
+        return key;
+}
+
+/* Forget every interned key at once. */
+void ht_keys_reset(struct ht_keys *k)
+{
+        memset(k->bucket, 0, k->num_buckets * sizeof *k->bucket);
+        k->num_keys = 0;
+        ht_arena_reset(&k->arena);
+}
+
+void ht_keys_free(struct ht_keys *k)
+{
+        HT_FREE(k->bucket);
+        ht_arena_free(&k->arena);
+        memset(k, 0, sizeof *k);
+}
+
+#ifndef HT_NO_THREADS
+
+/*
+ * A table that can be shared between threads. It's a number of chained tables
+ * ("stripes"), each with its own lock, and each key belongs to the one its hash
+ * picks, so threads working on different stripes never wait for each other.
+ * The locks are readers-writer locks, so lookups in the same stripe don't wait
+ * for each other either, only for inserts and deletes.
+ *
+ * Values come out of a lookup by copy, since the entry could be gone as soon as
+ * the stripe is unlocked. There's no order across stripes, so no iteration or
+ * `move_to_end`. Each stripe has its own slab for its entries, which it only
+ * uses with its lock held.
+ */
+
+#include <pthread.h>
+
+#define HT_CACHE_LINE 64
+
+struct ht_shard {
+        pthread_rwlock_t lock;
+        struct ht table;
+        struct ht_slab slab;
+};
+
+/* A stripe padded out to a whole number of cache lines, so two stripes' locks
+ * are never in the same one. */
+union ht_shard_line {
+        struct ht_shard s;
+        char pad[(sizeof (struct ht_shard) + HT_CACHE_LINE - 1)
+                 / HT_CACHE_LINE * HT_CACHE_LINE];
+};
+
+struct ht_shards {
+        union ht_shard_line *shard;     /* Aligned to a cache line */
+        size_t num_shards;              /* A power of two */
+        void *memory;                   /* What `shard` is in */
+};
+
+void ht_shards_free(struct ht_shards *s);
+
+int ht_shards_init(struct ht_shards *s, size_t num_shards,
+                   int (*equal)(void *, void *))
+{
+        memset(s, 0, sizeof *s);
+
+        s->memory = HT_MALLOC(num_shards * sizeof *s->shard
+                              + HT_CACHE_LINE - 1);
+        if (!s->memory) return HT_ERROR;
+
+        s->shard = (void *)(((uintptr_t)s->memory + HT_CACHE_LINE - 1)
+                            & ~(uintptr_t)(HT_CACHE_LINE - 1));
+
+        for (size_t i = 0; i < num_shards; i++) {
+                struct ht_shard *shard = &s->shard[i].s;
+
+                if (ht_init_with(&shard->table, equal, sizeof (struct ht_entry))) {
+                        ht_shards_free(s);
+                        return HT_ERROR;
+                }
+
+                if (pthread_rwlock_init(&shard->lock, NULL)) {
+                        ht_free(&shard->table);
+                        ht_shards_free(s);
+                        return HT_ERROR;
+                }
+
+                ht_slab_init(&shard->slab, sizeof (struct ht_entry));
+                shard->table.slab = &shard->slab;
+                s->num_shards++;
+        }
+
+        return 0;
+}
+
+static struct ht_shard *ht_shard_for(struct ht_shards *s, uint64_t hash)
+{
+        /* The stripe's own table uses the low bits of the hash (more or
+         * less), so use the high ones. */
+        return &s->shard[(st_mix(hash) >> 32) & (s->num_shards - 1)].s;
+}
+
+/* Like `ht_find`, but returns 1 and sets `*value` if `key` is there, or 0. */
+int ht_shards_get(struct ht_shards *s, void *key, uint64_t hash, void **value)
+{
+        struct ht_shard *shard = ht_shard_for(s, hash);
+        struct ht_entry *e;
+
+        pthread_rwlock_rdlock(&shard->lock);
+        int err = ht_find(&shard->table, key, hash, &e);
+        if (!err && e) *value = e->value;
+        pthread_rwlock_unlock(&shard->lock);
+
+        return err ? err : e != NULL;
+}
+
+/* Set `key` to `value`. Returns 1 if it's new, 0 if it was already there, or
+ * HT_ERROR/HT_CHANGED. */
+int ht_shards_put(struct ht_shards *s, void *key, uint64_t hash, void *value)
+{
+        struct ht_shard *shard = ht_shard_for(s, hash);
+        struct ht_entry *e;
+
+        pthread_rwlock_wrlock(&shard->lock);
+        int created = ht_insert(&shard->table, key, hash, &e);
+        if (created >= 0) e->value = value;
+        pthread_rwlock_unlock(&shard->lock);
+
+        return created;
+}
+
+/* Remove `key`. Returns 1 if it was there, 0 if not, or HT_ERROR/HT_CHANGED. */
+int ht_shards_delete(struct ht_shards *s, void *key, uint64_t hash)
+{
+        struct ht_shard *shard = ht_shard_for(s, hash);
+        struct ht_entry *e;
+
+        pthread_rwlock_wrlock(&shard->lock);
+        int err = ht_find(&shard->table, key, hash, &e);
+        if (!err && e) ht_remove(&shard->table, e);
+        pthread_rwlock_unlock(&shard->lock);
+
+        return err ? err : e != NULL;
+}
 
-#define HT_BUCKETS 1000
+/* How many keys there are. The stripes are counted one at a time, so it's
+ * only exact if nothing else is changing the table. */
+size_t ht_shards_count(struct ht_shards *s)
+{
+        size_t count = 0;
 
-struct ht {
-        struct bucket {
-                void *value;
-                char *key;
-                struct bucket *next;
-        } **bucket;
+        for (size_t i = 0; i < s->num_shards; i++) {
+                struct ht_shard *shard = &s->shard[i].s;
+                pthread_rwlock_rdlock(&shard->lock);
+                count += shard->table.num_keys;
+                pthread_rwlock_unlock(&shard->lock);
+        }
 
-        unsigned num_keys;
-};
+        return count;
+}
 
-void ht_init(struct ht *h)
+/* Free the table, which no other thread can be using any more. */
+void ht_shards_free(struct ht_shards *s)
 {
-        memset(h, 0, sizeof *h);
-        h->bucket = malloc(HT_BUCKETS * sizeof *h->bucket);
-        memset(h->bucket, 0, HT_BUCKETS * sizeof *h->bucket);
+        for (size_t i = 0; i < s->num_shards; i++) {
+                struct ht_shard *shard = &s->shard[i].s;
+                ht_free(&shard->table);
+                ht_slab_free(&shard->slab);
+                pthread_rwlock_destroy(&shard->lock);
+        }
+
+        HT_FREE(s->memory);
+        memset(s, 0, sizeof *s);
 }
 
+#endif
+
+#ifndef HT_NO_MAIN
+
+/* String keys, which is all `main` needs. */
+
+/* The same as `ht_hash_string`, in one pass over a C string. */
 uint64_t hash(char *d)
 {
-	uint64_t hash = 5381;
-        size_t len = strlen(d);
+        uint64_t hash = 5381;
+
+        for (; *d; d++)
+                hash = ((hash << 5) + hash) + *d;
+
+        return hash;
+}
 
-	for (size_t i = 0; i < len; i++)
-		hash = ((hash << 5) + hash) + d[i];
+static int streq(void *a, void *b)
+{
+        return !strcmp(a, b);
+}
 
-	return hash % HT_BUCKETS;
+void ht_init(struct ht *h)
+{
+        if (ht_init_with(h, streq, sizeof (struct ht_entry))) abort();
 }
+
 void ht_add(struct ht *h, char *key, void *value)
 {
-        unsigned bucket_index = hash(key);
-        struct bucket **b = &h->bucket[bucket_index];
-        while (*b && strcmp((*b)->key, key)) b = &(*b)->next;
-        if (!*b) {
-                *b = malloc(sizeof *b);
-                **b = (struct bucket) {
-                        .key = key,
-                        .value = value,
-                        .next = 0,
-                };
-        } else {
-                (*b)->value = value;
-        }
+        struct ht_entry *e;
+        if (ht_insert(h, key, hash(key), &e) < 0) abort();
+        e->value = value;
 }
 
 void *ht_get(struct ht *h, char *key)
 {
-        unsigned bucket_index = hash(key);
-        struct bucket *b = h->bucket[bucket_index];
-        while (b && strcmp(b->key, key)) b = b->next;
-        return b ? b->value : 0;
+        struct ht_entry *e;
+        ht_find(h, key, hash(key), &e);
+        return e ? e->value : 0;
+}
+
+void ht_delete(struct ht *h, char *key)
+{
+        struct ht_entry *e;
+        ht_find(h, key, hash(key), &e);
+        if (e) ht_remove(h, e);
+}
+
+void st_init(struct st *s)
+{
+        if (st_init_with(s, streq)) abort();
+}
+
+void st_add(struct st *s, char *key, void *value)
+{
+        struct st_slot *slot;
+        if (st_insert(s, key, hash(key), &slot) < 0) abort();
+        slot->value = value;
+}
+
+void *st_get(struct st *s, char *key)
+{
+        struct st_slot *slot;
+        st_find(s, key, hash(key), &slot);
+        return slot ? slot->value : 0;
+}
+
+void st_delete(struct st *s, char *key)
+{
+        struct st_slot *slot;
+        st_find(s, key, hash(key), &slot);
+        if (slot) st_remove(s, slot);
 }
 
-void random_string(char **string)
+/* A random string of 1 to 10 letters, interned in `keys`. */
+char *random_string(struct ht_keys *keys)
 {
+        char string[10];
         unsigned len = 1 + rand() % 10;
-        *string = malloc(len + 1);
+
         for (unsigned i = 0; i < len; i++)
-                (*string)[i] = 'a' + (rand() % 26);
-        (*string)[len] = 0;
+                string[i] = 'a' + (rand() % 26);
+
+        struct ht_key *key = ht_intern(keys, string, len);
+        if (!key) abort();
+        return key->text;
 }
 
 struct value {
@@ -103,20 +1090,667 @@ struct value *value_get(char *key)
         return NULL;
 }
 
-int main(void)
+/*
+ * `./hashtable bench [max keys]` compares the two tables. For each size from
+ * 1000 keys up to the maximum (a million by default) in powers of ten, and each
+ * key length, it fills both tables to 50%, 75% and 87% of the number of
+ * buckets or slots they'd have at that size (both are allowed to get 90% full
+ * before growing, so that's where they stay) and reports:
+ *
+ *     load       keys per bucket or slot once they're all in
+ *     bytes/key  heap used by the table per key, not counting the keys
+ *     insert     ns per insert, counting the resizes
+ *     hit        ns per lookup of a key that's there
+ *     50/50      ns per lookup when half of the keys looked up are there
+ *     miss       ns per lookup of a key that isn't there
+ *     delete     ns per delete, of every key
+ *
+ * The keys are hashed beforehand, so the times are only the tables' own (plus
+ * an indirect call each, the same for both).
+ */
+
+#ifdef __GLIBC__
+#include <malloc.h>             /* mallinfo2 */
+#endif
+
+#define BENCH_LOOKUPS 1000000
+#define BENCH_MAX_LOAD 90
+
+struct bench_key {
+        char *key;
+        uint64_t hash;
+};
+
+struct bench_table {
+        const char *name;
+        void *(*new)(unsigned max_load);
+        void (*add)(void *t, char *key, uint64_t hash);
+        int (*has)(void *t, char *key, uint64_t hash);
+        void (*delete)(void *t, char *key, uint64_t hash);
+        double (*load)(void *t);
+        size_t (*bytes)(void *t);
+        void (*free)(void *t);
+};
+
+static void *bench_ht_new(unsigned max_load)
+{
+        struct ht *h = malloc(sizeof *h);
+        ht_init(h);
+        h->max_load = max_load;
+        return h;
+}
+
+static void bench_ht_add(void *t, char *key, uint64_t hash)
+{
+        struct ht_entry *e;
+        if (ht_insert(t, key, hash, &e) < 0) abort();
+        e->value = key;
+}
+
+static int bench_ht_has(void *t, char *key, uint64_t hash)
+{
+        struct ht_entry *e;
+        ht_find(t, key, hash, &e);
+        return e != NULL;
+}
+
+static void bench_ht_delete(void *t, char *key, uint64_t hash)
+{
+        struct ht_entry *e;
+        ht_find(t, key, hash, &e);
+        if (e) ht_remove(t, e);
+}
+
+static double bench_ht_load(void *t)
+{
+        struct ht *h = t;
+        return (double)h->num_keys / h->num_buckets;
+}
+
+static size_t bench_ht_bytes(void *t)
+{
+        struct ht *h = t;
+        return sizeof *h + h->num_buckets * sizeof *h->bucket
+                + h->num_keys * h->entry_size;
+}
+
+static void bench_ht_free(void *t)
+{
+        ht_free(t);
+        free(t);
+}
+
+static void *bench_st_new(unsigned max_load)
+{
+        struct st *s = malloc(sizeof *s);
+        st_init(s);
+        s->max_load = max_load;
+        return s;
+}
+
+static void bench_st_add(void *t, char *key, uint64_t hash)
+{
+        struct st_slot *slot;
+        if (st_insert(t, key, hash, &slot) < 0) abort();
+        slot->value = key;
+}
+
+static int bench_st_has(void *t, char *key, uint64_t hash)
+{
+        struct st_slot *slot;
+        st_find(t, key, hash, &slot);
+        return slot != NULL;
+}
+
+static void bench_st_delete(void *t, char *key, uint64_t hash)
+{
+        struct st_slot *slot;
+        st_find(t, key, hash, &slot);
+        if (slot) st_remove(t, slot);
+}
+
+static double bench_st_load(void *t)
+{
+        struct st *s = t;
+        return (double)s->num_keys / s->num_slots;
+}
+
+static size_t bench_st_bytes(void *t)
+{
+        struct st *s = t;
+        return sizeof *s + s->num_slots * (1 + sizeof *s->slot);
+}
+
+static void bench_st_free(void *t)
+{
+        st_free(t);
+        free(t);
+}
+
+static struct bench_table bench_tables[] = {
+        { "chained", bench_ht_new, bench_ht_add, bench_ht_has,
+          bench_ht_delete, bench_ht_load, bench_ht_bytes, bench_ht_free },
+        { "swiss", bench_st_new, bench_st_add, bench_st_has,
+          bench_st_delete, bench_st_load, bench_st_bytes, bench_st_free },
+};
+
+static double now_ns(void)
+{
+        struct timespec t;
+        timespec_get(&t, TIME_UTC);
+        return t.tv_sec * 1e9 + t.tv_nsec;
+}
+
+/* Bytes allocated on the heap, or 0 if there's no way to tell. */
+static size_t heap_used(void)
+{
+#if defined(__GLIBC__) && (__GLIBC__ > 2 || __GLIBC_MINOR__ >= 33)
+        struct mallinfo2 m = mallinfo2();
+        return m.uordblks + m.hblkhd;
+#else
+        return 0;
+#endif
+}
+
+static uint64_t bench_random(uint64_t *state)
+{
+        *state ^= *state >> 12;
+        *state ^= *state << 25;
+        *state ^= *state >> 27;
+        return *state * 0x2545f4914f6cdd1du;
+}
+
+/*
+ * `count` different keys of `len` letters, from `first` onwards, so keys made
+ * with 'a' and with 'A' never clash. The last 6 letters are the key's index in
+ * base 26 (enough for 308 million keys), and the rest are random.
+ */
+static struct bench_key *bench_keys(size_t count, size_t len, char first,
+                                    uint64_t *state)
+{
+        struct bench_key *keys = malloc(count * sizeof *keys);
+        char *text = malloc(count * (len + 1));
+
+        for (size_t i = 0; i < count; i++) {
+                char *key = text + i * (len + 1);
+                size_t n = i;
+
+                for (size_t j = len; j-- > 0;) {
+                        if (j + 6 >= len) {
+                                key[j] = first + n % 26;
+                                n /= 26;
+                        } else {
+                                key[j] = first + bench_random(state) % 26;
+                        }
+                }
+
+                key[len] = 0;
+                keys[i] = (struct bench_key) { key, hash(key) };
+        }
+
+        return keys;
+}
+
+static void bench_free_keys(struct bench_key *keys)
+{
+        free(keys[0].key);
+        free(keys);
+}
+
+/* Lookups of random keys, `hits` percent of them from `keys`. */
+static struct bench_key *bench_lookups(struct bench_key *keys, size_t count,
+                                       struct bench_key *misses,
+                                       unsigned hits, uint64_t *state)
+{
+        struct bench_key *lookups = malloc(BENCH_LOOKUPS * sizeof *lookups);
+
+        for (size_t i = 0; i < BENCH_LOOKUPS; i++)
+                lookups[i] = bench_random(state) % 100 < hits
+                        ? keys[bench_random(state) % count]
+                        : misses[i];
+
+        return lookups;
+}
+
+static double bench_find(struct bench_table *table, void *t,
+                         struct bench_key *lookups)
+{
+        /* Otherwise an optimizing compiler throws the lookups away. */
+        volatile int found = 0;
+
+        double begin = now_ns();
+        for (size_t i = 0; i < BENCH_LOOKUPS; i++)
+                found += table->has(t, lookups[i].key, lookups[i].hash);
+        return (now_ns() - begin) / BENCH_LOOKUPS;
+}
+
+static void bench_run(struct bench_table *table,
+                      struct bench_key *keys, size_t count, size_t len,
+                      struct bench_key **lookups)
+{
+        /* Small tables are filled several times to get a measurable time. */
+        size_t rounds = count < BENCH_LOOKUPS ? BENCH_LOOKUPS / count : 1;
+        double insert = 0;
+        size_t bytes = 0;
+        void *t = NULL;
+
+        for (size_t round = 0; round < rounds; round++) {
+                if (t) table->free(t);
+
+                size_t before = heap_used();
+                t = table->new(BENCH_MAX_LOAD);
+
+                double begin = now_ns();
+                for (size_t i = 0; i < count; i++)
+                        table->add(t, keys[i].key, keys[i].hash);
+                insert += now_ns() - begin;
+
+                bytes = heap_used() - before;
+        }
+
+        if (!bytes) bytes = table->bytes(t);
+
+        double hit = bench_find(table, t, lookups[0]);
+        double half = bench_find(table, t, lookups[1]);
+        double miss = bench_find(table, t, lookups[2]);
+        double load = table->load(t);
+
+        double begin = now_ns();
+        for (size_t i = 0; i < count; i++)
+                table->delete(t, keys[i].key, keys[i].hash);
+        double delete = (now_ns() - begin) / count;
+
+        table->free(t);
+
+        printf("%-8s %9zu %4zu %5.2f %10.1f %7.1f %6.1f %6.1f %6.1f %7.1f\n",
+               table->name, count, len, load,
+               (double)bytes / count, insert / (rounds * count),
+               hit, half, miss, delete);
+}
+
+int bench(size_t max_keys)
+{
+        static const size_t lengths[] = { 8, 32 };
+        static const unsigned loads[] = { 50, 75, 87 };
+        uint64_t state = 88172645463325252u;
+
+        printf("%-8s %9s %4s %5s %10s %7s %6s %6s %6s %7s\n",
+               "table", "keys", "len", "load", "bytes/key",
+               "insert", "hit", "50/50", "miss", "delete");
+
+        for (size_t size = 1000; size <= max_keys; size *= 10) {
+                size_t capacity = 1;
+                while (capacity < size) capacity *= 2;
+
+                for (size_t l = 0; l < sizeof lengths / sizeof *lengths; l++) {
+                        size_t len = lengths[l];
+                        struct bench_key *keys = bench_keys(
+                                capacity * loads[2] / 100, len, 'a', &state);
+                        struct bench_key *misses =
+                                bench_keys(BENCH_LOOKUPS, len, 'A', &state);
+
+                        for (size_t i = 0; i < sizeof loads / sizeof *loads; i++) {
+                                size_t count = capacity * loads[i] / 100;
+                                struct bench_key *lookups[] = {
+                                        bench_lookups(keys, count, misses, 100, &state),
+                                        bench_lookups(keys, count, misses, 50, &state),
+                                        bench_lookups(keys, count, misses, 0, &state),
+                                };
+
+                                for (size_t t = 0; t < sizeof bench_tables / sizeof *bench_tables; t++)
+                                        bench_run(bench_tables + t, keys, count,
+                                                  len, lookups);
+
+                                for (size_t j = 0; j < 3; j++) free(lookups[j]);
+                        }
+
+                        bench_free_keys(misses);
+                        bench_free_keys(keys);
+                }
+        }
+
+        return 0;
+}
+
+/*
+ * `./hashtable alloc [keys]` puts random keys of 8 to 16 letters (a million by
+ * default) into one chained table and then into four, and frees it all. Each
+ * time it's done the old way, with a malloc for every key and every entry (and
+ * so a copy of each key for each table that owns it), and with interned keys
+ * and a slab for the entries, in a process of its own so it has its own peak
+ * RSS. It reports:
+ *
+ *     allocs    calls to HT_MALLOC and HT_CALLOC
+ *     peak MB   resident set size of the process at its biggest
+ *     insert    ns per key, counting copying or interning it
+ *     free      ns per key to free the tables and the keys
+ */
+
+#include <sys/resource.h>       /* getrusage */
+#include <sys/wait.h>           /* waitpid */
+#include <unistd.h>             /* fork */
+
+#define ALLOC_MAX_TABLES 4
+
+static void alloc_run(int interned, size_t count, size_t tables)
+{
+        uint64_t state = 88172645463325252u;
+        struct ht h[ALLOC_MAX_TABLES];
+        struct ht_slab slab;
+        struct ht_keys keys;
+        char text[17];
+
+        size_t allocations = atomic_load_explicit(&ht_allocations,
+                                                  memory_order_relaxed);
+        double begin = now_ns();
+
+        ht_slab_init(&slab, sizeof (struct ht_entry));
+        if (interned && ht_keys_init(&keys)) abort();
+
+        for (size_t t = 0; t < tables; t++) {
+                if (ht_init_with(h + t, interned ? ht_key_equal : streq,
+                                 sizeof (struct ht_entry)))
+                        abort();
+                if (interned) h[t].slab = &slab;
+        }
+
+        for (size_t i = 0; i < count; i++) {
+                size_t len = 8 + bench_random(&state) % 9;
+                for (size_t j = 0; j < len; j++)
+                        text[j] = 'a' + bench_random(&state) % 26;
+                text[len] = 0;
+
+                struct ht_key *key = interned ? ht_intern(&keys, text, len)
+                                              : NULL;
+                if (interned && !key) abort();
+
+                for (size_t t = 0; t < tables; t++) {
+                        struct ht_entry *e;
+
+                        if (interned) {
+                                if (ht_insert(h + t, key, key->hash, &e) < 0)
+                                        abort();
+                                continue;
+                        }
+
+                        char *copy = HT_MALLOC(len + 1);
+                        if (!copy) abort();
+                        memcpy(copy, text, len + 1);
+
+                        int created = ht_insert(h + t, copy, hash(copy), &e);
+                        if (created < 0) abort();
+                        if (!created) HT_FREE(copy);
+                }
+        }
+
+        double insert = now_ns() - begin;
+        allocations = atomic_load_explicit(&ht_allocations,
+                                           memory_order_relaxed) - allocations;
+        begin = now_ns();
+
+        for (size_t t = 0; t < tables; t++) {
+                if (!interned)
+                        for (struct ht_entry *e = ht_next(h + t, NULL); e;
+                             e = ht_next(h + t, e))
+                                HT_FREE(e->key);
+                ht_free(h + t);
+        }
+
+        ht_slab_free(&slab);
+        if (interned) ht_keys_free(&keys);
+
+        double freeing = now_ns() - begin;
+
+        struct rusage usage;
+        getrusage(RUSAGE_SELF, &usage);
+
+        printf("%-9s %6zu %9zu %8.1f %7.1f %7.1f\n",
+               interned ? "interned" : "malloc", tables, allocations,
+               usage.ru_maxrss / 1024.0, insert / count, freeing / count);
+}
+
+int alloc(size_t count)
+{
+        static const size_t tables[] = { 1, ALLOC_MAX_TABLES };
+
+        printf("%-9s %6s %9s %8s %7s %7s\n", "keys", "tables", "allocs",
+               "peak MB", "insert", "free");
+
+        for (size_t t = 0; t < sizeof tables / sizeof *tables; t++) {
+                for (int interned = 0; interned < 2; interned++) {
+                        fflush(stdout);
+
+                        pid_t pid = fork();
+                        if (pid < 0) {
+                                perror("fork");
+                                return 1;
+                        }
+
+                        if (pid == 0) {
+                                alloc_run(interned, count, tables[t]);
+                                fflush(stdout);
+                                _exit(0);
+                        }
+
+                        int status;
+                        if (waitpid(pid, &status, 0) < 0 || !WIFEXITED(status)
+                            || WEXITSTATUS(status))
+                                return 1;
+                }
+        }
+
+        return 0;
+}
+
+#ifndef HT_NO_THREADS
+
+/*
+ * `./hashtable threads [keys] [max threads]` measures how a shared table's
+ * throughput scales with threads, from 1 up to the maximum (the number of CPUs
+ * by default). The table starts with `keys` keys (a million by default), and
+ * each thread runs its share of a fixed number of operations on random keys:
+ *
+ *     read-heavy  90% lookups, 5% inserts and 5% deletes
+ *     mixed       50% lookups, 25% inserts and 25% deletes
+ *
+ * Lookups are of keys that are there, and inserts and deletes are of a second
+ * set of keys, so about half of those are there at any time. It's run with a
+ * single stripe, which is the same as one lock around a plain table, and with
+ * THREADS_STRIPES, and reports millions of operations per second in all, of
+ * lookups and of inserts, and the speedup over one thread.
+ */
+
+#define THREADS_OPS 4000000
+#define THREADS_STRIPES 64
+
+struct threads_work {
+        struct ht_shards *table;
+        struct bench_key *keys, *extra;
+        size_t num_keys;
+        unsigned lookups, inserts;      /* Percent, and the rest are deletes */
+        size_t ops;
+        uint64_t seed;
+        pthread_barrier_t *start;
+        size_t done_lookups, done_inserts;
+};
+
+static void *threads_worker(void *arg)
+{
+        struct threads_work *w = arg;
+        uint64_t state = w->seed;
+        void *value;
+
+        pthread_barrier_wait(w->start);
+
+        for (size_t i = 0; i < w->ops; i++) {
+                unsigned op = bench_random(&state) % 100;
+                struct bench_key *k;
+
+                if (op < w->lookups) {
+                        k = w->keys + bench_random(&state) % w->num_keys;
+                        if (ht_shards_get(w->table, k->key, k->hash, &value) != 1)
+                                abort();
+                        w->done_lookups++;
+                } else if (op < w->lookups + w->inserts) {
+                        k = w->extra + bench_random(&state) % w->num_keys;
+                        if (ht_shards_put(w->table, k->key, k->hash, k->key) < 0)
+                                abort();
+                        w->done_inserts++;
+                } else {
+                        k = w->extra + bench_random(&state) % w->num_keys;
+                        ht_shards_delete(w->table, k->key, k->hash);
+                }
+        }
+
+        return NULL;
+}
+
+/* Runs the workload with `num_threads` threads and returns the seconds it
+ * took, adding up the lookups and inserts done. */
+static double threads_run(struct ht_shards *table, struct bench_key *keys,
+                          struct bench_key *extra, size_t num_keys,
+                          unsigned lookups, unsigned inserts,
+                          size_t num_threads, size_t *done_lookups,
+                          size_t *done_inserts)
+{
+        pthread_t *thread = malloc(num_threads * sizeof *thread);
+        struct threads_work *work = malloc(num_threads * sizeof *work);
+        pthread_barrier_t start;
+
+        if (!thread || !work) abort();
+
+        pthread_barrier_init(&start, NULL, num_threads + 1);
+
+        for (size_t i = 0; i < num_threads; i++) {
+                work[i] = (struct threads_work) {
+                        .table = table,
+                        .keys = keys,
+                        .extra = extra,
+                        .num_keys = num_keys,
+                        .lookups = lookups,
+                        .inserts = inserts,
+                        .ops = THREADS_OPS / num_threads,
+                        .seed = 88172645463325252u + i * 7919,
+                        .start = &start,
+                };
+
+                if (pthread_create(thread + i, NULL, threads_worker, work + i))
+                        abort();
+        }
+
+        pthread_barrier_wait(&start);
+        double begin = now_ns();
+
+        for (size_t i = 0; i < num_threads; i++) {
+                pthread_join(thread[i], NULL);
+                *done_lookups += work[i].done_lookups;
+                *done_inserts += work[i].done_inserts;
+        }
+
+        double seconds = (now_ns() - begin) / 1e9;
+        pthread_barrier_destroy(&start);
+        free(thread);
+        free(work);
+        return seconds;
+}
+
+int threads(size_t num_keys, size_t max_threads)
+{
+        static const struct {
+                const char *name;
+                unsigned lookups, inserts;
+        } workloads[] = {
+                { "read-heavy", 90, 5 },
+                { "mixed", 50, 25 },
+        };
+        static const size_t stripes[] = { 1, THREADS_STRIPES };
+        uint64_t state = 88172645463325252u;
+
+        struct bench_key *keys = bench_keys(num_keys, 16, 'a', &state);
+        struct bench_key *extra = bench_keys(num_keys, 16, 'A', &state);
+
+        printf("%-10s %7s %7s %8s %9s %9s %7s\n", "workload", "stripes",
+               "threads", "Mops/s", "lookups", "inserts", "speedup");
+
+        for (size_t s = 0; s < sizeof stripes / sizeof *stripes; s++) {
+                struct ht_shards table;
+                if (ht_shards_init(&table, stripes[s], streq)) abort();
+
+                for (size_t i = 0; i < num_keys; i++)
+                        if (ht_shards_put(&table, keys[i].key, keys[i].hash,
+                                          keys[i].key) < 0)
+                                abort();
+
+                for (size_t w = 0; w < sizeof workloads / sizeof *workloads; w++) {
+                        double one = 0;
+
+                        /* 1, 2, 4 and so on, and then `max_threads`. */
+                        for (size_t n = 1; ;
+                             n = n * 2 < max_threads ? n * 2 : max_threads) {
+                                size_t lookups = 0, inserts = 0;
+                                double seconds = threads_run(
+                                        &table, keys, extra, num_keys,
+                                        workloads[w].lookups,
+                                        workloads[w].inserts, n,
+                                        &lookups, &inserts);
+                                double ops = THREADS_OPS / n * n / seconds;
+
+                                if (n == 1) one = ops;
+
+                                printf("%-10s %7zu %7zu %8.2f %9.2f %9.2f %6.2fx\n",
+                                       workloads[w].name, stripes[s], n,
+                                       ops / 1e6, lookups / seconds / 1e6,
+                                       inserts / seconds / 1e6, ops / one);
+
+                                if (n >= max_threads) break;
+                        }
+                }
+
+                ht_shards_free(&table);
+        }
+
+        bench_free_keys(extra);
+        bench_free_keys(keys);
+        return 0;
+}
+
+#endif
+
+int main(int argc, char **argv)
 {
+        if (argc > 1 && !strcmp(argv[1], "bench"))
+                return bench(argc > 2 ? strtoull(argv[2], NULL, 10) : 1000000);
+        if (argc > 1 && !strcmp(argv[1], "alloc"))
+                return alloc(argc > 2 ? strtoull(argv[2], NULL, 10) : 1000000);
+#ifndef HT_NO_THREADS
+        if (argc > 1 && !strcmp(argv[1], "threads"))
+                return threads(argc > 2 ? strtoull(argv[2], NULL, 10) : 1000000,
+                               argc > 3 ? strtoull(argv[3], NULL, 10)
+                                        : (size_t)sysconf(_SC_NPROCESSORS_ONLN));
+#endif
+
         srand(time(0));
 
+        /* Every string is interned, and every entry comes from a slab, so
+         * they're all freed at once at the end. */
+        struct ht_keys keys;
+        if (ht_keys_init(&keys)) abort();
+
+        struct ht_slab slab;
+        ht_slab_init(&slab, sizeof (struct ht_entry));
+
         struct ht *h = malloc(sizeof *h);
         ht_init(h);
+        h->slab = &slab;
+
+        struct st *s = malloc(sizeof *s);
+        st_init(s);
 
         for (unsigned i = 0; i < sizeof vals / sizeof *vals; i++) {
-                char *key;
-                random_string(&key);
+                char *key = random_string(&keys);
 
-                if (value_get(key)) {
+                if (ht_get(h, key)) {
                         i--;
-                        free(key);
                         continue;
                 }
 
@@ -127,11 +1761,12 @@ int main(void)
                         vals[i].integer = rand() % 1000;
                         break;
                 case VALUE_STRING:
-                        random_string(&vals[i].string);
+                        vals[i].string = random_string(&keys);
                         break;
                 }
 
                 ht_add(h, vals[i].key, vals + i);
+                st_add(s, vals[i].key, vals + i);
                 nvals++;
         }
 
@@ -140,15 +1775,67 @@ int main(void)
         for (unsigned i = 0; i < nvals; i++)
                 lookups[i] = vals[rand() % nvals].key;
 
+        /* Otherwise an optimizing compiler throws the lookups away. */
+        void *volatile found;
+
         clock_t begin = clock();
-        for (unsigned i = 0; i < nvals; i++) ht_get(h, lookups[i]);
+        for (unsigned i = 0; i < nvals; i++) found = ht_get(h, lookups[i]);
         clock_t ht_time = clock() - begin;
 
         begin = clock();
-        for (unsigned i = 0; i < nvals; i++) value_get(lookups[i]);
+        for (unsigned i = 0; i < nvals; i++) found = value_get(lookups[i]);
         clock_t linear_time = clock() - begin;
 
+        (void)found;
+
         printf("hash table is %.0lf times faster (%ld vs. %ld)\n",
                (double)linear_time / (double)ht_time,
                ht_time, linear_time);
+
+        /* Delete every other key and check the tables still agree with the
+         * array, in order for the chained one. */
+        for (unsigned i = 0; i < nvals; i += 2) {
+                ht_delete(h, vals[i].key);
+                st_delete(s, vals[i].key);
+        }
+
+        unsigned errors = 0, next = 1;
+        for (struct ht_entry *e = ht_next(h, NULL); e; e = ht_next(h, e)) {
+                if (e->value != vals + next) errors++;
+                next += 2;
+        }
+
+        for (unsigned i = 0; i < nvals; i++)
+                if (ht_get(h, vals[i].key) != (i % 2 ? vals + i : NULL))
+                        errors++;
+
+        printf("%zu keys in %zu buckets after deleting half, %u errors\n",
+               h->num_keys, h->num_buckets, errors);
+
+        unsigned st_errors = 0, seen = 0;
+        for (struct st_slot *slot = st_next(s, NULL); slot; slot = st_next(s, slot)) {
+                if (((struct value *)slot->value - vals) % 2 == 0) st_errors++;
+                seen++;
+        }
+
+        if (seen != nvals / 2) st_errors++;
+
+        for (unsigned i = 0; i < nvals; i++)
+                if (st_get(s, vals[i].key) != (i % 2 ? vals + i : NULL))
+                        st_errors++;
+
+        printf("%zu keys in %zu slots (%zu deleted) after deleting half, "
+               "%u errors\n", s->num_keys, s->num_slots, s->num_deleted,
+               st_errors);
+
+        ht_free(h);
+        free(h);
+        ht_slab_free(&slab);
+        st_free(s);
+        free(s);
+        ht_keys_free(&keys);
+
+        return errors + st_errors != 0;
 }
+
+#endif
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+'''Compare committing rows one at a time with committing them in batches.
+
+This commits the same `--rows` people, `--bad` of them (a fraction) with a
+value of the wrong type, into fresh tables stored by row and by column, with
+and without indexes. Each is done once with `Table.insert` per row, the way
+`commit` used to, and once with `Database.insert_many`, the way it does now.
+It reports the nanoseconds per row each took, checking both stored the same
+rows.
+
+Usage:
+
+    python bench/batch.py --rows 200000 --bad 0.01
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from toydb import Database
+
+SCHEMA = [('id', int), ('name', str), ('age', int), ('score', float)]
+
+def people(rows, bad):
+    pending = []
+    for i in range(rows):
+        values = [i, 'person{}'.format(i % 1000), i * 7 % 100, i / 3]
+        if random.random() < bad:
+            values[random.randrange(len(values))] = None
+        pending.append(('Person', values))
+    return pending
+
+def timed(storage, indexes, insert, pending):
+    '''Returns nanoseconds per row, and the rows stored.'''
+
+    db = Database()
+    db.create('Person', SCHEMA, indexes, storage)
+
+    begin = time.perf_counter_ns()
+    insert(db, pending)
+    db.update_indexes()
+    elapsed = time.perf_counter_ns() - begin
+
+    return elapsed / len(pending), [list(row) for row in db.tables['Person'].rows]
+
+def one_at_a_time(db, pending):
+    for name, values in pending:
+        db.insert(name, values)
+
+def batched(db, pending):
+    db.insert_many(pending)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--bad', type=float, default=0.01)
+    args = parser.parse_args()
+
+    random.seed(0)
+    pending = people(args.rows, args.bad)
+
+    print('{:<10} {:<10} {:>12} {:>12} {:>9}'.format(
+        'storage', 'indexes', 'per row ns', 'batched ns', 'speedup'))
+
+    for storage in ['rows', 'columns']:
+        for indexes in [None, {'name': 'hash', 'age': 'sorted'}]:
+            single, expected = timed(storage, indexes, one_at_a_time, pending)
+            batch, found = timed(storage, indexes, batched, pending)
+            if found != expected:
+                sys.exit('{}: batching stored different rows'.format(storage))
+
+            print('{:<10} {:<10} {:>12.0f} {:>12.0f} {:>8.1f}x'.format(
+                storage, 'yes' if indexes else 'no', single, batch,
+                single / batch))
+
+if __name__ == '__main__':
+    main()
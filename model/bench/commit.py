@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+'''Compare commit throughput of a `DurableEngine` by how often it fsyncs.
+
+This makes `--commits` commits of `--rows` rows each to a fresh database in
+`--dir` (somewhere on a real disk, since fsync is nearly free on a tmpfs),
+once for each of 1, 10, 100 and 1000 commits per fsync, and once more with
+the plain in-memory `Engine` for comparison. It reports commits per second
+for each. Then it times compacting the last database into a snapshot, and
+recovering it from the log alone and from the snapshot.
+
+Usage:
+
+    python bench/commit.py --commits 2000 --rows 10 --dir .
+'''
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from durable import DurableEngine
+from toydb import Engine
+
+BATCHES = [1, 10, 100, 1000]
+
+# Big enough that nothing is compacted until it's asked for.
+NEVER = 1 << 62
+
+def declare(db):
+    class Event(db.Model):
+        id = int
+        kind = str
+        value = float
+
+        __storage__ = 'columns'
+
+    return Event
+
+def fill(db, commits, rows):
+    '''Returns commits per second.'''
+
+    Event = declare(db)
+    db.create_all()
+
+    begin = time.perf_counter()
+    for i in range(commits):
+        for j in range(i * rows, (i + 1) * rows):
+            db.add(Event(j, 'event{}'.format(j % 10), j / 3))
+        db.commit()
+    elapsed = time.perf_counter() - begin
+
+    return commits / elapsed
+
+def recover(path):
+    '''Returns the seconds it took to open the database at `path`, and how
+    many rows it had.'''
+
+    db = DurableEngine(path, compact_size=NEVER)
+    Event = declare(db)
+
+    begin = time.perf_counter()
+    db.create_all()
+    elapsed = time.perf_counter() - begin
+
+    rows = len(db.db.tables[Event.__name__].rows)
+    db.close()
+    return elapsed, rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--commits', type=int, default=2000)
+    parser.add_argument('--rows', type=int, default=10,
+                        help='rows per commit')
+    parser.add_argument('--dir', default=None,
+                        help='where to make the databases')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='toydb-commit-', dir=args.dir)
+    try:
+        print('{:<16} {:>12}'.format('fsync every', 'commits/s'))
+
+        for batch in BATCHES:
+            path = os.path.join(root, str(batch))
+            db = DurableEngine(path, sync_every=batch, compact_size=NEVER)
+            rate = fill(db, args.commits, args.rows)
+            db.close()
+            print('{:<16} {:>12.0f}'.format(batch, rate))
+
+        print('{:<16} {:>12.0f}'.format('in memory',
+                                        fill(Engine(), args.commits,
+                                             args.rows)))
+
+        elapsed, rows = recover(path)
+        print('\nreplaying {} rows from the log: {:.3f}s'.format(rows, elapsed))
+
+        db = DurableEngine(path, compact_size=NEVER)
+        declare(db)
+        db.create_all()
+        begin = time.perf_counter()
+        db.compact()
+        print('compacting them into a snapshot: {:.3f}s'.format(
+            time.perf_counter() - begin))
+        db.close()
+
+        elapsed, rows = recover(path)
+        print('loading {} rows from the snapshot: {:.3f}s'.format(rows,
+                                                                 elapsed))
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
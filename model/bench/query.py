@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+'''Compare indexed queries on the toy database with scans.
+
+This fills two tables with the same `--rows` random people, one with indexes
+(a hash index on `name`, and sorted ones on `id` and `age`) and one without,
+and times a few queries on each. It reports the time each commit took, and
+the milliseconds per query with and without the indexes, checking that both
+found the same rows.
+
+Usage:
+
+    python bench/query.py --rows 100000
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from toydb import Engine
+
+db = Engine()
+
+class Indexed(db.Model):
+    id = int
+    name = str
+    age = int
+
+    __indexes__ = {'id': 'sorted', 'name': 'hash', 'age': 'sorted'}
+
+class Plain(db.Model):
+    id = int
+    name = str
+    age = int
+
+QUERIES = [
+    ('name == ...', lambda q, rows: q.where(name='person{}'.format(rows // 2 % 1000))),
+    ('id == ...', lambda q, rows: q.where('id', '==', rows // 2)),
+    ('id in 100 rows', lambda q, rows: q.where('id', '>=', rows // 2)
+                                        .where('id', '<', rows // 2 + 100)),
+    ('18 <= age < 20', lambda q, rows: q.where('age', '>=', 18)
+                                        .where('age', '<', 20)),
+    ('age > 50, name', lambda q, rows: q.where('age', '>', 50)
+                                        .where(name='person7')),
+]
+
+def timed(function, repeat=1):
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - begin) / repeat, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    db.create_all()
+    people = [(i, 'person{}'.format(random.randrange(1000)),
+               random.randrange(100)) for i in range(args.rows)]
+
+    for model in [Plain, Indexed]:
+        for person in people:
+            db.add(model(*person))
+        seconds, _ = timed(db.commit)
+        print('commit {} rows into {}: {:.0f}ms'.format(args.rows,
+                                                        model.__name__,
+                                                        seconds * 1000))
+
+    print('{:<16} {:>7} {:>10} {:>10} {:>8}  {}'.format(
+        'query', 'rows', 'scan ms', 'index ms', 'speedup', 'plan'))
+
+    for name, build in QUERIES:
+        scan, expected = timed(lambda: build(db.select(Plain), args.rows).all(),
+                               args.repeat)
+        index, found = timed(lambda: build(db.select(Indexed), args.rows).all(),
+                             args.repeat)
+
+        if sorted(found) != sorted(expected):
+            sys.exit('{} found different rows with an index'.format(name))
+
+        print('{:<16} {:>7} {:>10.3f} {:>10.3f} {:>7.0f}x  {}'.format(
+            name, len(found), scan * 1000, index * 1000, scan / index,
+            build(db.select(Indexed), args.rows).explain()))
+
+if __name__ == '__main__':
+    main()
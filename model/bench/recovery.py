@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+'''Check that a `DurableEngine` recovers everything it acknowledged.
+
+This runs a child process that commits `--batch` numbered rows at a time and
+prints how many it's committed after each commit, and kills it with SIGKILL
+at a random moment, `--rounds` times. Sometimes it also leaves half a record
+on the end of the log, the way a machine crashing mid-write would. After each
+kill it recovers the database and checks that the rows are 0, 1, 2, ... with
+no gaps or repeats, that no commit was half applied, and that every commit
+the child printed is there. The log is compacted every `--compact-size`
+bytes, so some kills land around compaction too.
+
+It can't pull the power, so it doesn't check that fsync was called when it
+should have been; only that what was written is read back.
+
+Usage:
+
+    python bench/recovery.py --rounds 20
+'''
+
+import argparse
+import os
+import random
+import shutil
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from durable import DurableEngine
+
+def open_db(path, compact_size):
+    db = DurableEngine(path, compact_size=compact_size)
+
+    class Item(db.Model):
+        id = int
+        name = str
+        weight = float
+
+        __storage__ = 'columns'
+
+    db.create_all()
+    return db, Item
+
+def child(path, batch, compact_size):
+    '''Commits forever, saying how many rows are in after each commit.'''
+
+    db, Item = open_db(path, compact_size)
+    count = len(db.select(Item).all())
+
+    while True:
+        for i in range(count, count + batch):
+            db.add(Item(i, 'item{}'.format(i), i / 2))
+        db.commit()
+        count += batch
+        print(count, flush=True)
+
+def tear(path):
+    '''Append the start of a record that never finished to the newest log.'''
+
+    logs = sorted((int(name[4:]), name) for name in os.listdir(path)
+                  if name.startswith('log.'))
+    with open(os.path.join(path, logs[-1][1]), 'ab') as f:
+        f.write(struct.pack('<II', 1000, 0) + b'[["Item", [')
+
+def check(path, batch, compact_size, acknowledged):
+    '''Returns how many rows were recovered, or exits if they're wrong.'''
+
+    db, Item = open_db(path, compact_size)
+    ids = [row[0] for row in db.select(Item)]
+    db.close()
+
+    if ids != list(range(len(ids))):
+        sys.exit('recovered ids aren\'t 0 to {}'.format(len(ids) - 1))
+    if len(ids) % batch != 0:
+        sys.exit('recovered {} rows, which is part of a commit'.format(len(ids)))
+    if len(ids) < acknowledged:
+        sys.exit('recovered {} rows, but {} were committed'.format(
+            len(ids), acknowledged))
+
+    return len(ids)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=10)
+    parser.add_argument('--compact-size', type=int, default=256 * 1024)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.batch, args.compact_size)
+        return
+
+    path = tempfile.mkdtemp(prefix='toydb-recovery-')
+    try:
+        for round in range(args.rounds):
+            process = subprocess.Popen(
+                [sys.executable, __file__, '--child', path,
+                 '--batch', str(args.batch),
+                 '--compact-size', str(args.compact_size)],
+                stdout=subprocess.PIPE, text=True)
+            time.sleep(random.uniform(0.2, 1))
+            process.send_signal(signal.SIGKILL)
+
+            lines = process.communicate()[0].split()
+            acknowledged = int(lines[-1]) if lines else 0
+
+            torn = random.random() < 0.5
+            if torn:
+                tear(path)
+
+            recovered = check(path, args.batch, args.compact_size,
+                              acknowledged)
+            print('round {:>3}: {:>8} acknowledged, {:>8} recovered{}'.format(
+                round + 1, acknowledged, recovered,
+                ', torn record cut off' if torn else ''))
+    finally:
+        shutil.rmtree(path)
+
+    print('every acknowledged commit was recovered')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+'''Compare the toy database's row and column storage.
+
+This commits the same `--rows` people to a table stored as a list per row
+(with a class built for every model instance, as the notes do it) and to one
+stored a column at a time (with `__storage__ = 'columns'`), each in a process
+of its own so their memory doesn't mix. It reports the seconds spent making
+and adding the instances and committing them, the bytes each row leaves
+behind once committed, the peak RSS, and the milliseconds a few scans take,
+checking that both found the same number of rows.
+
+Usage:
+
+    python bench/storage.py --rows 1000000
+'''
+
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from toydb import Engine
+
+db = Engine()
+
+class RowPerson(db.Model):
+    id = int
+    name = str
+    age = int
+
+class ColumnPerson(db.Model):
+    id = int
+    name = str
+    age = int
+
+    __storage__ = 'columns'
+
+MODELS = {'rows': RowPerson, 'columns': ColumnPerson}
+
+QUERIES = [
+    ('18 <= age < 20', lambda q: q.where('age', '>=', 18).where('age', '<', 20)),
+    ('name == ...', lambda q: q.where(name='person7')),
+    ('age > 50, name', lambda q: q.where('age', '>', 50).where(name='person7')),
+    ('every row', lambda q: q)
+]
+
+def rss():
+    '''Resident memory in bytes, or None where /proc isn't there.'''
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None
+
+def run(storage, rows, repeat):
+    '''Fills and queries one table, returning what was measured.'''
+
+    model = MODELS[storage]
+    db.create_all()
+
+    gc.collect()
+    before = rss()
+
+    begin = time.perf_counter()
+    for i in range(rows):
+        db.add(model(i, 'person{}'.format(i % 1000), i * 7 % 100))
+    add = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    db.commit()
+    commit = time.perf_counter() - begin
+
+    gc.collect()
+    after = rss()
+
+    queries = []
+    for _, query in QUERIES:
+        begin = time.perf_counter()
+        for _ in range(repeat):
+            count = query(db.select(model)).count()
+        queries.append(((time.perf_counter() - begin) / repeat * 1000, count))
+
+    return {
+        'add': add,
+        'commit': commit,
+        'bytes': None if before == None else (after - before) / rows,
+        'peak': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'queries': queries
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--storage', choices=MODELS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.storage:
+        print(json.dumps(run(args.storage, args.rows, args.repeat)))
+        return
+
+    results = {}
+    for storage in MODELS:
+        output = subprocess.run([sys.executable, __file__, '--storage', storage,
+                                 '--rows', str(args.rows),
+                                 '--repeat', str(args.repeat)],
+                                check=True, capture_output=True, text=True)
+        results[storage] = json.loads(output.stdout)
+
+    print('{:<16} {:>10} {:>10} {:>10} {:>10}'.format(
+        'storage', 'add s', 'commit s', 'bytes/row', 'peak MB'))
+    for storage, result in results.items():
+        size = '-' if result['bytes'] == None else \
+            '{:.1f}'.format(result['bytes'])
+        print('{:<16} {:>10.2f} {:>10.2f} {:>10} {:>10.0f}'.format(
+            storage, result['add'], result['commit'], size, result['peak']))
+
+    print('\n{:<16} {:>10} {:>10} {:>10}'.format('query', 'rows ms',
+                                                 'columns ms', 'speedup'))
+    for i, (name, _) in enumerate(QUERIES):
+        (rows, found), (columns, also) = results['rows']['queries'][i], \
+            results['columns']['queries'][i]
+        if found != also:
+            sys.exit('{}: rows found {}, but columns found {}'.format(
+                name, found, also))
+        print('{:<16} {:>10.1f} {:>10.1f} {:>9.1f}x'.format(
+            name, rows, columns, rows / columns))
+
+if __name__ == '__main__':
+    main()
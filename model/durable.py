@@ -0,0 +1,318 @@
+'''A toy database that survives restarts: `toydb.Engine`, with a log and
+snapshots on disk. Basic usage is like this:
+
+    db = DurableEngine('people.db', sync_every=100)
+
+    class Person(db.Model):
+        id = int
+        name = str
+
+    db.create_all()                 # loads whatever people.db already has
+    db.add(Person(1, 'bob'))
+    db.commit()                     # appended to the log before it's applied
+    db.close()
+
+Each commit is appended to `log.<generation>` in the directory as one record
+(its length, a CRC32 and the rows as JSON), so a commit is either all there
+after a crash or not there at all. The log is only fsynced every
+`sync_every` commits: a crashed process loses nothing, since every commit has
+been written, but a crashed machine can lose up to the last `sync_every - 1`.
+
+Once the log is bigger than `compact_size` bytes, everything is written to a
+new `snapshot`, each column in one piece (an int column is its array's bytes,
+a str column is its UTF-8 and the offsets of each string), and the log starts
+again. `create_all` memory-maps the snapshot, copies the columns out of it in
+bulk, and replays the logs written since, stopping at a record that's torn
+or corrupt and cutting it off.
+'''
+
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+from toydb import Engine, StringColumn
+
+MAGIC = b'toydb snapshot 1\n'
+RECORD = struct.Struct('<II')
+TRAILER = struct.Struct('<Q')
+
+# How a column of each type is kept in a snapshot; anything else is JSON.
+ENCODINGS = {int: 'q', float: 'd', str: 'utf-8'}
+
+def sync_directory(path):
+    '''Make a file created or renamed in `path` survive a crash.'''
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class Log:
+    '''An append-only file of checksummed records, fsynced every
+    `sync_every` appends.'''
+
+    def __init__(self, path, sync_every=1):
+        self.path = path
+        self.sync_every = sync_every
+        self.unsynced = 0
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self.fd).st_size
+
+    def append(self, payload):
+        data = memoryview(RECORD.pack(len(payload), zlib.crc32(payload)) +
+                          payload)
+        while len(data) > 0:
+            data = data[os.write(self.fd, data):]
+
+        self.size += RECORD.size + len(payload)
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        if self.unsynced > 0:
+            os.fsync(self.fd)
+            self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        os.close(self.fd)
+
+def read_log(path):
+    '''Yields the payload of each whole record in the log at `path`. A torn
+    or corrupt record ends the log, so it's cut off there.'''
+
+    with open(path, 'r+b') as f:
+        data = f.read()
+        offset = 0
+
+        while offset + RECORD.size <= len(data):
+            length, crc = RECORD.unpack_from(data, offset)
+            payload = data[offset + RECORD.size:offset + RECORD.size + length]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                break
+            yield payload
+            offset += RECORD.size + length
+
+        if offset < len(data):
+            f.truncate(offset)
+            os.fsync(f.fileno())
+
+def write_snapshot(path, generation, tables):
+    '''Write every table to `path`: the magic, the blob of each column one
+    after another, a JSON header saying where they are, and where it is.'''
+
+    header = {'generation': generation, 'byteorder': sys.byteorder,
+              'tables': {}}
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+
+        def blob(data):
+            start = f.tell()
+            f.write(data)
+            return [start, f.tell() - start]
+
+        for name, table in tables.items():
+            columns = []
+
+            for (_, kind), values in zip(table.schema, table.rows.unload()):
+                encoding = ENCODINGS.get(kind, 'json')
+
+                # Columns from a `RowStorage` are lists, to be packed first.
+                if encoding == 'utf-8' and not isinstance(values, StringColumn):
+                    packed = StringColumn()
+                    for value in values:
+                        packed.append(value)
+                    values = packed
+                elif encoding in ('q', 'd') and \
+                     not isinstance(values, array.array):
+                    try:
+                        values = array.array(encoding, values)
+                    except OverflowError:
+                        # Ints too big for an int64.
+                        encoding = 'json'
+
+                if encoding == 'utf-8':
+                    blobs = [blob(values.ends), blob(values.heap)]
+                elif encoding == 'json':
+                    blobs = [blob(json.dumps(list(values)).encode())]
+                else:
+                    blobs = [blob(values)]
+
+                columns.append({'encoding': encoding, 'blobs': blobs})
+
+            header['tables'][name] = {
+                'rows': len(table.rows),
+                'schema': [[column, kind.__name__]
+                           for column, kind in table.schema],
+                'columns': columns
+            }
+
+        start = f.tell()
+        f.write(json.dumps(header).encode())
+        f.write(TRAILER.pack(start))
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_snapshot(path):
+    '''Returns the generation of the snapshot at `path`, and the columns of
+    each table in it, keyed by table name, as (schema, columns) pairs.'''
+
+    with open(path, 'rb') as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+         memoryview(data) as view:
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} isn\'t a snapshot'.format(path))
+
+        start, = TRAILER.unpack_from(data, len(data) - TRAILER.size)
+        header = json.loads(data[start:len(data) - TRAILER.size])
+
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('{} was written on a {} endian machine'.format(
+                path, header['byteorder']))
+
+        def blob(where, read):
+            '''Hands a blob to `read` without copying it out of the map.'''
+
+            offset, size = where
+            with view[offset:offset + size] as part:
+                return read(part)
+
+        tables = {}
+        for name, table in header['tables'].items():
+            columns = []
+
+            for column in table['columns']:
+                encoding, blobs = column['encoding'], column['blobs']
+
+                if encoding == 'utf-8':
+                    values = StringColumn()
+                    values.ends = array.array('Q')
+                    blob(blobs[0], values.ends.frombytes)
+                    values.heap = blob(blobs[1], bytearray)
+                elif encoding == 'json':
+                    values = json.loads(blob(blobs[0], bytes))
+                else:
+                    values = array.array(encoding)
+                    blob(blobs[0], values.frombytes)
+
+                columns.append(values)
+
+            tables[name] = table['schema'], columns
+
+        return header['generation'], tables
+
+class DurableEngine(Engine):
+    '''An `Engine` that keeps its tables in the directory at `path`.'''
+
+    def __init__(self, path, sync_every=1, compact_size=64 * 1024 * 1024):
+        super().__init__()
+        self.path = path
+        self.sync_every = sync_every
+        self.compact_size = compact_size
+        self.generation = 0
+        self.log = None
+
+    def logs(self):
+        '''The generation of each log in the directory, oldest first.'''
+
+        return sorted(int(name[4:]) for name in os.listdir(self.path)
+                      if name.startswith('log.') and name[4:].isdigit())
+
+    def log_path(self, generation):
+        return os.path.join(self.path, 'log.{}'.format(generation))
+
+    def create_all(self):
+        '''Create the tables, and fill them from the snapshot and logs.'''
+
+        if self.log != None:
+            self.log.close()
+
+        super().create_all()
+        os.makedirs(self.path, exist_ok=True)
+
+        snapshot = os.path.join(self.path, 'snapshot')
+        if os.path.exists(snapshot + '.tmp'):
+            os.remove(snapshot + '.tmp')
+
+        self.generation = 0
+        if os.path.exists(snapshot):
+            self.generation, tables = read_snapshot(snapshot)
+
+            for name, (schema, columns) in tables.items():
+                table = self.db.tables.get(name)
+                if table == None or schema != [[column, kind.__name__]
+                                               for column, kind in table.schema]:
+                    raise ValueError('The snapshot\'s {} table doesn\'t match '
+                                     'any model'.format(name))
+                table.load(columns)
+
+        # Logs older than the snapshot are already in it, but may not have
+        # been removed if compaction was cut short.
+        for generation in self.logs():
+            if generation < self.generation:
+                os.remove(self.log_path(generation))
+                continue
+
+            for payload in read_log(self.log_path(generation)):
+                self.db.insert_many(json.loads(payload))
+            self.generation = generation
+
+        self.db.update_indexes()
+        self.log = Log(self.log_path(self.generation), self.sync_every)
+        sync_directory(self.path)
+
+    def commit(self):
+        '''Append the pending rows to the log, then insert them, returning
+        any `Rejection`s. Compacts the log into a snapshot if it's grown past
+        `compact_size`.'''
+
+        if self.log == None:
+            raise RuntimeError('create_all has to be called first, to read '
+                               'what\'s already on disk')
+
+        if len(self.uncommitted) > 0:
+            self.log.append(json.dumps(self.uncommitted).encode())
+
+        rejected = super().commit()
+
+        if self.log.size >= self.compact_size:
+            self.compact()
+
+        return rejected
+
+    def compact(self):
+        '''Write everything committed to a new snapshot, and start a new log.
+
+        The new log is made first and the old ones removed last, so a crash
+        at any point leaves a snapshot and the logs needed on top of it.'''
+
+        self.log.close()
+        self.generation += 1
+        self.log = Log(self.log_path(self.generation), self.sync_every)
+        sync_directory(self.path)
+
+        snapshot = os.path.join(self.path, 'snapshot')
+        write_snapshot(snapshot + '.tmp', self.generation, self.db.tables)
+        os.replace(snapshot + '.tmp', snapshot)
+        sync_directory(self.path)
+
+        for generation in self.logs():
+            if generation < self.generation:
+                os.remove(self.log_path(generation))
+
+    def sync(self):
+        '''fsync the log now, rather than waiting for `sync_every` commits.'''
+
+        self.log.sync()
+
+    def close(self):
+        if self.log != None:
+            self.log.close()
+            self.log = None
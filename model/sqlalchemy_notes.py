@@ -216,71 +216,11 @@ C().value = 'hi'
 print('C().value = {0}'.format(C().value)) # C().value = hi
 
 # Hmm…
+#
+# (This toy database used to be written out here. It grew queries and
+# indexes, so it lives in `toydb.py` now.)
 
-class Table:
-    def __repr__(self):
-        return 'Table {0}:\n\n'.format(self.name) + \
-            '\n'.join([str(row) for row in self.rows])
-
-    def insert(self, values):
-        for i in range(len(values)):
-            if not isinstance(values[i], self.schema[i][1]):
-                return
-        self.rows.append(values)
-
-    def __init__(self, name, schema):
-        self.name = name
-        self.schema = schema
-        print(schema)
-        self.rows = []
-
-class Database:
-    def create(self, tablename, schema):
-        self.tables[tablename] = Table(tablename, schema)
-
-    def insert(self, tablename, values):
-        self.tables[tablename].insert(values)
-
-    def __repr__(self):
-        return '\n\n'.join([str(v) for k, v in self.tables.items()])
-
-    def __init__(self):
-        self.tables = {}
-
-class Engine:
-    class MetadataClass(type):
-        __metadata__ = {}
-
-        def __init__(cls, name, bases, dct):
-            if name not in cls.__metadata__ and name != 'Model':
-                cls.__metadata__[name] = [(k, v) for k, v in cls.__dict__.items() if k[0:2] != '__']
-
-        def __call__(cls, *args, **kwargs):
-            ret = type(cls.__name__, cls.__bases__, dict(cls.__dict__))
-            setattr(ret, '__values__', list(args))
-            return ret
-
-    class Model(metaclass=MetadataClass):
-        pass
-
-    def create_all(self):
-        for k, v in self.MetadataClass.__metadata__.items():
-            self.db.create(k, v)
-
-    def commit(self):
-        for name, values in self.uncommitted:
-            self.db.insert(name, values)
-        self.uncommitted = []
-
-    def add(self, obj):
-        self.uncommitted.append((obj.__name__, obj.__values__))
-
-    def __repr__(self):
-        return '{0}\n\nUncommitted transactions:\n\n{1}\n'.format(str(self.db), '\n'.join(['insert into {0} values ({1})'.format(name, values) for name, values in self.uncommitted]))
-
-    def __init__(self):
-        self.db = Database()
-        self.uncommitted = []
+from toydb import Engine
 
 # User code:
 
@@ -302,12 +242,17 @@ db.add(john)
 
 print(db)
 
-db.commit()
+# `john` doesn't fit, so the commit says why it was dropped:
+print(db.commit())
+# => [Rejection(table='Person', position=2, values=[3, 42],
+#               reason='name: expected str, got int')]
 
 print(db)
 
-# Well anyway this is getting to be a diversion, maybe I'll come back
-# to this and add queries and such.
+print(db.select(Person).where(name='alice').all()) # => [[2, 'alice']]
+
+# Well anyway this is getting to be a diversion. I did come back to it
+# and add queries, see `toydb.py`.
 
 # Resources:
 #
@@ -0,0 +1,795 @@
+'''The toy database from `sqlalchemy_notes.py`, grown a bit.
+
+Models are declared with a metaclass, like SQLAlchemy's declarative classes,
+and can ask for secondary indexes on their columns. Basic usage is like this:
+
+    db = Engine()
+
+    class Person(db.Model):
+        id = int
+        name = str
+        age = int
+
+        __indexes__ = {'name': 'hash', 'age': 'sorted'}
+
+    db.create_all()
+    db.add(Person(1, 'bob', 30))
+    db.add(Person(2, 'alice', 'thirty'))
+    db.commit()
+    # => [Rejection(table='Person', position=1, values=[2, 'alice', 'thirty'],
+    #               reason='age: expected int, got str')]
+
+    db.select(Person).where(name='bob').all()           # => [[1, 'bob', 30]]
+    db.select(Person).where('age', '>=', 18).count()    # => 1
+    db.select(Person).where('age', '<', 40).explain()
+    # => 'sorted index on age: 1 of 1 rows'
+
+`commit` inserts the rows for each table together, checking and storing them
+a column at a time, and returns a `Rejection` for each row it had to drop.
+
+A hash index answers equality, and a sorted index answers equality and ranges
+(and gives the rows in that column's order). Indexes are brought up to date
+when `commit` is done inserting, and each query uses whichever index narrows it
+down to the fewest rows, or scans the table if there's no index to use.
+
+A model can also ask to be stored a column at a time, which is far smaller for
+big tables (an int column is a typed `array`, and a str column is its UTF-8
+text end to end), and makes scans run down one column at a time:
+
+    class Reading(db.Model):
+        sensor = str
+        value = float
+
+        __storage__ = 'columns'
+
+Queries on such a table give back `RowHandle`s rather than lists, which read
+their values out of the columns, and can be used like `row[1]` or `row.value`.
+'''
+
+import array
+import bisect
+import collections
+import functools
+import itertools
+import operator
+
+INT64 = range(-2 ** 63, 2 ** 63)
+
+OPERATORS = {
+    '==': operator.eq,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge
+}
+
+class HashIndex:
+    '''Row numbers by value, for equality.'''
+
+    kind = 'hash'
+
+    def __init__(self):
+        self.rows = {}
+
+    def add(self, value, row):
+        self.rows.setdefault(value, []).append(row)
+
+    def add_many(self, values, start):
+        '''Add `values`, from the rows numbered from `start` on.'''
+
+        rows = self.rows
+        for row, value in enumerate(values, start):
+            rows.setdefault(value, []).append(row)
+
+    def update(self):
+        pass
+
+    def lookup(self, bounds):
+        '''The rows in `bounds`, or None if this index can't tell.'''
+
+        if bounds.equals is Bounds.ANY:
+            return None
+        return self.rows.get(bounds.equals, [])
+
+class SortedIndex:
+    '''Values in order, with the row each came from, for equality and ranges.
+
+    Rows added since the last `update` wait in `pending`, so a commit of many
+    rows sorts them once and merges them in, rather than inserting each one
+    into the middle of the lists.'''
+
+    kind = 'sorted'
+
+    def __init__(self):
+        self.values = []
+        self.rows = []
+        self.pending = []
+
+    def add(self, value, row):
+        self.pending.append((value, row))
+
+    def add_many(self, values, start):
+        self.pending.extend(zip(values, itertools.count(start)))
+
+    def update(self):
+        if len(self.pending) == 0:
+            return
+
+        # Two sorted runs, which `sort` merges in linear time.
+        pairs = list(zip(self.values, self.rows))
+        self.pending.sort()
+        pairs.extend(self.pending)
+        pairs.sort()
+
+        self.values = [value for value, _ in pairs]
+        self.rows = [row for _, row in pairs]
+        self.pending = []
+
+    def lookup(self, bounds):
+        if bounds.equals is not Bounds.ANY:
+            start = bisect.bisect_left(self.values, bounds.equals)
+            end = bisect.bisect_right(self.values, bounds.equals)
+            return self.rows[start:end]
+
+        start, end = 0, len(self.values)
+
+        if bounds.low is not Bounds.ANY:
+            search = bisect.bisect_left if bounds.low_inclusive \
+                else bisect.bisect_right
+            start = search(self.values, bounds.low)
+
+        if bounds.high is not Bounds.ANY:
+            search = bisect.bisect_right if bounds.high_inclusive \
+                else bisect.bisect_left
+            end = search(self.values, bounds.high)
+
+        return self.rows[start:max(start, end)]
+
+INDEXES = {index.kind: index for index in [HashIndex, SortedIndex]}
+
+def matcher(checks):
+    '''A function saying whether a row passes every (position, check, value)
+    in `checks`.'''
+
+    def matches(values):
+        for position, check, value in checks:
+            if not check(values[position], value):
+                return False
+        return True
+
+    return matches
+
+class RowStorage(list):
+    '''A table's rows as a list of lists, one per row.'''
+
+    kind = 'rows'
+
+    def __init__(self, name, schema):
+        super().__init__()
+        self.width = len(schema)
+
+    def add(self, values):
+        '''Append a row that's already been checked against the schema.
+        Returns whether it was stored.'''
+
+        self.append(values)
+        return True
+
+    def load(self, columns):
+        '''Append whole columns of rows that fit the schema.'''
+
+        self.extend(map(list, zip(*columns)))
+
+    def add_many(self, rows, columns):
+        '''Append `rows`, which are also given as `columns`.'''
+
+        self.extend(rows)
+
+    def misfits(self, columns):
+        '''Which rows of `columns` (of the right types) can't be stored, and
+        why, by their position in the columns.'''
+
+        return {}
+
+    def unload(self):
+        '''The rows as a list per column.'''
+
+        return [[row[i] for row in self] for i in range(self.width)]
+
+    def scan(self, checks):
+        return filter(matcher(checks), self)
+
+    def fetch(self, rows, checks):
+        return filter(matcher(checks), map(self.__getitem__, rows))
+
+encode = functools.partial(str.encode, encoding='utf-8', errors='surrogatepass')
+
+class StringColumn:
+    '''Strings packed end to end as UTF-8, with where each one ends.
+
+    A million short strings cost a few bytes of text and eight of offset each,
+    instead of a str object and a pointer to it. Since UTF-8 sorts the same
+    way as the code points it encodes, comparisons can be done on the bytes
+    without decoding them.'''
+
+    def __init__(self):
+        self.heap = bytearray()
+        self.ends = array.array('Q', [0])
+
+    def append(self, value):
+        self.heap += encode(value)
+        self.ends.append(len(self.heap))
+
+    def __getitem__(self, i):
+        return self.encoded(i).decode('utf-8', 'surrogatepass')
+
+    def __delitem__(self, rows):
+        '''Only for dropping the rows from `rows.start` on.'''
+
+        del self.ends[rows.start + 1:]
+        del self.heap[self.ends[-1]:]
+
+    def __len__(self):
+        return len(self.ends) - 1
+
+    def __iter__(self):
+        heap = self.heap
+        return (heap[start:end].decode('utf-8', 'surrogatepass')
+                for start, end in zip(self.ends, self.ends[1:]))
+
+    def extend(self, values):
+        '''Append every string in `values`, which may be another
+        `StringColumn`.'''
+
+        base = len(self.heap)
+
+        if isinstance(values, StringColumn):
+            self.heap += values.heap
+            ends = values.ends[1:]
+        else:
+            encoded = list(map(encode, values))
+            self.heap += b''.join(encoded)
+            ends = itertools.accumulate(map(len, encoded))
+
+        self.ends.extend(map(base.__add__, ends))
+
+    def encoded(self, i):
+        return bytes(self.heap[self.ends[i]:self.ends[i + 1]])
+
+    def select(self, check, value, rows=None):
+        '''The rows (of all of them, or of `rows`) whose string passes
+        `check` against `value`.'''
+
+        if not isinstance(value, str) or value == '':
+            rows = range(len(self)) if rows == None else rows
+            return [i for i in rows if check(self[i], value)]
+
+        text = value.encode('utf-8', 'surrogatepass')
+        heap, ends = self.heap, self.ends
+
+        if rows == None and check is operator.eq:
+            return self.find(text)
+        if rows == None:
+            return [i for i, (start, end) in enumerate(zip(ends, ends[1:]))
+                    if check(heap[start:end], text)]
+        return [i for i in rows if check(heap[ends[i]:ends[i + 1]], text)]
+
+    def find(self, text):
+        '''The rows holding exactly `text` (which isn't empty), found by
+        searching the heap for it rather than looking at every row.'''
+
+        heap, ends, rows = self.heap, self.ends, []
+
+        start = heap.find(text)
+        while start != -1:
+            # The last row ending here, in case some before it are empty.
+            row = bisect.bisect_right(ends, start) - 1
+            if ends[row] == start and ends[row + 1] == start + len(text):
+                rows.append(row)
+            start = heap.find(text, start + 1)
+
+        return rows
+
+# Columns for types that fit in an `array`; anything else is a list.
+COLUMNS = {
+    int: lambda: array.array('q'),
+    float: lambda: array.array('d'),
+    str: StringColumn
+}
+
+class RowHandle:
+    '''One row of a `ColumnStorage`, read a column at a time when asked.
+
+    Each table gets a subclass with a property per column, so `row.name`
+    works as well as `row[1]`. It indexes, iterates and compares like the
+    list a `RowStorage` would have given.'''
+
+    __slots__ = ('columns', 'row')
+
+    def __init__(self, columns, row):
+        self.columns = columns
+        self.row = row
+
+    def __getitem__(self, position):
+        return self.columns[position][self.row]
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __iter__(self):
+        row = self.row
+        return (column[row] for column in self.columns)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __lt__(self, other):
+        return list(self) < list(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+def column_property(position):
+    return property(lambda self: self.columns[position][self.row])
+
+class ColumnStorage:
+    '''A table's rows as one column per field: ints and floats in typed
+    `array`s, strings in a `StringColumn`, and anything else in a list.
+    Rows come back as `RowHandle`s.'''
+
+    kind = 'columns'
+
+    def __init__(self, name, schema):
+        self.names = [column for column, _ in schema]
+        self.columns = [COLUMNS.get(kind, list)() for _, kind in schema]
+        self.appends = [column.append for column in self.columns]
+        self.length = 0
+        self.handle = type(name + 'Row', (RowHandle,), dict(
+            {column: column_property(i) for i, (column, _) in enumerate(schema)},
+            __slots__=()))
+
+    def add(self, values):
+        try:
+            for append, value in zip(self.appends, values):
+                append(value)
+        except OverflowError:
+            # An int too big for its array; put back the columns that
+            # took it so they stay in step.
+            for column in self.columns:
+                del column[self.length:]
+            return False
+
+        self.length += 1
+        return True
+
+    def load(self, columns):
+        for column, values in zip(self.columns, columns):
+            column.extend(values)
+        self.length += len(columns[0]) if columns else 0
+
+    def add_many(self, rows, columns):
+        self.load(columns)
+
+    def misfits(self, columns):
+        '''Ints too big for their column's array.'''
+
+        reasons = {}
+        for name, column, values in zip(self.names, self.columns, columns):
+            if not isinstance(column, array.array) or column.typecode != 'q':
+                continue
+
+            try:
+                array.array('q', values)
+            except OverflowError:
+                for i, value in enumerate(values):
+                    if value not in INT64:
+                        reasons.setdefault(i, '{}: {} doesn\'t fit in 64 '
+                                              'bits'.format(name, value))
+
+        return reasons
+
+    def unload(self):
+        return self.columns
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, row):
+        return self.handle(self.columns, row)
+
+    def __iter__(self):
+        return map(self.handle, itertools.repeat(self.columns),
+                   range(self.length))
+
+    def scan(self, checks):
+        '''Checks a column at a time: the first predicate runs down its
+        whole column, and the rest only look at the rows still in. Equality
+        goes first, since it usually leaves the fewest rows.'''
+
+        if len(checks) == 0:
+            return iter(self)
+
+        checks = sorted(checks, key=lambda check: check[1] is not operator.eq)
+        position, check, value = checks[0]
+        return self.fetch(select(self.columns[position], check, value),
+                          checks[1:])
+
+    def fetch(self, rows, checks):
+        for position, check, value in checks:
+            rows = select(self.columns[position], check, value, rows)
+        return map(self.handle, itertools.repeat(self.columns), rows)
+
+def select(column, check, value, rows=None):
+    '''The rows (of all of them, or of `rows`) whose value in `column`
+    passes `check` against `value`.'''
+
+    if isinstance(column, StringColumn):
+        return column.select(check, value, rows)
+    if rows == None:
+        return [i for i, v in enumerate(column) if check(v, value)]
+    return [i for i in rows if check(column[i], value)]
+
+STORAGE = {storage.kind: storage for storage in [RowStorage, ColumnStorage]}
+
+class Bounds:
+    '''What a query's predicates say about one column's values.'''
+
+    ANY = object()
+
+    def __init__(self):
+        self.equals = Bounds.ANY
+        self.low = Bounds.ANY
+        self.low_inclusive = True
+        self.high = Bounds.ANY
+        self.high_inclusive = True
+
+    def narrow(self, op, value):
+        if op == '==':
+            self.equals = value
+        elif op in ('>', '>='):
+            if self.low is Bounds.ANY or value > self.low or \
+               (value == self.low and op == '>'):
+                self.low, self.low_inclusive = value, op == '>='
+        elif op in ('<', '<='):
+            if self.high is Bounds.ANY or value < self.high or \
+               (value == self.high and op == '<'):
+                self.high, self.high_inclusive = value, op == '<='
+
+    def __str__(self):
+        if self.equals is not Bounds.ANY:
+            return '== {!r}'.format(self.equals)
+
+        parts = []
+        if self.low is not Bounds.ANY:
+            parts.append('{} {!r}'.format('>=' if self.low_inclusive else '>',
+                                          self.low))
+        if self.high is not Bounds.ANY:
+            parts.append('{} {!r}'.format('<=' if self.high_inclusive else '<',
+                                          self.high))
+        return ' and '.join(parts)
+
+class Query:
+    '''The rows of a table that match every predicate given to `where`.
+
+    Nothing is looked up until the query is iterated over (or `all`, `first`
+    or `count` is called), so it can be built up bit by bit.'''
+
+    def __init__(self, table):
+        self.table = table
+        self.predicates = []
+
+    def where(self, *predicate, **equals):
+        '''Add a predicate like `where('age', '>=', 18)`, or equality
+        predicates like `where(name='bob')`. Returns the query.'''
+
+        if len(predicate) not in (0, 3):
+            raise TypeError('where takes a column, an operator and a value')
+
+        if len(predicate) == 3:
+            self._add(*predicate)
+
+        for column, value in equals.items():
+            self._add(column, '==', value)
+
+        return self
+
+    def _add(self, column, op, value):
+        if op not in OPERATORS:
+            raise ValueError('Unknown operator {!r}; expected one of {}'.format(
+                op, ', '.join(OPERATORS)))
+        self.table.position(column)
+        self.predicates.append((column, op, value))
+
+    def plan(self):
+        '''Returns the rows to check (in the order to return them), and what
+        they came from.'''
+
+        self.table.update_indexes()
+
+        bounds = {}
+        for column, op, value in self.predicates:
+            bounds.setdefault(column, Bounds()).narrow(op, value)
+
+        best = None
+        for column, index in self.table.indexes.items():
+            if column not in bounds:
+                continue
+
+            rows = index.lookup(bounds[column])
+            if rows != None and (best == None or len(rows) < len(best[0])):
+                best = rows, '{} index on {} {}'.format(index.kind, column,
+                                                        bounds[column])
+
+        if best == None:
+            return range(len(self.table.rows)), 'scan'
+
+        return best
+
+    def explain(self):
+        rows, source = self.plan()
+        return '{}: {} of {} rows'.format(source, len(rows),
+                                          len(self.table.rows))
+
+    def __iter__(self):
+        rows, source = self.plan()
+        checks = [(self.table.position(column), OPERATORS[op], value)
+                  for column, op, value in self.predicates]
+
+        if source == 'scan':
+            return self.table.rows.scan(checks)
+
+        return self.table.rows.fetch(rows, checks)
+
+    def all(self):
+        return list(self)
+
+    def first(self):
+        return next(iter(self), None)
+
+    def count(self):
+        return sum(1 for _ in self)
+
+class Table:
+    def __repr__(self):
+        return 'Table {0}:\n\n'.format(self.name) + \
+            '\n'.join([str(row) for row in self.rows])
+
+    def insert(self, values):
+        '''Append a row, unless it doesn't fit the schema, in which case it's
+        quietly dropped.'''
+
+        if len(values) != len(self.types) or \
+           not all(map(isinstance, values, self.types)):
+            return
+
+        row = len(self.rows)
+        if not self.rows.add(values):
+            return
+
+        for position, index in self.indexed:
+            index.add(values[position], row)
+
+    def load(self, columns):
+        '''Append whole columns of rows already known to fit the schema, like
+        the ones in a snapshot, without checking each row.'''
+
+        start = len(self.rows)
+        self.rows.load(columns)
+
+        for position, index in self.indexed:
+            index.add_many(columns[position], start)
+
+    def insert_many(self, rows):
+        '''Append `rows`, checking and storing them a column at a time, and
+        dropping the ones that don't fit the schema. Returns why each one
+        was dropped, by its position in `rows`.'''
+
+        # Each check is a pass over a whole column that only looks at rows
+        # one by one if something in it is wrong.
+        width = len(self.types)
+        reasons = {}
+        if set(map(len, rows)) - {width}:
+            for i in itertools.compress(range(len(rows)),
+                                        map(width.__ne__, map(len, rows))):
+                reasons[i] = 'expected {} values, got {}'.format(width,
+                                                                 len(rows[i]))
+
+        kept = [i for i in range(len(rows)) if i not in reasons] if reasons \
+            else range(len(rows))
+        if reasons:
+            rows = [rows[i] for i in kept]
+        columns = [list(map(operator.itemgetter(position), rows))
+                   for position in range(width)]
+
+        def drop(misfits):
+            '''Take the rows at `misfits` (positions in `columns`) out.'''
+
+            nonlocal kept, rows, columns
+            for i, reason in misfits.items():
+                reasons.setdefault(kept[i], reason)
+            keep = [True] * len(kept)
+            for i in misfits:
+                keep[i] = False
+            kept = list(itertools.compress(kept, keep))
+            rows = list(itertools.compress(rows, keep))
+            columns = [list(itertools.compress(column, keep))
+                       for column in columns]
+
+        misfits = {}
+        for (name, kind), column in zip(self.schema, columns):
+            types = list(map(type, column))
+            for found in set(types):
+                if issubclass(found, kind):
+                    continue
+                i = -1
+                for _ in range(types.count(found)):
+                    i = types.index(found, i + 1)
+                    misfits.setdefault(i, '{}: expected {}, got {}'.format(
+                        name, kind.__name__, found.__name__))
+        if misfits:
+            drop(misfits)
+
+        misfits = self.rows.misfits(columns)
+        if misfits:
+            drop(misfits)
+
+        if len(kept) > 0:
+            start = len(self.rows)
+            self.rows.add_many(rows, columns)
+            for position, index in self.indexed:
+                index.add_many(columns[position], start)
+
+        return reasons
+
+    def update_indexes(self):
+        for index in self.indexes.values():
+            index.update()
+
+    def position(self, column):
+        '''Where `column` is in a row.'''
+
+        try:
+            return self.positions[column]
+        except KeyError:
+            raise KeyError('{} has no column {!r}'.format(self.name, column)) \
+                from None
+
+    def __init__(self, name, schema, indexes=None, storage='rows'):
+        if storage not in STORAGE:
+            raise ValueError('Unknown storage {!r}; expected one of {}'.format(
+                storage, ', '.join(STORAGE)))
+
+        self.name = name
+        self.schema = schema
+        self.positions = {column: i for i, (column, _) in enumerate(schema)}
+        self.rows = STORAGE[storage](name, schema)
+        self.indexes = {}
+
+        for column, kind in (indexes or {}).items():
+            self.position(column)
+            if kind not in INDEXES:
+                raise ValueError('Unknown index {!r}; expected one of {}'.format(
+                    kind, ', '.join(INDEXES)))
+            self.indexes[column] = INDEXES[kind]()
+
+        # What `insert` checks, worked out once rather than for every row.
+        self.types = tuple(kind for _, kind in schema)
+        self.indexed = [(self.positions[column], index)
+                        for column, index in self.indexes.items()]
+
+Rejection = collections.namedtuple('Rejection',
+                                   'table position values reason')
+Rejection.__doc__ = '''A row that a commit dropped: its table, where it was
+among the rows committed, its values, and what was wrong with it.'''
+
+class Database:
+    def create(self, tablename, schema, indexes=None, storage='rows'):
+        self.tables[tablename] = Table(tablename, schema, indexes, storage)
+
+    def insert(self, tablename, values):
+        self.tables[tablename].insert(values)
+
+    def insert_many(self, pending):
+        '''Insert the (tablename, values) pairs in `pending` a table at a
+        time. Returns a `Rejection` for each one that didn't fit.'''
+
+        names = list(map(operator.itemgetter(0), pending))
+        rows = list(map(operator.itemgetter(1), pending))
+
+        if len(names) > 0 and names.count(names[0]) == len(names):
+            batches = {names[0]: (range(len(rows)), rows)}
+        else:
+            batches = {}
+            for position, name in enumerate(names):
+                batch = batches.setdefault(name, ([], []))
+                batch[0].append(position)
+                batch[1].append(rows[position])
+
+        rejected = []
+        for name, (positions, rows) in batches.items():
+            for i, reason in self.tables[name].insert_many(rows).items():
+                rejected.append(Rejection(name, positions[i], rows[i], reason))
+
+        rejected.sort(key=operator.attrgetter('position'))
+        return rejected
+
+    def update_indexes(self):
+        for table in self.tables.values():
+            table.update_indexes()
+
+    def __repr__(self):
+        return '\n\n'.join([str(v) for k, v in self.tables.items()])
+
+    def __init__(self):
+        self.tables = {}
+
+class Record:
+    '''A row waiting to be committed, with what `Engine.add` reads off a model
+    instance and nothing else.'''
+
+    __slots__ = ('__name__', '__values__')
+
+    def __init__(self, name, values):
+        self.__name__ = name
+        self.__values__ = values
+
+    def __repr__(self):
+        return '{}({})'.format(self.__name__, ', '.join(map(repr, self.__values__)))
+
+class Engine:
+    class MetadataClass(type):
+        __metadata__ = {}
+        __index_metadata__ = {}
+        __storage_metadata__ = {}
+
+        def __init__(cls, name, bases, dct):
+            if name not in cls.__metadata__ and name != 'Model':
+                cls.__metadata__[name] = [(k, v) for k, v in cls.__dict__.items() if k[0:2] != '__']
+                cls.__index_metadata__[name] = dict(dct.get('__indexes__', {}))
+                cls.__storage_metadata__[name] = dct.get('__storage__', 'rows')
+
+        def __call__(cls, *args, **kwargs):
+            # Models stored by column get a `Record`; the rest still get a
+            # class of their own per instance, as the notes build them.
+            if cls.__storage_metadata__.get(cls.__name__) == 'columns':
+                return Record(cls.__name__, list(args))
+
+            ret = type(cls.__name__, cls.__bases__, dict(cls.__dict__))
+            setattr(ret, '__values__', list(args))
+            return ret
+
+    class Model(metaclass=MetadataClass):
+        pass
+
+    def create_all(self):
+        for k, v in self.MetadataClass.__metadata__.items():
+            self.db.create(k, v, self.MetadataClass.__index_metadata__.get(k),
+                           self.MetadataClass.__storage_metadata__.get(k, 'rows'))
+
+    def commit(self):
+        '''Insert the added rows, a table at a time. Returns a `Rejection`
+        for each row that didn't fit its table, in the order they were
+        added.'''
+
+        rejected = self.db.insert_many(self.uncommitted)
+        self.uncommitted = []
+        self.db.update_indexes()
+        return rejected
+
+    def add(self, obj):
+        self.uncommitted.append((obj.__name__, obj.__values__))
+
+    def select(self, model):
+        '''A `Query` of the table for `model` (a model class or its name).'''
+
+        name = model if isinstance(model, str) else model.__name__
+        return Query(self.db.tables[name])
+
+    def __repr__(self):
+        return '{0}\n\nUncommitted transactions:\n\n{1}\n'.format(str(self.db), '\n'.join(['insert into {0} values ({1})'.format(name, values) for name, values in self.uncommitted]))
+
+    def __init__(self):
+        self.db = Database()
+        self.uncommitted = []